@@ -1,381 +1,1196 @@
-from supabase import create_client, Client
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Blueprint, render_template, request, jsonify, Response, stream_with_context, g, current_app
+from werkzeug.middleware.proxy_fix import ProxyFix
 import json
 import os
-from groq import Groq
 from dotenv import load_dotenv
-import qrcode
+from cliente_groq import ClienteGroqResiliente, Disjuntor, CircuitoAbertoErro
 from io import BytesIO
 import base64
-from collections import Counter
+import hashlib
+import itertools
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from pesquisa import IndicePesquisa, CAMPOS_PESQUISA, normalizar
+from facetas import IndiceFacetas, FACETAS, chave_faceta
+from semelhanca import IndiceSemelhanca, CAMPOS_SEMELHANCA, documento
+from sugestoes import IndiceSugestoes
+from estatisticas import EstatisticasCatalogo, CAMPOS_ESTATISTICAS, CONTADORES
+from contadores import BufferContadores
+from visitas import VisitasUnicas, criar_filtro_bots
+import atexit
+from cache import CacheLRU
+from json_incremental import ParserSeccoesJSON
+from tarefas import GestorTarefas, FilaCheiaErro
+from cache_geracoes import CacheGeracoes
+from seccoes import classificar_feedback, validar_seccoes
+from validacao import interpretar_json, validar_protocolo, FORMATO_SECCOES
+from transferencia import linhas_ndjson, importar_ndjson, chave_duplicado, Checkpoint
+from geracao_lote import ler_pedidos, BaldeTokens, executar_lote
+from armazenamento import ArmazenamentoSupabase, ArmazenamentoSQLite, ArmazenamentoComCache
+from registos import criar_registo, ler_registo, colunas_registo, migrar_registo, FORMATO_ATUAL
+import click
+import logging
+from metricas import RegistoMetricas, ChamadasMedidas
+from preguicoso import Preguicoso
+from respostas import Versoes, RespostaCodificada, negociar_codificacao
 
 # -----------------------------
 # Configuração
 # -----------------------------
 load_dotenv()
 
+# Logs com nível configurável (LOG_LEVEL), mensagens no formato "evento chave=valor"
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s"
+)
+log = logging.getLogger("portal")
+
+# Métricas em /metrics (formato Prometheus); se METRICAS_TOKEN existir, é exigido como Bearer
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN")
+metricas = RegistoMetricas()
+metrica_pedidos = metricas.histograma(
+    "portal_http_pedido_duracao_segundos",
+    "Duração dos pedidos HTTP até à resposta (sem o corpo em streaming)", ("rota", "metodo", "status")
+)
+metrica_dependencias = metricas.histograma(
+    "portal_dependencia_duracao_segundos",
+    "Duração das chamadas a armazenamento, Groq, QR Code e templates", ("dependencia", "operacao", "resultado")
+)
+metrica_groq_tokens = metricas.contador("portal_groq_tokens_total", "Tokens gastos no Groq", ("operacao", "tipo"))
+metrica_groq_repeticoes = metricas.contador(
+    "portal_groq_repeticoes_total", "Novas tentativas de pedidos ao Groq", ("operacao",)
+)
+metrica_qr = metricas.contador("portal_qr_codes_total", "QR Codes servidos, por origem", ("origem",))
+
+
+def _groq_terminado(operacao, duracao, resultado, uso):
+    metrica_dependencias.observar(duracao, dependencia="groq", operacao=operacao, resultado=resultado)
+    if uso is not None:
+        metrica_groq_tokens.incrementar(getattr(uso, "prompt_tokens", 0) or 0, operacao=operacao, tipo="prompt")
+        metrica_groq_tokens.incrementar(
+            getattr(uso, "completion_tokens", 0) or 0, operacao=operacao, tipo="completion"
+        )
+
+# Armazenamento: Supabase (por omissão) ou SQLite local com ARMAZENAMENTO=sqlite
+ARMAZENAMENTO = os.getenv("ARMAZENAMENTO", "supabase").lower()
+ARMAZENAMENTO_CACHE_TTL_SEGUNDOS = float(os.getenv("ARMAZENAMENTO_CACHE_TTL_SEGUNDOS", "30"))
+ARMAZENAMENTO_CACHE_ITENS = int(os.getenv("ARMAZENAMENTO_CACHE_ITENS", "2000"))
+
 # Supabase - USAR VARIÁVEIS DE AMBIENTE!
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "protocolos.db")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("❌ ERRO: SUPABASE_URL ou SUPABASE_KEY não encontradas!")
-    print("   Adiciona estas variáveis ao .env ou às Environment Variables do Render")
-    supabase = None
+
+def _criar_armazenamento():
+    if ARMAZENAMENTO == "sqlite":
+        backend = ArmazenamentoSQLite(SQLITE_PATH)
+        log.info("armazenamento sqlite caminho=%s", SQLITE_PATH)
+    else:
+        # Importado só aqui: o cliente do Supabase é pesado e só é preciso no primeiro pedido
+        from supabase import create_client
+        backend = ArmazenamentoSupabase(create_client(SUPABASE_URL, SUPABASE_KEY))
+        log.info("armazenamento supabase ligado")
+
+    # Cada chamada ao backend é medida (por baixo da cache: só conta o que vai mesmo à base de dados)
+    backend = ChamadasMedidas(backend, metrica_dependencias, dependencia=ARMAZENAMENTO)
+
+    # Cache de leitura com TTL (ARMAZENAMENTO_CACHE_TTL_SEGUNDOS=0 desativa)
+    if ARMAZENAMENTO_CACHE_TTL_SEGUNDOS > 0:
+        backend = ArmazenamentoComCache(
+            backend, ttl=ARMAZENAMENTO_CACHE_TTL_SEGUNDOS, max_itens=ARMAZENAMENTO_CACHE_ITENS
+        )
+    return backend
+
+
+# Clientes criados no primeiro uso, em cada worker (ver preguicoso.py)
+if ARMAZENAMENTO != "sqlite" and (not SUPABASE_URL or not SUPABASE_KEY):
+    log.error("SUPABASE_URL ou SUPABASE_KEY não encontradas: adiciona-as ao .env ou às Environment Variables do Render")
+    armazenamento = None
 else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase conectado!")
+    armazenamento = Preguicoso(_criar_armazenamento)
 
-# Groq
+# Groq (GROQ_BASE_URL permite apontar para o servidor falso em ferramentas/fake_groq.py)
 groq_api_key = os.getenv("GROQ_API_KEY")
+
+
+def _criar_groq():
+    from groq import Groq
+
+    # Retries, prazos e concorrência são geridos por ClienteGroqResiliente
+    return ClienteGroqResiliente(
+        Groq(api_key=groq_api_key, base_url=os.getenv("GROQ_BASE_URL") or None, max_retries=0),
+        timeout=float(os.getenv("GROQ_TIMEOUT_SEGUNDOS", "60")),
+        tentativas=int(os.getenv("GROQ_TENTATIVAS", "3")),
+        max_concorrencia=int(os.getenv("GROQ_MAX_CONCORRENCIA", "4")),
+        disjuntor=Disjuntor(
+            limite_falhas=int(os.getenv("GROQ_DISJUNTOR_FALHAS", "5")),
+            pausa=float(os.getenv("GROQ_DISJUNTOR_PAUSA_SEGUNDOS", "30"))
+        ),
+        ao_terminar=_groq_terminado,
+        ao_repetir=lambda operacao: metrica_groq_repeticoes.incrementar(operacao=operacao)
+    )
+
+
 if groq_api_key:
-    groq_client = Groq(api_key=groq_api_key)
-    print("✅ Groq API conectada!")
+    groq_client = Preguicoso(_criar_groq)
+    # Quota da conta Groq, usada pela geração em lote (flask --app app gerar-lote)
+    GROQ_TOKENS_POR_MINUTO = int(os.getenv("GROQ_TOKENS_POR_MINUTO", "6000"))
+    log.info("groq configurado")
 else:
-    print("❌ GROQ_API_KEY não encontrada!")
+    log.error("GROQ_API_KEY não encontrada")
     groq_client = None
-
-# Flask
-app = Flask(__name__)
+    GROQ_TOKENS_POR_MINUTO = 0
+
+# Rotas e comandos (registados na aplicação por create_app)
+portal = Blueprint("portal", __name__, cli_group=None)
+
+# Registos no formato compacto (ver registos.py); secções de texto a partir deste tamanho
+# são comprimidas (0 = nunca; o Postgres já comprime valores grandes em disco)
+REGISTOS_COMPRIMIR_BYTES = int(os.getenv("REGISTOS_COMPRIMIR_BYTES", "0"))
+
+# Listagem/pesquisa: colunas dos cartões (sem procedimento, quiz, segurança, etc.)
+COLUNAS_CARTAO = colunas_registo("id,titulo,resumo,autor,disciplinas,anos,gostos,nao_gostos,visualizacoes,created_at")
+LIMITE_PAGINA_PADRAO = 24
+LIMITE_PAGINA_MAXIMO = 100
+
+# Índice de pesquisa em memória (construído no arranque, atualizado ao guardar)
+COLUNAS_PESQUISA = colunas_registo("id,created_at,disciplinas,anos," + ",".join(CAMPOS_PESQUISA))
+PESQUISA_REINDEXAR_SEGUNDOS = int(os.getenv("PESQUISA_REINDEXAR_SEGUNDOS", "900"))
+indice_pesquisa = IndicePesquisa()
+# Filtros por disciplina/ano e respetivas contagens (construído e atualizado com o de pesquisa)
+indice_facetas = IndiceFacetas()
+
+# Protocolos semelhantes na página de cada protocolo: vizinhos pré-calculados, lidos de
+# SEMELHANCA_PATH (flask --app app reconstruir-semelhanca) e atualizados ao guardar. Sem
+# ficheiro, cada worker só calcula no arranque até SEMELHANCA_MAX_EM_FALTA protocolos
+SEMELHANCA_PATH = os.getenv("SEMELHANCA_PATH", "semelhanca.json")
+SEMELHANCA_MAX_EM_FALTA = int(os.getenv("SEMELHANCA_MAX_EM_FALTA", "500"))
+indice_semelhanca = IndiceSemelhanca(k=int(os.getenv("SEMELHANCA_VIZINHOS", "6")))
+_semelhanca_ficheiro_lido = None
+
+# Agregados do dashboard (mantidos em memória, reconstruídos periodicamente)
+COLUNAS_ESTATISTICAS = colunas_registo(",".join(CAMPOS_ESTATISTICAS))
+ESTATISTICAS_RECONSTRUIR_SEGUNDOS = int(os.getenv("ESTATISTICAS_RECONSTRUIR_SEGUNDOS", "900"))
+estatisticas = EstatisticasCatalogo(top_n=5, ultimos_n=5)
+_lock_estatisticas = threading.Lock()
+# Sugestões da caixa de pesquisa (títulos, autores, disciplinas), pesadas pela popularidade:
+# reconstruídas com as estatísticas, que já percorrem o catálogo com essas colunas
+SUGESTOES_LIMITE_MAXIMO = 20
+indice_sugestoes = IndiceSugestoes()
+
+# Contadores: incrementos acumulados em memória e descarregados em lote
+CONTADORES_INTERVALO_SEGUNDOS = float(os.getenv("CONTADORES_INTERVALO_SEGUNDOS", "5"))
+CONTADORES_LIMITE_LOTE = int(os.getenv("CONTADORES_LIMITE_LOTE", "200"))
+
+# Visualizações: em modo "unicas" cada visitante conta uma vez por protocolo a cada
+# VISITAS_JANELA_SEGUNDOS e bots/pré-visualizações de links não contam (VISITAS_BOTS_REGEX,
+# "" para desligar); "todas" conta cada pedido. A deduplicação é por worker, em memória fixa.
+# O visitante é um cookie próprio; sem ele, o IP dado pelo proxy de confiança + User-Agent
+VISITAS_MODO = os.getenv("VISITAS_MODO", "unicas")
+VISITAS_COOKIE = "visitante"
+VISITAS_COOKIE_DIAS = 365
+# Proxies à frente do portal (ex.: 1 no Render/Heroku): o IP do cliente é o que o último deles
+# acrescentou ao X-Forwarded-For, não o primeiro valor (esse é escolhido pelo cliente)
+PROXIES_CONFIAVEIS = int(os.getenv("PROXIES_CONFIAVEIS", "1"))
+visitas_unicas = VisitasUnicas(
+    janela=float(os.getenv("VISITAS_JANELA_SEGUNDOS", "1800")),
+    capacidade=int(os.getenv("VISITAS_CAPACIDADE", "100000")),
+    e_bot=criar_filtro_bots(os.getenv("VISITAS_BOTS_REGEX"))
+)
+
+# QR Codes: cache LRU em memória e, opcionalmente, em disco (QR_CACHE_DIR)
+QR_CACHE_ITENS = int(os.getenv("QR_CACHE_ITENS", "1024"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR")
+QR_MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+cache_qr = CacheLRU(max_itens=QR_CACHE_ITENS)
+
+# Páginas /protocolo/<id> renderizadas (sem contadores), com orçamento de memória
+PAGINAS_CACHE_MB = float(os.getenv("PAGINAS_CACHE_MB", "32"))
+cache_paginas = CacheLRU(max_bytes=int(PAGINAS_CACHE_MB * 1024 * 1024))
+
+# Respostas JSON (/search_protocols, /api/stats) por (rota, query, versões), já comprimidas;
+# o TTL apanha as alterações feitas noutros workers, que não mudam as versões deste
+VERSAO_CONTADORES_SEGUNDOS = float(os.getenv("VERSAO_CONTADORES_SEGUNDOS", "5"))
+RESPOSTAS_CACHE_MB = float(os.getenv("RESPOSTAS_CACHE_MB", "16"))
+RESPOSTAS_CACHE_TTL_SEGUNDOS = float(os.getenv("RESPOSTAS_CACHE_TTL_SEGUNDOS", "30"))
+versoes = Versoes(VERSAO_CONTADORES_SEGUNDOS)
+cache_respostas = CacheLRU(max_bytes=int(RESPOSTAS_CACHE_MB * 1024 * 1024), ttl=RESPOSTAS_CACHE_TTL_SEGUNDOS)
+
+# Tarefas de geração: pool limitado, fora dos workers web; o estado fica no armazenamento
+# (tabela tarefas, sql/tarefas.sql) para que qualquer worker responda a GET /api/jobs/<id>
+gestor_tarefas = GestorTarefas(
+    max_workers=int(os.getenv("TAREFAS_WORKERS", "4")),
+    max_pendentes=int(os.getenv("TAREFAS_MAX_PENDENTES", "20")),
+    timeout=int(os.getenv("TAREFAS_TIMEOUT_SEGUNDOS", "180")),
+    expiracao=int(os.getenv("TAREFAS_EXPIRACAO_SEGUNDOS", "3600")),
+    registo=armazenamento
+)
+
+# Gerações em streaming: cada uma ocupa uma thread web durante toda a chamada ao Groq. Acima
+# deste limite a resposta é 503 imediato e a página passa a usar /api/jobs/generate
+GERACAO_STREAMS_MAX = int(os.getenv("GERACAO_STREAMS_MAX", "2"))
+_vagas_streams = threading.BoundedSemaphore(GERACAO_STREAMS_MAX)
+
+# Cache de gerações (SQLite): pedidos iguais não voltam a gastar quota do Groq
+cache_geracoes = Preguicoso(lambda: CacheGeracoes(
+    os.getenv("GERACOES_CACHE_PATH", "cache_geracoes.db"),
+    ttl=int(float(os.getenv("GERACOES_CACHE_TTL_HORAS", "168")) * 3600),
+    max_entradas=int(os.getenv("GERACOES_CACHE_MAX_ENTRADAS", "2000"))
+))
+
+# Estado interno lido no momento de cada recolha de /metrics
+metricas.medidor("portal_tarefas_ativas", "Tarefas de geração pendentes ou em execução", gestor_tarefas.profundidade)
+metricas.medidor("portal_indice_pesquisa_protocolos", "Protocolos no índice de pesquisa", lambda: len(indice_pesquisa))
+metricas.medidor(
+    "portal_cache_itens", "Itens nas caches em memória",
+    lambda: {("paginas",): len(cache_paginas), ("qr",): len(cache_qr), ("respostas",): len(cache_respostas)},
+    ("cache",)
+)
+metricas.medidor("portal_cache_paginas_bytes", "Bytes de HTML na cache de páginas", lambda: cache_paginas.bytes)
+metricas.medidor(
+    "portal_visualizacoes_total", "Visualizações de protocolos, por resultado da deduplicação",
+    lambda: {("unica",): visitas_unicas.unicas, ("repetida",): visitas_unicas.repetidas, ("bot",): visitas_unicas.bots},
+    ("resultado",), "counter"
+)
+# (sem forçar a criação dos clientes: um scrape não deve abrir ligações)
+metricas.medidor(
+    "portal_cache_geracoes_total", "Consultas à cache de gerações",
+    lambda: {("acerto",): cache_geracoes.acertos, ("falha",): cache_geracoes.falhas} if cache_geracoes.pronto else {},
+    ("resultado",), "counter"
+)
+if armazenamento and ARMAZENAMENTO_CACHE_TTL_SEGUNDOS > 0:
+    metricas.medidor(
+        "portal_armazenamento_cache_total", "Leituras servidas pela cache de armazenamento",
+        lambda: {("acerto",): armazenamento.acertos, ("falha",): armazenamento.falhas,
+                 ("obsoleto",): armazenamento.obsoletos} if armazenamento.pronto else {},
+        ("resultado",), "counter"
+    )
+if groq_client:
+    metricas.medidor(
+        "portal_groq_disjuntor_estado", "Estado do disjuntor do Groq (1 no estado atual)",
+        lambda: {(estado,): int(groq_client.disjuntor.estado == estado)
+                 for estado in (Disjuntor.FECHADO, Disjuntor.SEMI_ABERTO, Disjuntor.ABERTO)}
+        if groq_client.pronto else {},
+        ("estado",)
+    )
 
 
 # -----------------------------
-# Funções Supabase
+# Funções de armazenamento
 # -----------------------------
+def guardar_protocolo_completo(protocolo: dict):
+    """Guarda um protocolo (gerado ou editado) e atualiza páginas, índice e estatísticas; retorna o ID"""
+    # Registo no formato compacto: secções com tipos nativos num único documento
+    registro = criar_registo(protocolo, REGISTOS_COMPRIMIR_BYTES)
+    registro.update({"gostos": 0, "nao_gostos": 0, "visualizacoes": 0})
+
+    log.debug("registo preparado campos=%s", list(registro.keys()))
+    
+    protocol_id = guardar_protocolo(registro)
+    if protocol_id:
+        invalidar_pagina_protocolo(protocol_id)
+        protocolo_guardado = {
+            **ler_registo(registro),
+            "id": protocol_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        indice_pesquisa.adicionar(protocolo_guardado)
+        indice_facetas.adicionar(protocolo_guardado)
+        # Páginas cuja lista de protocolos semelhantes mudou
+        for id in indice_semelhanca.adicionar(protocolo_guardado):
+            invalidar_pagina_protocolo(id)
+        estatisticas.registar_protocolo(protocolo_guardado)
+        indice_sugestoes.adicionar(protocolo_guardado)
+        # Só depois de todos os índices: uma resposta gerada com os antigos ficaria em cache
+        # (e com ETag) sob a nova versão
+        versoes.alterar_catalogo()
+    return protocol_id
+
+
 def guardar_protocolo(protocolo: dict):
-    """Guarda um protocolo no Supabase e retorna o ID"""
-    if not supabase:
-        print("❌ Supabase não inicializado")
+    """Guarda um protocolo e retorna o ID"""
+    if not armazenamento:
+        log.error("armazenamento não inicializado")
         return None
     try:
-        print(f"📤 A enviar para Supabase: {list(protocolo.keys())}")
-        response = supabase.table("protocolos").insert(protocolo).execute()
-        print(f"📥 Resposta Supabase: {response}")
-        if response.data:
-            print(f"✅ Protocolo guardado com ID: {response.data[0]['id']}")
-            return response.data[0]["id"]
-        print(f"⚠️ Resposta sem dados: {response}")
+        id = armazenamento.inserir(protocolo)
+        if id:
+            log.info("protocolo guardado id=%s", id)
+            return id
+        log.warning("insercao sem id devolvido")
         return None
     except Exception as e:
-        print(f"❌ Erro ao guardar protocolo: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("erro ao guardar protocolo erro=%s: %s", type(e).__name__, e)
         return None
 
 
-def listar_protocolos(limite=None):
-    """Lista protocolos ordenados por data de criação"""
-    if not supabase:
-        return []
+class CursorInvalidoErro(ValueError):
+    """O cursor recebido não foi gerado por este portal (ou foi alterado pelo cliente)"""
+
+
+# Os cursores levam o tipo: "k" = chave (created_at, id) do armazenamento, "p" = posição nos
+# resultados do índice. Entre duas páginas o índice pode ficar pronto e a pesquisa mudar de
+# modo; um cursor do outro tipo é recusado em vez de ser lido como "sem cursor" (página 1)
+def _codificar(tipo, valor):
+    return base64.urlsafe_b64encode(json.dumps({tipo: valor}).encode()).decode()
+
+
+def _descodificar(cursor, tipo):
     try:
-        query = supabase.table("protocolos").select("*").order("created_at", desc=True)
-        if limite:
-            query = query.limit(limite)
-        response = query.execute()
-        return response.data if response.data else []
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())[tipo]
     except Exception as e:
-        print(f"❌ Erro ao listar protocolos: {e}")
-        return []
+        raise CursorInvalidoErro("Cursor inválido") from e
+
+
+def codificar_cursor(protocolo: dict):
+    """Codifica o cursor (created_at, id) do último protocolo de uma página"""
+    return _codificar("k", [protocolo.get("created_at"), protocolo.get("id")])
+
+
+def descodificar_cursor(cursor):
+    """Descodifica um cursor, retornando (created_at, id) ou None se não houver cursor
+
+    O cursor vem do cliente e acaba num filtro do PostgREST: só passa um created_at que seja
+    uma data ISO válida e um id inteiro, senão lança CursorInvalidoErro.
+    """
+    if not cursor:
+        return None
+    try:
+        created_at, id = _descodificar(cursor, "k")
+        datetime.fromisoformat(created_at)
+    except Exception as e:
+        raise CursorInvalidoErro("Cursor inválido") from e
+    if not isinstance(id, int) or isinstance(id, bool):
+        raise CursorInvalidoErro("Cursor inválido")
+    return created_at, id
+
+
+def _paginar(linhas, limite):
+    """Separa a linha extra pedida ao armazenamento e calcula o cursor da página seguinte"""
+    if limite and len(linhas) > limite:
+        linhas = linhas[:limite]
+        return linhas, codificar_cursor(linhas[-1])
+    return linhas, None
+
+
+def listar_pagina_protocolos(limite=None, cursor=None, colunas=COLUNAS_CARTAO):
+    """Lista uma página de protocolos, retornando (protocolos, próximo cursor)"""
+    if not armazenamento:
+        return [], None
+    try:
+        return _consultar_pagina(limite, cursor, colunas)
+    except CursorInvalidoErro:
+        raise
+    except Exception as e:
+        log.error("erro ao listar protocolos erro=%s", e)
+        return [], None
+
+
+def _consultar_pagina(limite, cursor, colunas, origem=None):
+    # Pedir uma linha a mais para saber se existe página seguinte
+    linhas = (origem or armazenamento).consultar_pagina(
+        limite + 1 if limite else None, descodificar_cursor(cursor), colunas
+    )
+    return _paginar([ler_registo(linha) for linha in linhas], limite)
 
 
 def obter_protocolo_por_id(id: int):
     """Obtém um protocolo específico pelo ID"""
-    if not supabase:
+    if not armazenamento:
         return None
     try:
-        response = supabase.table("protocolos").select("*").eq("id", id).single().execute()
-        return response.data
+        return ler_registo(armazenamento.obter(id))
     except Exception as e:
-        print(f"❌ Erro ao obter protocolo {id}: {e}")
+        log.error("erro ao obter protocolo id=%s erro=%s", id, e)
         return None
 
 
-def pesquisar_protocolos(termo: str):
-    """Pesquisa protocolos por título, resumo ou autor"""
-    if not supabase:
+def iterar_protocolos(colunas="*", lote=500, cursor=None):
+    """Percorre o catálogo (a partir do cursor) em lotes keyset, sem o carregar de uma vez em memória"""
+    # Leitura sequencial de todo o catálogo: sem passar pela cache de leitura
+    origem = getattr(armazenamento, "backend", armazenamento)
+    while origem:
+        # Erros propagam-se: um catálogo parcial não deve passar por completo
+        protocolos, cursor = _consultar_pagina(lote, cursor, colunas, origem)
+        yield from protocolos
+        if not cursor:
+            break
+
+
+def obter_protocolos_por_ids(ids, colunas=COLUNAS_CARTAO):
+    """Obtém vários protocolos pelo ID, mantendo a ordem dos IDs pedidos"""
+    if not armazenamento or not ids:
+        return []
+    try:
+        por_id = {p["id"]: ler_registo(p) for p in armazenamento.obter_varios(ids, colunas)}
+        return [por_id[id] for id in ids if id in por_id]
+    except Exception as e:
+        log.error("erro ao obter protocolos ids=%s erro=%s", ids, e)
         return []
+
+
+def construir_indice_pesquisa():
+    """(Re)constrói o índice de pesquisa a partir do catálogo completo"""
+    if not armazenamento:
+        return
+    try:
+        inicio = time.time()
+        # Uma só passagem pelo catálogo para todos os índices (facetas e semelhança guardam pouco);
+        # facetas e semelhança só recebem os dados no fim e têm de guardar já o que for adicionado
+        indice_facetas.iniciar_reconstrucao()
+        indice_semelhanca.iniciar_reconstrucao()
+        facetas = []
+        documentos = []
+        def protocolos():
+            for protocolo in iterar_protocolos(COLUNAS_PESQUISA):
+                facetas.append({campo: protocolo.get(campo) for campo in ("id", "created_at", *FACETAS)})
+                documentos.append(documento(protocolo))
+                yield protocolo
+        indice_pesquisa.reconstruir(protocolos())
+        indice_facetas.reconstruir(facetas)
+        atualizar_semelhanca(documentos)
+        versoes.alterar_catalogo()
+        log.info("indice de pesquisa construido protocolos=%d duracao=%.1fs", len(indice_pesquisa), time.time() - inicio)
+    except Exception as e:
+        log.error("erro ao construir indice de pesquisa erro=%s", e)
+
+
+def atualizar_semelhanca(documentos):
+    """Reconstrói os vetores de semelhança e completa os vizinhos em falta (ficheiro ou cálculo)"""
+    global _semelhanca_ficheiro_lido
+    indice_semelhanca.reconstruir(documentos)
+    try:
+        modificado = os.path.getmtime(SEMELHANCA_PATH)
+    except OSError:
+        modificado = None
+    if modificado and modificado != _semelhanca_ficheiro_lido and indice_semelhanca.carregar(SEMELHANCA_PATH):
+        _semelhanca_ficheiro_lido = modificado
+        log.info("vizinhos de semelhanca carregados caminho=%s", SEMELHANCA_PATH)
+    em_falta = len(indice_semelhanca.em_falta())
+    if em_falta > SEMELHANCA_MAX_EM_FALTA:
+        log.warning("semelhanca sem vizinhos protocolos=%d corre flask --app app reconstruir-semelhanca", em_falta)
+    elif em_falta:
+        inicio = time.time()
+        indice_semelhanca.calcular_em_falta()
+        log.info("vizinhos de semelhanca calculados protocolos=%d duracao=%.1fs", em_falta, time.time() - inicio)
+    # As páginas em cache foram renderizadas com as listas anteriores
+    cache_paginas.limpar()
+
+
+def reconstruir_estatisticas():
+    """Recalcula de raiz os agregados do dashboard"""
+    if not armazenamento:
+        return
+    try:
+        inicio = time.time()
+        protocolos = []
+        # Sem descargas durante a leitura, a base de dados + o instantâneo dos pendentes tiram
+        # todos os incrementos anteriores ao início; os seguintes são reaplicados pelas
+        # estatísticas (lê-los também das linhas contá-los-ia duas vezes)
+        with buffer_contadores.descarga_suspensa():
+            with _lock_incrementos:
+                estatisticas.iniciar_reconstrucao()
+                pendentes = buffer_contadores.instantaneo()
+            # As sugestões só recebem os protocolos no fim: guardar já o que for adicionado
+            indice_sugestoes.iniciar_reconstrucao()
+            def percorrer():
+                for protocolo in iterar_protocolos(COLUNAS_ESTATISTICAS):
+                    for campo, delta in pendentes.get(protocolo.get("id"), {}).items():
+                        protocolo[campo] = (protocolo.get(campo) or 0) + delta
+                    protocolos.append(protocolo)
+                    yield protocolo
+            estatisticas.reconstruir(percorrer())
+        indice_sugestoes.reconstruir(protocolos)
+        versoes.alterar_catalogo()
+        log.info("estatisticas reconstruidas protocolos=%d duracao=%.1fs", estatisticas.resumo()["total_protocolos"], time.time() - inicio)
+    except Exception as e:
+        log.error("erro ao reconstruir estatisticas erro=%s", e)
+
+
+def _em_segundo_plano(funcao):
+    threading.Thread(target=funcao, daemon=True).start()
+
+
+def _codificar_posicao(posicao):
+    return _codificar("p", posicao)
+
+
+def _descodificar_posicao(cursor):
+    posicao = _descodificar(cursor, "p")
+    if not isinstance(posicao, int) or isinstance(posicao, bool) or posicao < 0:
+        raise CursorInvalidoErro("Cursor inválido")
+    return posicao
+
+
+def _reindexar_se_antigo():
+    # Outros workers podem ter guardado protocolos entretanto
+    if indice_pesquisa.pronto and time.time() - indice_pesquisa.construido_em > PESQUISA_REINDEXAR_SEGUNDOS:
+        indice_pesquisa.construido_em = time.time()
+        _em_segundo_plano(construir_indice_pesquisa)
+
+
+def relevancia(termo: str):
+    """IDs por relevância e o respetivo conjunto no índice de facetas, ou None sem termo ou sem índices
+
+    A pesquisa BM25 é o passo caro: calculada uma vez por pedido e passada aos resultados e às contagens.
+    """
+    if not termo or not indice_pesquisa.pronto or not indice_facetas.pronto:
+        return None
+    ordem = [id for id, _ in indice_pesquisa.pesquisar(termo)]
+    return ordem, indice_facetas.conjunto(ordem)
+
+
+def pesquisar_protocolos(termo: str, limite=None, cursor=None, colunas=COLUNAS_CARTAO, pesquisa=None):
+    """Pesquisa protocolos por relevância, retornando (protocolos, próximo cursor)
+
+    `pesquisa` é o resultado de relevancia(termo), se já tiver sido calculado.
+    """
+    if not indice_pesquisa.pronto:
+        return pesquisar_protocolos_texto(termo, limite, cursor, colunas)
+
+    _reindexar_se_antigo()
+    ids = pesquisa[0] if pesquisa else [id for id, _ in indice_pesquisa.pesquisar(termo)]
+    inicio = _descodificar_posicao(cursor) if cursor else 0
+    fim = inicio + limite if limite else len(ids)
+    proximo_cursor = _codificar_posicao(fim) if fim < len(ids) else None
+    return obter_protocolos_por_ids(ids[inicio:fim], colunas), proximo_cursor
+
+
+def pesquisar_protocolos_texto(termo: str, limite=None, cursor=None, colunas=COLUNAS_CARTAO):
+    """Pesquisa por título, resumo ou autor diretamente no armazenamento (enquanto o índice não está pronto)"""
+    if not armazenamento:
+        return [], None
     try:
-        response = supabase.table("protocolos").select("*").or_(
-            f"titulo.ilike.%{termo}%,resumo.ilike.%{termo}%,autor.ilike.%{termo}%"
-        ).order("created_at", desc=True).execute()
-        return response.data if response.data else []
+        linhas = armazenamento.pesquisar_texto(
+            termo, limite + 1 if limite else None, descodificar_cursor(cursor), colunas
+        )
+        return _paginar([ler_registo(linha) for linha in linhas], limite)
+    except CursorInvalidoErro:
+        raise
     except Exception as e:
-        print(f"❌ Erro ao pesquisar: {e}")
-        # Fallback: buscar tudo e filtrar em Python
-        protocolos = listar_protocolos()
+        log.warning("erro ao pesquisar no armazenamento erro=%s a filtrar em python", e)
+        # Fallback: percorrer o catálogo em lotes e filtrar em Python, só até encher a página
         termo_lower = termo.lower()
-        return [
-            p for p in protocolos
+        encontrados = (
+            p for p in iterar_protocolos(colunas, cursor=cursor)
             if termo_lower in (p.get("titulo") or "").lower()
             or termo_lower in (p.get("resumo") or "").lower()
             or termo_lower in (p.get("autor") or "").lower()
-        ]
+        )
+        try:
+            return _paginar(list(itertools.islice(encontrados, limite + 1 if limite else None)), limite)
+        except CursorInvalidoErro:
+            raise
+        except Exception as e:
+            log.error("erro ao pesquisar erro=%s", e)
+            return [], None
+
+
+def _corresponde_filtros(protocolo, filtros):
+    for faceta, valores in filtros.items():
+        chaves = {chave_faceta(v) for v in protocolo.get(FACETAS[faceta]) or []}
+        if not chaves & {chave_faceta(v) for v in valores}:
+            return False
+    return True
+
+
+def pesquisar_por_facetas(termo: str, filtros: dict, limite=None, cursor=None, colunas=COLUNAS_CARTAO,
+                          pesquisa=None):
+    """Pesquisa (opcional) combinada com filtros {faceta: [valores]}, retornando (protocolos, próximo cursor)
+
+    Com os índices prontos, filtra e ordena em memória (relevância se houver termo, senão os
+    mais recentes primeiro); caso contrário percorre o catálogo até encher a página.
+    `pesquisa` é o resultado de relevancia(termo), se já tiver sido calculado.
+    """
+    if indice_facetas.pronto and (not termo or indice_pesquisa.pronto):
+        _reindexar_se_antigo()
+        if termo:
+            ordem, base = pesquisa or relevancia(termo)
+            ids = indice_facetas.ids(indice_facetas.filtrar(filtros, base), ordem)
+        else:
+            ids = indice_facetas.ids(indice_facetas.filtrar(filtros))
+        inicio = _descodificar_posicao(cursor) if cursor else 0
+        fim = inicio + limite if limite else len(ids)
+        proximo_cursor = _codificar_posicao(fim) if fim < len(ids) else None
+        return obter_protocolos_por_ids(ids[inicio:fim], colunas), proximo_cursor
+
+    termo_normalizado = normalizar(termo)
+    encontrados = (
+        p for p in iterar_protocolos(colunas, cursor=cursor)
+        if _corresponde_filtros(p, filtros) and (
+            not termo
+            or any(termo_normalizado in normalizar(p.get(campo)) for campo in ("titulo", "resumo", "autor"))
+        )
+    )
+    try:
+        return _paginar(list(itertools.islice(encontrados, limite + 1 if limite else None)), limite)
+    except CursorInvalidoErro:
+        raise
+    except Exception as e:
+        log.error("erro ao filtrar protocolos erro=%s", e)
+        return [], None
+
+
+def contar_facetas(termo: str, filtros: dict, pesquisa=None):
+    """Contagens por disciplina e ano no resultado atual (None enquanto o índice não está pronto)
+
+    `pesquisa` é o resultado de relevancia(termo), se já tiver sido calculado.
+    """
+    if not indice_facetas.pronto or (termo and not indice_pesquisa.pronto):
+        return None
+    base = (pesquisa or relevancia(termo))[1] if termo else indice_facetas.todos
+    return indice_facetas.contar(base, filtros)
+
+
+def aplicar_incrementos(incrementos: dict):
+    """Aplica um lote {id: {campo: delta}} de incrementos numa única chamada atómica"""
+    if not armazenamento:
+        raise RuntimeError("Armazenamento não inicializado")
+    armazenamento.incrementar([
+        {"id": id, **{campo: deltas.get(campo, 0) for campo in CONTADORES}}
+        for id, deltas in incrementos.items()
+    ])
+
+
+buffer_contadores = BufferContadores(
+    aplicar_incrementos, CONTADORES_INTERVALO_SEGUNDOS, CONTADORES_LIMITE_LOTE
+)
+
+
+# Buffer e agregados mudam juntos: uma reconstrução das estatísticas vê cada incremento
+# ou no instantâneo do buffer ou nos eventos a reaplicar, nunca nos dois
+_lock_incrementos = threading.Lock()
 
 
 def incrementar_contador(id: int, campo: str):
-    """Incrementa um contador (gostos, nao_gostos, visualizacoes)"""
-    if not supabase:
-        return False
-    try:
-        # Primeiro buscar valor atual
-        protocolo = obter_protocolo_por_id(id)
-        if not protocolo:
-            return False
-        
-        valor_atual = protocolo.get(campo, 0) or 0
-        novo_valor = valor_atual + 1
-        
-        # Atualizar
-        response = supabase.table("protocolos").update({campo: novo_valor}).eq("id", id).execute()
-        return response.data is not None
-    except Exception as e:
-        print(f"❌ Erro ao incrementar {campo}: {e}")
+    """Incrementa um contador (gostos, nao_gostos, visualizacoes) via buffer write-behind"""
+    if not armazenamento or campo not in CONTADORES:
         return False
+    with _lock_incrementos:
+        buffer_contadores.incrementar(id, campo)
+        estatisticas.registar_incremento(id, campo)
+    versoes.alterar_contadores()
+    return True
+
+
+def registar_visualizacao(id: int, resposta):
+    """Conta a visualização do pedido atual se for única na janela (ou sempre, em VISITAS_MODO=todas)
+
+    Dá o cookie de visitante a quem ainda não o tem (na resposta indicada).
+    """
+    if VISITAS_MODO == "todas":
+        return incrementar_contador(id, "visualizacoes")
+    user_agent = request.headers.get("User-Agent", "")
+    visitante = request.cookies.get(VISITAS_COOKIE, "")[:64]
+    if visitante:
+        contar = visitas_unicas.registar(f"c:{visitante}", id, user_agent)
+    else:
+        # Primeira visita ou cliente sem cookies: IP (ProxyFix) + User-Agent. Alunos atrás do
+        # mesmo NAT com telemóveis iguais não contam aqui, mas sim no pedido seguinte da
+        # página (contadores), que já traz o cookie
+        contar = visitas_unicas.registar(f"ip:{request.remote_addr}|{user_agent}", id, user_agent)
+        visitante = secrets.token_urlsafe(16)
+        if contar:
+            visitas_unicas.marcar(f"c:{visitante}", id)
+        resposta.set_cookie(
+            VISITAS_COOKIE, visitante, max_age=VISITAS_COOKIE_DIAS * 86400,
+            httponly=True, samesite="Lax", secure=request.is_secure
+        )
+    return incrementar_contador(id, "visualizacoes") if contar else False
+
+
+def obter_contadores(id: int):
+    """Contadores atuais de um protocolo (agregados em memória ou BD + pendentes), ou None se não existir"""
+    contadores = estatisticas.contadores(id)
+    if contadores is not None:
+        return contadores
+    protocolo = obter_protocolo_por_id(id)
+    if not protocolo:
+        return None
+    buffer_contadores.aplicar_pendentes(protocolo)
+    return {campo: protocolo.get(campo) or 0 for campo in CONTADORES}
 
 
 # -----------------------------
 # Funções Auxiliares
 # -----------------------------
-def gerar_qr_code(url):
-    """Gera QR Code em base64"""
+def _renderizar_qr_code(url, formato):
+    # qrcode/PIL só são importados quando é preciso gerar um QR Code novo
+    import qrcode
+    import qrcode.image.svg
+
     qr = qrcode.QRCode(version=1, box_size=10, border=2)
     qr.add_data(url)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
     buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
-
-
-def to_string(value):
-    """Converte valor para string, juntando listas com newlines"""
-    if isinstance(value, list):
-        return "\n".join(str(v) for v in value)
-    return str(value) if value else ""
-
-
-def parse_json_field(value, default=None):
-    """Parse de campo JSON/TEXT, retornando default se falhar"""
-    if default is None:
-        default = {}
-    if value is None:
-        return default
-    if isinstance(value, (dict, list)):
-        return value
-    if isinstance(value, str):
+    if formato == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffered)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def gerar_qr_code(url, formato="png"):
+    """Gera QR Code (bytes PNG ou SVG), com cache em memória e opcionalmente em disco"""
+    chave = (url, formato)
+    conteudo = cache_qr.obter(chave)
+    if conteudo is not None:
+        metrica_qr.incrementar(origem="memoria")
+        return conteudo
+    
+    caminho = None
+    if QR_CACHE_DIR:
+        nome = hashlib.sha256(url.encode()).hexdigest()
+        caminho = os.path.join(QR_CACHE_DIR, f"{nome}.{formato}")
         try:
-            return json.loads(value)
-        except:
-            return default
-    return default
+            with open(caminho, "rb") as f:
+                conteudo = f.read()
+        except OSError:
+            pass
+    
+    if conteudo is not None:
+        metrica_qr.incrementar(origem="disco")
+    else:
+        metrica_qr.incrementar(origem="gerado")
+        with metrica_dependencias.cronometrar(dependencia="qrcode", operacao=formato):
+            conteudo = _renderizar_qr_code(url, formato)
+        if caminho:
+            try:
+                os.makedirs(QR_CACHE_DIR, exist_ok=True)
+                with open(caminho, "wb") as f:
+                    f.write(conteudo)
+            except OSError as e:
+                log.warning("nao foi possivel guardar qr code em disco erro=%s", e)
+    
+    cache_qr.guardar(chave, conteudo)
+    return conteudo
 
 
-def preparar_protocolo_para_template(protocolo):
-    """Prepara um protocolo da BD para ser usado no template"""
+def obter_pagina_protocolo(id: int):
+    """Retorna (versão, HTML) da página do protocolo, renderizando-a apenas se não estiver em cache"""
+    pagina = cache_paginas.obter(id)
+    if pagina is not None:
+        return pagina
+    
+    protocolo = obter_protocolo_por_id(id)
     if not protocolo:
         return None
     
-    # Parse campos que podem ser JSON em formato texto
-    protocolo["disciplinas"] = parse_json_field(protocolo.get("disciplinas"), [])
-    protocolo["anos"] = parse_json_field(protocolo.get("anos"), [])
-    protocolo["seguranca"] = parse_json_field(protocolo.get("seguranca_json") or protocolo.get("seguranca"), {})
-    protocolo["quiz"] = parse_json_field(protocolo.get("quiz_json") or protocolo.get("quiz"), [])
-    protocolo["diferenciacao"] = parse_json_field(protocolo.get("diferenciacao_json"), {})
-    protocolo["competencias"] = parse_json_field(protocolo.get("competencias"), [])
-    protocolo["objetivos"] = parse_json_field(protocolo.get("objetivos"), [])
+    # Contadores e QR Code são servidos por rotas próprias
+    html = renderizar("protocolo.html", protocolo=protocolo, relacionados=indice_semelhanca.vizinhos(id)).encode()
     
-    return protocolo
+    pagina = (hashlib.sha1(html).hexdigest(), html)
+    cache_paginas.guardar(id, pagina, tamanho=len(html))
+    return pagina
+
+
+def renderizar(template, **contexto):
+    """render_template com a duração registada nas métricas"""
+    with metrica_dependencias.cronometrar(dependencia="jinja", operacao=template):
+        return render_template(template, **contexto)
+
+
+def resposta_json_versionada(gerar):
+    """JSON de gerar() em cache por (rota, query, versões), com ETag forte, 304 e compressão negociada"""
+    # Versões lidas antes de gerar: uma escrita a meio muda a chave do pedido seguinte
+    chave = (request.endpoint, request.query_string, versoes.catalogo, versoes.contadores)
+    entrada = cache_respostas.obter(chave)
+    if entrada is None:
+        entrada = RespostaCodificada(current_app.json.dumps(gerar()).encode())
+        # Conta com uma variante comprimida além do corpo original
+        cache_respostas.guardar(chave, entrada, tamanho=2 * entrada.tamanho)
+    
+    corpo, etag, codificacao = entrada.variante(negociar_codificacao(request.headers.get("Accept-Encoding")))
+    resposta = Response(corpo, mimetype="application/json")
+    resposta.set_etag(etag)
+    resposta.headers["Cache-Control"] = "no-cache"
+    resposta.headers["Vary"] = "Accept-Encoding"
+    if codificacao != "identity":
+        resposta.headers["Content-Encoding"] = codificacao
+    return resposta.make_conditional(request)
+
+
+def invalidar_pagina_protocolo(id: int):
+    """Descarta a página em cache de um protocolo cujo conteúdo mudou"""
+    cache_paginas.remover(id)
+
+
+def evento_sse(evento, dados):
+    """Formata um evento Server-Sent Events com dados em JSON"""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
 
 
 # -----------------------------
 # Rotas Flask
 # -----------------------------
-@app.route("/")
+@portal.before_app_request
+def _iniciar_cronometro():
+    g.inicio_pedido = time.perf_counter()
+
+
+@portal.after_app_request
+def _registar_pedido(response):
+    inicio = g.pop("inicio_pedido", None)
+    if inicio is not None:
+        metrica_pedidos.observar(
+            time.perf_counter() - inicio,
+            rota=request.url_rule.rule if request.url_rule else "(sem rota)",
+            metodo=request.method,
+            status=response.status_code
+        )
+    return response
+
+
+@portal.route("/metrics")
+def metrics():
+    """Métricas no formato de texto do Prometheus"""
+    if METRICAS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICAS_TOKEN}":
+        return Response("Não autorizado\n", status=401, mimetype="text/plain")
+    return Response(
+        metricas.exportar(),
+        mimetype="text/plain; version=0.0.4; charset=utf-8",
+        headers={"Cache-Control": "no-store"}
+    )
+
+
+@portal.route("/healthz")
+def healthz():
+    """Liveness: o processo responde (sem tocar em dependências)"""
+    return jsonify({"status": "ok"})
+
+
+@portal.route("/readyz")
+def readyz():
+    """Readiness: o armazenamento responde; o índice e o Groq são informativos"""
+    estado = {
+        "armazenamento": "nao_configurado",
+        "groq": "configurado" if groq_client else "nao_configurado",
+        "indice_pesquisa": "pronto" if indice_pesquisa.pronto else "a_construir",
+    }
+    pronto = False
+    if armazenamento:
+        try:
+            armazenamento.consultar_pagina(1, None, "id")
+            estado["armazenamento"] = "ok"
+            pronto = True
+        except Exception as e:
+            log.warning("readyz armazenamento indisponivel erro=%s", e)
+            estado["armazenamento"] = "indisponivel"
+    resposta = jsonify({"status": "ok" if pronto else "erro", **estado})
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta, 200 if pronto else 503
+
+
+@portal.route("/")
 def index():
-    return render_template("index.html")
+    return renderizar("index.html")
 
 
-@app.route("/gerar")
+@portal.route("/gerar")
 def gerar():
-    return render_template("gerar_protocolo.html")
+    return renderizar("gerar_protocolo.html")
 
 
-@app.route("/consultar")
+@portal.route("/consultar")
 def consultar():
-    return render_template("consultar_protocolos.html")
+    return renderizar("consultar_protocolos.html")
 
 
-@app.route("/api/stats")
+@portal.route("/api/stats")
 def get_stats():
     """Endpoint para dashboard de estatísticas"""
     try:
-        protocolos = listar_protocolos()
-        
-        total = len(protocolos)
-        total_views = sum(p.get("visualizacoes", 0) or 0 for p in protocolos)
-        
-        # Top 5 mais populares
-        mais_populares = sorted(
-            protocolos, 
-            key=lambda x: (x.get("gostos", 0) or 0, x.get("visualizacoes", 0) or 0), 
-            reverse=True
-        )[:5]
-        
-        # Contagem por disciplina
-        todas_disciplinas = []
-        for p in protocolos:
-            disc = parse_json_field(p.get("disciplinas"), [])
-            todas_disciplinas.extend(disc)
-        
-        disc_counter = Counter(todas_disciplinas)
-        por_disciplina = [{"disciplina": k, "count": v} for k, v in disc_counter.most_common()]
+        if not estatisticas.pronto:
+            # Primeiro pedido antes da construção no arranque terminar
+            with _lock_estatisticas:
+                if not estatisticas.pronto:
+                    reconstruir_estatisticas()
+        elif time.time() - estatisticas.construido_em > ESTATISTICAS_RECONSTRUIR_SEGUNDOS:
+            # Outros workers podem ter alterado o catálogo entretanto
+            estatisticas.construido_em = time.time()
+            _em_segundo_plano(reconstruir_estatisticas)
         
-        # Últimos 5
-        ultimos = protocolos[:5]
-        
-        return jsonify({
-            "total_protocolos": total,
-            "total_visualizacoes": total_views,
-            "mais_populares": mais_populares,
-            "por_disciplina": por_disciplina,
-            "ultimos": ultimos
-        })
+        return resposta_json_versionada(estatisticas.resumo)
     except Exception as e:
-        print(f"❌ Erro ao obter estatísticas: {e}")
+        log.error("erro ao obter estatisticas erro=%s", e)
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/generate_protocol", methods=["POST"])
-def generate_protocol():
-    """Gera um novo protocolo usando IA"""
-    data = request.get_json()
+def gerar_protocolo_pedido(data: dict, levantar_erros=False):
+    """Gera um protocolo a partir do pedido JSON de /generate_protocol"""
     autor = data.get("autor", "")
     anos = data.get("anos", [])
     disciplinas = data.get("disciplinas", [])
     resumo_usuario = data.get("resumo", "")
     titulo_usuario = data.get("titulo", "") or "(Sem título)"
 
-    print(f"📝 A gerar protocolo pedagógico completo: {titulo_usuario}")
+    forcar_nova = bool(data.get("forcar_nova"))
+
+    log.info("a gerar protocolo titulo=%r", titulo_usuario)
     
-    protocolo_gerado = gerar_protocolo_ia(titulo_usuario, resumo_usuario, anos, disciplinas)
+    protocolo_gerado = gerar_protocolo_ia(
+        titulo_usuario, resumo_usuario, anos, disciplinas, forcar_nova, levantar_erros
+    )
     protocolo_gerado["autor"] = autor
     protocolo_gerado["anos"] = anos
     protocolo_gerado["disciplinas"] = disciplinas
-    
-    return jsonify({"status": "ok", "protocolo": protocolo_gerado})
+    return protocolo_gerado
 
 
-@app.route("/regenerate_protocol", methods=["POST"])
-def regenerate_protocol():
-    """Regenera protocolo com base em feedback"""
-    data = request.get_json()
+def regenerar_protocolo_pedido(data: dict):
+    """Regenera um protocolo a partir do pedido JSON de /regenerate_protocol"""
     protocolo_anterior = data.get("protocolo_anterior", {})
     feedback = data.get("feedback", "")
+    seccoes = validar_seccoes(data.get("seccoes"))
     
-    print(f"🔄 A regenerar protocolo com feedback: {feedback[:50]}...")
+    log.info("a regenerar protocolo feedback=%r", feedback[:50])
     
-    protocolo_novo = regenerar_protocolo_ia(protocolo_anterior, feedback)
+    protocolo_novo = regenerar_protocolo_ia(protocolo_anterior, feedback, seccoes)
     protocolo_novo["autor"] = protocolo_anterior.get("autor", "")
     protocolo_novo["anos"] = protocolo_anterior.get("anos", [])
     protocolo_novo["disciplinas"] = protocolo_anterior.get("disciplinas", [])
-    
+    return protocolo_novo
+
+
+@portal.route("/generate_protocol", methods=["POST"])
+def generate_protocol():
+    """Gera um novo protocolo usando IA"""
+    protocolo_gerado = gerar_protocolo_pedido(request.get_json())
+    return jsonify({"status": "ok", "protocolo": protocolo_gerado})
+
+
+@portal.route("/generate_protocol/stream", methods=["POST"])
+def generate_protocol_stream():
+    """Gera um novo protocolo usando IA, enviando cada secção por Server-Sent Events"""
+    data = request.get_json()
+    autor = data.get("autor", "")
+    anos = data.get("anos", [])
+    disciplinas = data.get("disciplinas", [])
+    resumo_usuario = data.get("resumo", "")
+    titulo_usuario = data.get("titulo", "") or "(Sem título)"
+    forcar_nova = bool(data.get("forcar_nova"))
+
+    if not _vagas_streams.acquire(blocking=False):
+        log.warning("geracao em streaming recusada maximo=%d", GERACAO_STREAMS_MAX)
+        resposta = jsonify({"status": "erro", "message": "Demasiadas gerações em curso. Usa /api/jobs/generate."})
+        resposta.headers["Retry-After"] = "10"
+        return resposta, 503
+
+    log.info("a gerar protocolo em streaming titulo=%r", titulo_usuario)
+
+    def eventos():
+        protocolo_gerado = {}
+        seccoes = gerar_protocolo_ia_stream(titulo_usuario, resumo_usuario, anos, disciplinas, forcar_nova)
+        for chave, valor in seccoes:
+            protocolo_gerado[chave] = valor
+            yield evento_sse("seccao", {"chave": chave, "valor": valor})
+        protocolo_gerado["autor"] = autor
+        protocolo_gerado["anos"] = anos
+        protocolo_gerado["disciplinas"] = disciplinas
+        yield evento_sse("fim", {"status": "ok", "protocolo": protocolo_gerado})
+
+    resposta = Response(
+        stream_with_context(eventos()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Ao fechar a resposta (fim, erro ou cliente que se desligou), mesmo sem ter começado o stream
+    resposta.call_on_close(_vagas_streams.release)
+    return resposta
+
+
+@portal.route("/regenerate_protocol", methods=["POST"])
+def regenerate_protocol():
+    """Regenera protocolo com base em feedback"""
+    protocolo_novo = regenerar_protocolo_pedido(request.get_json())
     return jsonify({"status": "ok", "protocolo": protocolo_novo})
 
 
-@app.route("/save_protocol", methods=["POST"])
+@portal.route("/api/jobs/<tipo>", methods=["POST"])
+def criar_tarefa(tipo):
+    """Submete uma geração (generate) ou regeneração (regenerate) e retorna o ID da tarefa"""
+    funcoes = {"generate": gerar_protocolo_pedido, "regenerate": regenerar_protocolo_pedido}
+    if tipo not in funcoes:
+        return jsonify({"status": "erro", "message": "Tipo de tarefa inválido"}), 404
+    
+    try:
+        tarefa = gestor_tarefas.submeter(tipo, funcoes[tipo], request.get_json())
+    except FilaCheiaErro as e:
+        log.warning("fila de tarefas cheia erro=%s", e)
+        resposta = jsonify({"status": "erro", "message": "Demasiados pedidos em curso. Tenta daqui a pouco."})
+        resposta.headers["Retry-After"] = "10"
+        return resposta, 503
+    
+    return jsonify({"status": "ok", **tarefa.para_dict()}), 202
+
+
+@portal.route("/api/jobs/<job_id>", methods=["GET"])
+def estado_tarefa(job_id):
+    """Estado (e resultado, se concluída) de uma tarefa"""
+    tarefa = gestor_tarefas.obter(job_id)
+    if not tarefa:
+        return jsonify({"status": "erro", "message": "Tarefa não encontrada"}), 404
+    return jsonify({"status": "ok", **tarefa.para_dict()})
+
+
+@portal.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancelar_tarefa(job_id):
+    """Cancela uma tarefa pendente ou em execução"""
+    if not gestor_tarefas.cancelar(job_id):
+        return jsonify({"status": "erro", "message": "Tarefa inexistente ou já terminada"}), 404
+    return jsonify({"status": "ok", "job_id": job_id, "estado": "cancelada"})
+
+
+@portal.route("/save_protocol", methods=["POST"])
 def save_protocol():
     """Guarda um protocolo na base de dados"""
     data = request.get_json()
     protocolo = data.get("protocolo", {})
     
-    print(f"💾 A guardar protocolo: {protocolo.get('titulo', '(sem título)')}")
-    print(f"📋 Campos recebidos: {list(protocolo.keys())}")
+    log.info("a guardar protocolo titulo=%r", protocolo.get("titulo", "(sem título)"))
+    log.debug("campos recebidos campos=%s", list(protocolo.keys()))
     
     try:
-        # Preparar registo - adaptar aos campos da tua tabela
-        registro = {
-            "titulo": to_string(protocolo.get("titulo", "")),
-            "subtitulo": to_string(protocolo.get("subtitulo", "")),
-            "duracao": to_string(protocolo.get("duracao", "")),
-            "competencias": to_string(protocolo.get("competencias", "")),
-            "objetivos": to_string(protocolo.get("objetivos", "")),
-            "contextualizacao": to_string(protocolo.get("contextualizacao", "")),
-            "resumo": to_string(protocolo.get("resumo", "")),
-            "materiais": to_string(protocolo.get("materiais", "")),
-            "pre_experiencia": to_string(protocolo.get("pre_experiencia", "")),
-            "procedimento": to_string(protocolo.get("procedimento", "")),
-            "pos_experiencia": to_string(protocolo.get("pos_experiencia", "")),
-            "resultados_esperados": to_string(protocolo.get("resultados_esperados", "")),
-            "seguranca": json.dumps(protocolo.get("seguranca", {})),
-            "seguranca_json": json.dumps(protocolo.get("seguranca", {})),
-            "quiz": json.dumps(protocolo.get("quiz", [])),
-            "quiz_json": json.dumps(protocolo.get("quiz", [])),
-            "diferenciacao_json": json.dumps(protocolo.get("diferenciacao", {})),
-            "recursos_extras": to_string(protocolo.get("recursos_extras", "")),
-            "disciplinas": json.dumps(protocolo.get("disciplinas", [])),
-            "anos": json.dumps(protocolo.get("anos", [])),
-            "autor": to_string(protocolo.get("autor", "")),
-            "gostos": 0,
-            "nao_gostos": 0,
-            "visualizacoes": 0
-        }
-
-        print(f"📝 Registo preparado com campos: {list(registro.keys())}")
-        
-        protocol_id = guardar_protocolo(registro)
+        protocol_id = guardar_protocolo_completo(protocolo)
         
         if protocol_id:
-            print("✅ Protocolo pedagógico guardado com sucesso!")
             return jsonify({"status": "ok", "id": protocol_id})
         else:
-            return jsonify({"status": "erro", "message": "Falha ao guardar no Supabase"}), 500
+            return jsonify({"status": "erro", "message": "Falha ao guardar o protocolo"}), 500
             
     except Exception as e:
-        print(f"❌ Erro ao guardar: {e}")
+        log.error("erro ao guardar erro=%s", e)
         return jsonify({"status": "erro", "message": str(e)}), 500
 
 
-@app.route("/search_protocols")
+@portal.route("/search_protocols")
 def search_protocols():
-    """Pesquisa protocolos por termo"""
+    """Pesquisa protocolos por termo e/ou facetas (disciplina, ano), paginado por cursor"""
     q = request.args.get("q", "").strip()
+    # Facetas repetíveis: ?disciplina=Física&disciplina=Química&ano=8º ano
+    filtros = {
+        faceta: [v for v in request.args.getlist(parametro) if v.strip()]
+        for faceta, parametro in (("disciplinas", "disciplina"), ("anos", "ano"))
+    }
+    filtros = {faceta: valores for faceta, valores in filtros.items() if valores}
+    cursor = request.args.get("cursor") or None
+    limite = request.args.get("limite", LIMITE_PAGINA_PADRAO, type=int)
+    limite = max(1, min(limite or LIMITE_PAGINA_PADRAO, LIMITE_PAGINA_MAXIMO))
     
-    if q:
-        resultados = pesquisar_protocolos(q)
-    else:
-        resultados = listar_protocolos()
-    
-    # Preparar para JSON response
-    for r in resultados:
-        r["disciplinas"] = parse_json_field(r.get("disciplinas"), [])
-        r["anos"] = parse_json_field(r.get("anos"), [])
+    def gerar():
+        # Uma só pesquisa BM25 por pedido, para os resultados e para as contagens das facetas
+        pesquisa = relevancia(q)
+        if filtros:
+            resultados, proximo_cursor = pesquisar_por_facetas(q, filtros, limite, cursor, pesquisa=pesquisa)
+        elif q:
+            resultados, proximo_cursor = pesquisar_protocolos(q, limite, cursor, pesquisa=pesquisa)
+        else:
+            resultados, proximo_cursor = listar_pagina_protocolos(limite, cursor)
+        for r in resultados:
+            buffer_contadores.aplicar_pendentes(r)
+        resposta = {"protocolos": resultados, "proximo_cursor": proximo_cursor}
+        if not cursor:
+            # Só na primeira página: as seguintes partilham as mesmas contagens
+            resposta["facetas"] = contar_facetas(q, filtros, pesquisa)
+        return resposta
     
-    return jsonify(resultados)
+    try:
+        return resposta_json_versionada(gerar)
+    except CursorInvalidoErro as e:
+        return jsonify({"status": "erro", "message": str(e)}), 400
+
+
+@portal.route("/suggest")
+def sugerir():
+    """Sugestões para a caixa de pesquisa a partir do que já foi escrito (prefixo)"""
+    q = request.args.get("q", "")[:100]
+    limite = request.args.get("limite", 8, type=int)
+    limite = max(1, min(limite or 8, SUGESTOES_LIMITE_MAXIMO))
+    # Sem índice ainda (arranque): lista vazia em vez de ir ao armazenamento a cada tecla
+    sugestoes = indice_sugestoes.sugerir(q, limite) if indice_sugestoes.pronto else []
+    resposta = jsonify({"sugestoes": sugestoes})
+    resposta.headers["Cache-Control"] = "public, max-age=60"
+    return resposta
+
+
+@portal.route("/export.ndjson")
+def exportar_catalogo():
+    """Exporta o catálogo completo em NDJSON, em streaming (memória constante)"""
+    if not armazenamento:
+        return jsonify({"status": "erro", "message": "Armazenamento não configurado"}), 503
+
+    def gerar():
+        try:
+            protocolos = (buffer_contadores.aplicar_pendentes(p) for p in iterar_protocolos())
+            yield from linhas_ndjson(protocolos)
+        except Exception as e:
+            # Os cabeçalhos já foram enviados: interromper a resposta para o cliente ver o erro
+            log.error("exportacao interrompida erro=%s", e)
+            raise
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="application/x-ndjson",
+        headers={
+            "Content-Disposition": "attachment; filename=protocolos.ndjson",
+            "Cache-Control": "no-store"
+        }
+    )
 
 
-@app.route("/protocolo/<int:id>")
+@portal.route("/protocolo/<int:id>")
 def ver_protocolo(id):
     """Visualiza um protocolo específico"""
-    # Incrementar visualizações
-    incrementar_contador(id, "visualizacoes")
-    
-    # Obter protocolo
-    protocolo = obter_protocolo_por_id(id)
+    pagina = obter_pagina_protocolo(id)
     
-    if not protocolo:
+    if not pagina:
         return "Protocolo não encontrado", 404
     
-    # Preparar para template
-    protocolo = preparar_protocolo_para_template(protocolo)
+    versao, html = pagina
+    resposta = Response(html, mimetype="text/html")
+    # Contar a visualização (também em pedidos condicionais que resultam em 304)
+    registar_visualizacao(id, resposta)
+    resposta.set_etag(versao)
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta.make_conditional(request)
+
+
+@portal.route("/api/protocolo/<int:id>/contadores")
+def contadores_protocolo(id):
+    """Contadores atuais de um protocolo (fora da página em cache)"""
+    contadores = obter_contadores(id)
+    if contadores is None:
+        return jsonify({"status": "erro", "message": "Protocolo não encontrado"}), 404
     
-    # Gerar QR Code
-    protocolo["qr_code"] = gerar_qr_code(request.host_url + f"protocolo/{id}")
+    resposta = jsonify(contadores)
+    # Pedido feito pela página ao abrir: conta a visita de quem recebeu o cookie na página
+    # (deduplicado com ela)
+    registar_visualizacao(id, resposta)
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
+
+
+@portal.route("/protocolo/<int:id>/qr.<formato>")
+def qr_protocolo(id, formato):
+    """QR Code do protocolo (PNG ou SVG), com ETag e cache de longa duração"""
+    if formato not in QR_MIMETYPES:
+        return "Formato não suportado", 404
     
-    return render_template("protocolo.html", protocolo=protocolo)
+    conteudo = gerar_qr_code(request.host_url + f"protocolo/{id}", formato)
+    
+    resposta = Response(conteudo, mimetype=QR_MIMETYPES[formato])
+    resposta.set_etag(hashlib.sha1(conteudo).hexdigest())
+    resposta.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resposta.make_conditional(request)
 
 
-@app.route("/avaliar_protocolo/<int:id>", methods=["POST"])
+@portal.route("/avaliar_protocolo/<int:id>", methods=["POST"])
 def avaliar_protocolo(id):
     """Avalia um protocolo (gosto/não gosto)"""
     data = request.get_json()
@@ -386,13 +1201,17 @@ def avaliar_protocolo(id):
     
     campo = "gostos" if tipo == "gosto" else "nao_gostos"
     
+    # Normalmente em memória: sem ida ao armazenamento por cada voto
+    contadores = obter_contadores(id)
+    if contadores is None:
+        return jsonify({"status": "erro", "message": "Protocolo não encontrado"}), 404
+    
     if incrementar_contador(id, campo):
-        # Buscar valores atualizados
-        protocolo = obter_protocolo_por_id(id)
+        contadores[campo] += 1
         return jsonify({
             "status": "ok",
-            "gostos": protocolo.get("gostos", 0) if protocolo else 0,
-            "nao_gostos": protocolo.get("nao_gostos", 0) if protocolo else 0
+            "gostos": contadores["gostos"],
+            "nao_gostos": contadores["nao_gostos"]
         })
     
     return jsonify({"status": "erro", "message": "Erro ao avaliar"}), 500
@@ -401,14 +1220,15 @@ def avaliar_protocolo(id):
 # -----------------------------
 # Funções IA (Groq)
 # -----------------------------
-def gerar_protocolo_ia(titulo, resumo, anos, disciplinas):
-    """Gera protocolo experimental PEDAGÓGICO COMPLETO usando IA"""
-    
-    if not groq_client:
-        print("❌ Cliente Groq não inicializado")
-        return criar_protocolo_fallback(titulo, resumo)
-    
-    prompt = f"""És um especialista em EDUCAÇÃO EM CIÊNCIAS com experiência em pedagogia das ciências experimentais, currículo português do ensino básico e segurança em laboratório escolar.
+MODELO_GROQ = "llama-3.3-70b-versatile"
+TEMPERATURA_GERACAO = 0.7
+SISTEMA_REGENERACAO = "És um especialista em melhorar protocolos experimentais. Respondes SEMPRE em JSON válido, sem markdown."
+SISTEMA_GERACAO = "És um especialista em educação em ciências. Crias protocolos pedagógicos completos, seguros e alinhados com o currículo português. Respondes SEMPRE em JSON válido, sem markdown."
+
+
+def construir_prompt_geracao(titulo, resumo, anos, disciplinas):
+    """Prompt para gerar um protocolo pedagógico completo"""
+    return f"""És um especialista em EDUCAÇÃO EM CIÊNCIAS com experiência em pedagogia das ciências experimentais, currículo português do ensino básico e segurança em laboratório escolar.
 
 Cria um protocolo experimental COMPLETO, PEDAGÓGICO e SEGURO em português de Portugal.
 
@@ -513,53 +1333,142 @@ FORMATO JSON (responde APENAS com isto, sem markdown):
 
 IMPORTANTE: Linguagem adequada aos anos {', '.join(anos) if anos else 'do ensino básico'}. Segurança é PRIORITÁRIA."""
 
+
+def gerar_protocolo_ia(titulo, resumo, anos, disciplinas, forcar_nova=False, levantar_erros=False):
+    """Gera protocolo experimental PEDAGÓGICO COMPLETO usando IA
+
+    Em caso de erro retorna o protocolo de fallback, ou lança a exceção se levantar_erros.
+    """
+    
+    chave_cache = CacheGeracoes.chave(titulo, resumo, anos, disciplinas, MODELO_GROQ, TEMPERATURA_GERACAO)
+    if not forcar_nova:
+        protocolo = cache_geracoes.obter(chave_cache)
+        if protocolo is not None:
+            log.info("protocolo obtido da cache de geracoes")
+            return protocolo
+    
+    if not groq_client:
+        log.error("cliente groq não inicializado")
+        if levantar_erros:
+            raise RuntimeError("Cliente Groq não inicializado")
+        return criar_protocolo_fallback(titulo, resumo)
+    
+    prompt = construir_prompt_geracao(titulo, resumo, anos, disciplinas)
+
     try:
-        print("🤖 A gerar protocolo pedagógico completo...")
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = groq_client.completar(
+            operacao="geracao",
+            model=MODELO_GROQ,
             messages=[
-                {
-                    "role": "system", 
-                    "content": "És um especialista em educação em ciências. Crias protocolos pedagógicos completos, seguros e alinhados com o currículo português. Respondes SEMPRE em JSON válido, sem markdown."
-                },
+                {"role": "system", "content": SISTEMA_GERACAO},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
+            temperature=TEMPERATURA_GERACAO,
             max_tokens=3500
         )
         
-        resposta_texto = response.choices[0].message.content.strip()
-        print("📥 Resposta recebida do Groq")
-        
-        # Limpar markdown se presente
-        if resposta_texto.startswith("```json"):
-            resposta_texto = resposta_texto[7:]
-        if resposta_texto.startswith("```"):
-            resposta_texto = resposta_texto[3:]
-        if resposta_texto.endswith("```"):
-            resposta_texto = resposta_texto[:-3]
-        resposta_texto = resposta_texto.strip()
-        
-        protocolo = json.loads(resposta_texto)
-        print("✅ Protocolo pedagógico gerado com sucesso!")
+        protocolo, invalidas = validar_protocolo(interpretar_json(response.choices[0].message.content))
+        if invalidas:
+            # Pedir de novo só o que faltou ou veio mal formado, em vez de deitar a geração fora
+            log.warning("geracao com seccoes invalidas seccoes=%s", ",".join(invalidas))
+            protocolo, invalidas = completar_seccoes_ia(protocolo, titulo, resumo, anos, disciplinas, invalidas)
+        if invalidas:
+            if levantar_erros:
+                raise ValueError(f"Secções inválidas na geração: {', '.join(invalidas)}")
+            # Incompleto: não vai para a cache
+            return completar_com_fallback(protocolo, titulo, resumo, invalidas)
+        log.info("protocolo gerado")
         
+        cache_geracoes.guardar(chave_cache, protocolo)
         return protocolo
         
-    except json.JSONDecodeError as e:
-        print(f"❌ Erro ao processar JSON: {e}")
+    except ValueError as e:
+        log.error("erro ao processar json da geracao erro=%s", e)
+        if levantar_erros:
+            raise
         return criar_protocolo_fallback(titulo, resumo)
     except Exception as e:
-        print(f"❌ Erro ao gerar protocolo: {e}")
+        log.error("erro ao gerar protocolo erro=%s", e)
+        if levantar_erros:
+            raise
         return criar_protocolo_fallback(titulo, resumo)
 
 
-def regenerar_protocolo_ia(protocolo_anterior, feedback):
+def gerar_protocolo_ia_stream(titulo, resumo, anos, disciplinas, forcar_nova=False):
+    """Gera protocolo em streaming, produzindo (secção, valor) assim que cada secção fica completa"""
+    
+    chave_cache = CacheGeracoes.chave(titulo, resumo, anos, disciplinas, MODELO_GROQ, TEMPERATURA_GERACAO)
+    if not forcar_nova:
+        protocolo = cache_geracoes.obter(chave_cache)
+        if protocolo is not None:
+            log.info("protocolo obtido da cache de geracoes")
+            yield from protocolo.items()
+            return
+    
+    if not groq_client:
+        log.error("cliente groq não inicializado")
+        yield from criar_protocolo_fallback(titulo, resumo).items()
+        return
+    
+    prompt = construir_prompt_geracao(titulo, resumo, anos, disciplinas)
+    parser = ParserSeccoesJSON()
+
+    try:
+        stream = groq_client.completar(
+            operacao="geracao_stream",
+            model=MODELO_GROQ,
+            messages=[
+                {"role": "system", "content": SISTEMA_GERACAO},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=TEMPERATURA_GERACAO,
+            max_tokens=3500,
+            stream=True
+        )
+        for chunk in stream:
+            texto = chunk.choices[0].delta.content if chunk.choices else None
+            if texto:
+                yield from parser.alimentar(texto)
+    except Exception as e:
+        log.error("erro ao gerar protocolo em streaming erro=%s", e)
+    
+    protocolo, invalidas = validar_protocolo(parser.protocolo)
+    # Secções corrigidas na validação (ex.: nível de risco sem acento) seguem na forma final
+    for seccao, valor in protocolo.items():
+        if valor != parser.protocolo.get(seccao):
+            yield seccao, valor
+    if not invalidas:
+        log.info("protocolo gerado em streaming")
+        cache_geracoes.guardar(chave_cache, protocolo)
+        return
+    
+    # Resposta interrompida ou inválida: voltar a pedir só essas secções (enviadas de novo, por
+    # cima das que já tinham sido enviadas) e, se ainda faltar alguma, usar o fallback
+    log.warning("geracao com seccoes invalidas seccoes=%s", ",".join(invalidas))
+    completo, em_falta = completar_seccoes_ia(protocolo, titulo, resumo, anos, disciplinas, invalidas)
+    for seccao in invalidas:
+        if seccao in completo:
+            yield seccao, completo[seccao]
+    if not em_falta:
+        cache_geracoes.guardar(chave_cache, completo)
+        return
+    fallback = criar_protocolo_fallback(titulo, resumo)
+    for seccao in em_falta:
+        yield seccao, fallback[seccao]
+
+
+def regenerar_protocolo_ia(protocolo_anterior, feedback, seccoes=None):
     """Regenera protocolo com base em feedback do utilizador"""
     
     if not groq_client:
-        print("❌ Cliente Groq não inicializado")
+        log.error("cliente groq não inicializado")
         return protocolo_anterior
     
+    # Feedback dirigido a secções concretas: enviar e regenerar só essas
+    seccoes = seccoes or classificar_feedback(feedback)
+    if seccoes:
+        return regenerar_seccoes_ia(protocolo_anterior, feedback, seccoes)
+    
     prompt = f"""Melhora este protocolo experimental com base no feedback do utilizador.
 
 PROTOCOLO ANTERIOR:
@@ -577,40 +1486,112 @@ INSTRUÇÕES:
 Retorna o protocolo melhorado no MESMO formato JSON."""
 
     try:
-        print("🔄 A regenerar protocolo...")
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+        response = groq_client.completar(
+            operacao="regeneracao",
+            model=MODELO_GROQ,
             messages=[
-                {
-                    "role": "system", 
-                    "content": "És um especialista em melhorar protocolos experimentais. Respondes SEMPRE em JSON válido, sem markdown."
-                },
+                {"role": "system", "content": SISTEMA_REGENERACAO},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
+            temperature=TEMPERATURA_GERACAO,
             max_tokens=3500
         )
         
-        resposta_texto = response.choices[0].message.content.strip()
+        # Secções que vierem em falta ou mal formadas ficam como estavam
+        validas, invalidas = validar_protocolo(interpretar_json(response.choices[0].message.content))
+        if invalidas:
+            log.warning("regeneracao com seccoes invalidas seccoes=%s", ",".join(invalidas))
+        log.info("protocolo regenerado")
+        return {**protocolo_anterior, **validas}
         
-        # Limpar markdown
-        if resposta_texto.startswith("```json"):
-            resposta_texto = resposta_texto[7:]
-        if resposta_texto.startswith("```"):
-            resposta_texto = resposta_texto[3:]
-        if resposta_texto.endswith("```"):
-            resposta_texto = resposta_texto[:-3]
-        resposta_texto = resposta_texto.strip()
+    except Exception as e:
+        log.error("erro ao regenerar erro=%s", e)
+        return protocolo_anterior
+
+
+def regenerar_seccoes_ia(protocolo_anterior, feedback, seccoes, operacao="regeneracao_seccoes"):
+    """Regenera apenas as secções indicadas e junta-as ao protocolo anterior"""
+    
+    contexto = {
+        campo: protocolo_anterior.get(campo)
+        for campo in ("titulo", "resumo", "anos", "disciplinas")
+        if protocolo_anterior.get(campo)
+    }
+    atuais = {seccao: protocolo_anterior.get(seccao) for seccao in seccoes}
+    
+    prompt = f"""Melhora APENAS algumas secções de um protocolo experimental com base no feedback do utilizador.
+
+CONTEXTO DO PROTOCOLO:
+{json.dumps(contexto, ensure_ascii=False)}
+
+SECÇÕES A MELHORAR (valores atuais):
+{json.dumps(atuais, indent=2, ensure_ascii=False)}
+
+FEEDBACK DO UTILIZADOR:
+{feedback}
+
+INSTRUÇÕES:
+- Retorna um objeto JSON APENAS com as chaves: {', '.join(seccoes)}
+- Mantém o formato de cada secção (texto, lista ou objeto, com as mesmas chaves internas)
+- Melhora apenas o que foi pedido no feedback
+- Mantém segurança e qualidade pedagógica
+- Responde APENAS com JSON válido, sem markdown"""
+
+    try:
+        log.info("a regenerar seccoes seccoes=%s", ",".join(seccoes))
+        response = groq_client.completar(
+            operacao=operacao,
+            model=MODELO_GROQ,
+            messages=[
+                {"role": "system", "content": SISTEMA_REGENERACAO},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=TEMPERATURA_GERACAO,
+            # Orçamento de tokens proporcional ao número de secções
+            max_tokens=min(3500, 300 + 500 * len(seccoes))
+        )
+        
+        validas, invalidas = validar_protocolo(interpretar_json(response.choices[0].message.content), seccoes)
         
-        protocolo_novo = json.loads(resposta_texto)
-        print("✅ Protocolo regenerado!")
+        # Só as secções pedidas (e bem formadas) são substituídas; as restantes ficam intactas
+        protocolo_novo = dict(protocolo_anterior)
+        protocolo_novo.update(validas)
+        if invalidas:
+            log.warning("seccoes regeneradas invalidas seccoes=%s", ",".join(invalidas))
+        log.info("seccoes regeneradas")
         return protocolo_novo
         
     except Exception as e:
-        print(f"❌ Erro ao regenerar: {e}")
+        log.error("erro ao regenerar seccoes erro=%s", e)
         return protocolo_anterior
 
 
+def completar_seccoes_ia(protocolo, titulo, resumo, anos, disciplinas, seccoes):
+    """Volta a pedir só as secções em falta ou inválidas de uma geração
+
+    Retorna (protocolo com as secções obtidas, secções que continuam em falta).
+    """
+    if not groq_client:
+        return protocolo, seccoes
+    contexto = {
+        "titulo": protocolo.get("titulo") or titulo,
+        "resumo": protocolo.get("resumo") or resumo,
+        "anos": anos,
+        "disciplinas": disciplinas,
+    }
+    pedido = "Estas secções faltaram ou vieram incompletas. Cria-as completas, com este formato:\n" + \
+        "\n".join(f"- {seccao}: {FORMATO_SECCOES[seccao]}" for seccao in seccoes)
+    completo = regenerar_seccoes_ia({**protocolo, **contexto}, pedido, seccoes, operacao="geracao_seccoes")
+    return validar_protocolo(completo)
+
+
+def completar_com_fallback(protocolo, titulo, resumo, seccoes):
+    """Preenche com o protocolo de fallback as secções que a IA não conseguiu dar"""
+    log.warning("seccoes preenchidas com o fallback seccoes=%s", ",".join(seccoes))
+    fallback = criar_protocolo_fallback(titulo, resumo)
+    return {seccao: protocolo.get(seccao, fallback[seccao]) for seccao in fallback}
+
+
 def criar_protocolo_fallback(titulo, resumo):
     """Protocolo básico em caso de erro da IA"""
     return {
@@ -645,6 +1626,244 @@ def criar_protocolo_fallback(titulo, resumo):
     }
 
 
+# -----------------------------
+# Comandos (flask --app app <comando>)
+# -----------------------------
+def _tamanho_registo(linha):
+    return len(json.dumps({c: v for c, v in linha.items() if v is not None}, ensure_ascii=False).encode())
+
+
+@portal.cli.command("migrar-registos")
+@click.option("--lote", default=200, show_default=True, help="Protocolos lidos e reescritos por lote")
+@click.option("--pausa", default=0.5, show_default=True, help="Segundos de pausa entre lotes")
+@click.option("--comprimir-bytes", default=REGISTOS_COMPRIMIR_BYTES, show_default=True,
+              help="Comprimir secções de texto a partir deste tamanho (0 = nunca)")
+@click.option("--simular", is_flag=True, help="Calcula a redução de tamanho sem escrever nada")
+def migrar_registos(lote, pausa, comprimir_bytes, simular):
+    """Converte os protocolos para o formato compacto, em lotes e sem parar o portal"""
+    if not armazenamento:
+        raise click.ClickException("Armazenamento não configurado")
+    origem = getattr(armazenamento, "backend", armazenamento)
+    migrados = ja_migrados = falhas = 0
+    bytes_antes = bytes_depois = 0
+    cursor = None
+    while True:
+        linhas, cursor = _paginar(origem.consultar_pagina(lote + 1, descodificar_cursor(cursor), "*"), lote)
+        for linha in linhas:
+            if (linha.get("formato") or 1) >= FORMATO_ATUAL:
+                ja_migrados += 1
+                continue
+            # Só as secções mudam: os contadores continuam a ser incrementados em paralelo
+            alteracoes = migrar_registo(linha, comprimir_bytes)
+            if not simular:
+                try:
+                    origem.atualizar(linha["id"], alteracoes)
+                except Exception as e:
+                    falhas += 1
+                    click.echo(f"❌ Protocolo {linha['id']}: {e}")
+                    continue
+            migrados += 1
+            bytes_antes += _tamanho_registo(linha)
+            bytes_depois += _tamanho_registo({**linha, **alteracoes})
+        click.echo(f"🔁 {migrados} migrados, {ja_migrados} já no formato {FORMATO_ATUAL}, {falhas} falhas")
+        if not cursor:
+            break
+        time.sleep(pausa)
+
+    if migrados:
+        reducao = 100 * (1 - bytes_depois / bytes_antes) if bytes_antes else 0
+        click.echo(f"📦 {bytes_antes} → {bytes_depois} bytes ({reducao:.0f}% menos)"
+                   + (" [simulação]" if simular else ""))
+
+
+@portal.cli.command("exportar")
+@click.argument("destino", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--lote", default=500, show_default=True, help="Protocolos lidos por lote")
+def exportar(destino, lote):
+    """Exporta o catálogo completo em NDJSON (para um ficheiro ou para o stdout)"""
+    if not armazenamento:
+        raise click.ClickException("Armazenamento não configurado")
+    inicio = time.time()
+    total = 0
+    for linha in linhas_ndjson(iterar_protocolos(lote=lote)):
+        destino.write(linha)
+        total += 1
+    click.echo(f"📤 {total} protocolos exportados em {time.time() - inicio:.1f}s", err=True)
+
+
+@portal.cli.command("importar")
+@click.argument("origem", type=click.File("r", encoding="utf-8"))
+@click.option("--lote", default=500, show_default=True, help="Protocolos inseridos por escrita")
+@click.option("--checkpoint", "caminho_checkpoint", default=None,
+              help="Ficheiro de progresso para retomar (por omissão <origem>.checkpoint)")
+@click.option("--manter-ids", is_flag=True, help="Inserir com os IDs originais (cópia fiel para staging)")
+def importar(origem, lote, caminho_checkpoint, manter_ids):
+    """Importa protocolos de um ficheiro NDJSON: valida, ignora duplicados e insere em lotes"""
+    if not armazenamento:
+        raise click.ClickException("Armazenamento não configurado")
+    if caminho_checkpoint is None and origem.name != "<stdin>":
+        caminho_checkpoint = origem.name + ".checkpoint"
+    checkpoint = Checkpoint(caminho_checkpoint)
+    if manter_ids:
+        # Os IDs explícitos não avançam a sequência do Postgres: sem a ajustar no fim, o próximo
+        # /save_protocol falharia com chave duplicada. Verificado já, antes de inserir o que quer que seja
+        try:
+            armazenamento.ajustar_sequencia()
+        except Exception as e:
+            raise click.ClickException(
+                f"--manter-ids precisa da função ajustar_sequencia_protocolos (sql/ajustar_sequencia.sql): {e}"
+            )
+
+    click.echo("🔎 A ler o catálogo de destino para deduplicação...")
+    existentes = {chave_duplicado(p) for p in iterar_protocolos(colunas_registo("id,created_at,titulo,resumo,autor"))}
+
+    inicio = time.time()
+    try:
+        estado = importar_ndjson(
+            origem, armazenamento.inserir_varios, existentes, lote, checkpoint,
+            manter_ids, REGISTOS_COMPRIMIR_BYTES, click.echo
+        )
+    finally:
+        # Também se a importação parar a meio: os lotes já inseridos têm IDs explícitos
+        if manter_ids:
+            armazenamento.ajustar_sequencia()
+    checkpoint.remover()
+    click.echo(f"✅ {estado['inseridos']} inseridos, {estado['duplicados']} duplicados, "
+               f"{estado['invalidos']} inválidos em {time.time() - inicio:.1f}s")
+
+
+@portal.cli.command("reconstruir-semelhanca")
+@click.option("--lote", default=500, show_default=True, help="Protocolos lidos por lote")
+def reconstruir_semelhanca(lote):
+    """Calcula os protocolos semelhantes de todo o catálogo e grava-os em SEMELHANCA_PATH"""
+    if not armazenamento:
+        raise click.ClickException("Armazenamento não configurado")
+    inicio = time.time()
+    colunas = colunas_registo("id,created_at,disciplinas," + ",".join(CAMPOS_SEMELHANCA))
+    indice_semelhanca.reconstruir(documento(p) for p in iterar_protocolos(colunas, lote))
+    click.echo(f"🧮 Vetores construídos em {time.time() - inicio:.1f}s")
+    total = indice_semelhanca.calcular_em_falta(
+        todos=True, relatar=lambda feitos, total: click.echo(f"🔗 {feitos}/{total} protocolos")
+    )
+    indice_semelhanca.guardar(SEMELHANCA_PATH)
+    click.echo(f"✅ Vizinhos de {total} protocolos gravados em {SEMELHANCA_PATH} ({time.time() - inicio:.1f}s)")
+
+
+@portal.cli.command("gerar-lote")
+@click.argument("ficheiro", type=click.Path(exists=True, dir_okay=False))
+@click.option("--concorrencia", default=4, show_default=True, help="Gerações em simultâneo")
+@click.option("--tokens-por-minuto", default=GROQ_TOKENS_POR_MINUTO, show_default=True,
+              help="Orçamento de tokens por minuto (quota da conta Groq)")
+@click.option("--tokens-resposta", default=2500, show_default=True,
+              help="Tokens estimados por resposta, somados aos do prompt")
+@click.option("--checkpoint", "caminho_checkpoint", default=None,
+              help="Ficheiro de progresso para retomar (por omissão <ficheiro>.checkpoint)")
+@click.option("--forcar-nova", is_flag=True, help="Ignorar a cache de gerações")
+@click.option("--espera-maxima", default=600.0, show_default=True,
+              help="Segundos que cada pedido espera pelo Groq com o disjuntor aberto antes de falhar")
+def gerar_lote(ficheiro, concorrencia, tokens_por_minuto, tokens_resposta, caminho_checkpoint, forcar_nova,
+               espera_maxima):
+    """Gera e guarda protocolos para uma lista de pedidos (CSV ou JSONL)"""
+    if not groq_client:
+        raise click.ClickException("Groq não configurado (GROQ_API_KEY)")
+    if not armazenamento:
+        raise click.ClickException("Armazenamento não configurado")
+    # Neste processo só corre o lote: a concorrência é a pedida, não a dos workers web
+    groq_client.definir_concorrencia(concorrencia)
+    checkpoint = Checkpoint(caminho_checkpoint or ficheiro + ".checkpoint")
+
+    def custo(pedido):
+        prompt = construir_prompt_geracao(pedido["titulo"], pedido["resumo"], pedido["anos"], pedido["disciplinas"])
+        return (len(SISTEMA_GERACAO) + len(prompt)) // 4 + tokens_resposta
+
+    def processar(pedido):
+        limite = time.monotonic() + espera_maxima
+        while True:
+            try:
+                protocolo = gerar_protocolo_pedido({**pedido, "forcar_nova": forcar_nova}, levantar_erros=True)
+                return guardar_protocolo_completo(protocolo)
+            except CircuitoAbertoErro:
+                # Não queimar o resto da lista enquanto o Groq está em baixo, mas sem esperar
+                # para sempre: a falha fica no checkpoint e é repetida ao voltar a correr
+                if time.monotonic() + groq_client.disjuntor.pausa > limite:
+                    raise
+                time.sleep(groq_client.disjuntor.pausa)
+
+    estado = executar_lote(
+        ler_pedidos(ficheiro), processar, custo, concorrencia,
+        BaldeTokens(tokens_por_minuto) if tokens_por_minuto > 0 else None, checkpoint, click.echo
+    )
+    minutos = estado["duracao"] / 60
+    click.echo(f"📊 {estado['gerados']} gerados em {estado['duracao']:.0f}s "
+               f"({estado['gerados'] / minutos if minutos else 0:.1f}/min), "
+               f"{len(estado['falhas'])} falhas, {estado['invalidos']} inválidos")
+    if estado["falhas"]:
+        click.echo(f"↪️ Volta a correr o mesmo comando para repetir as falhas (progresso em {checkpoint.caminho})")
+    else:
+        checkpoint.remover()
+
+
+# -----------------------------
+# Arranque
+# -----------------------------
+_pid_iniciado = None
+_lock_arranque = threading.Lock()
+
+
+def iniciar_processo():
+    """Arranca o trabalho em segundo plano deste processo (índice, estatísticas, contadores)
+
+    Com gunicorn --preload é chamado no post_fork de cada worker (gunicorn.conf.py): threads
+    criadas no processo pai não sobrevivem ao fork. Idempotente por processo.
+    """
+    global _pid_iniciado
+    with _lock_arranque:
+        if _pid_iniciado == os.getpid():
+            return
+        _pid_iniciado = os.getpid()
+    _em_segundo_plano(construir_indice_pesquisa)
+    _em_segundo_plano(reconstruir_estatisticas)
+    buffer_contadores.iniciar()
+    # Descarregar os contadores pendentes ao encerrar o processo
+    atexit.register(buffer_contadores.parar)
+
+
+def aquecer(aplicacao):
+    """Trabalho partilhável entre workers, feito uma vez no processo pai antes do fork
+
+    Compila os templates e importa os módulos pesados; não cria clientes nem ligações.
+    """
+    inicio = time.time()
+    for nome in aplicacao.jinja_env.list_templates(extensions=("html",)):
+        aplicacao.jinja_env.get_template(nome)
+    import qrcode.image.svg  # noqa: F401
+    if groq_client:
+        import groq  # noqa: F401
+    if armazenamento and ARMAZENAMENTO != "sqlite":
+        import supabase  # noqa: F401
+    log.info("aplicacao aquecida duracao=%.2fs", time.time() - inicio)
+
+
+def create_app():
+    """Cria a aplicação Flask; os clientes (Supabase, Groq) só são criados no primeiro uso"""
+    aplicacao = Flask(__name__)
+    aplicacao.register_blueprint(portal)
+    if PROXIES_CONFIAVEIS > 0:
+        # Só o IP do cliente (remote_addr); esquema e host ficam como estavam
+        aplicacao.wsgi_app = ProxyFix(aplicacao.wsgi_app, x_for=PROXIES_CONFIAVEIS, x_proto=0)
+
+    @aplicacao.before_request
+    def _iniciar_processo():
+        # Sem hook do gunicorn (flask run, python app.py, outros servidores)
+        if _pid_iniciado != os.getpid():
+            iniciar_processo()
+
+    return aplicacao
+
+
+app = create_app()
+
+
 # -----------------------------
 # MAIN
 # -----------------------------
@@ -654,13 +1873,14 @@ if __name__ == "__main__":
     print("   Com Supabase + Groq AI")
     print("=" * 50)
     
-    if not supabase:
-        print("⚠️  AVISO: Supabase não configurado!")
+    if not armazenamento:
+        print("⚠️  AVISO: Armazenamento não configurado (Supabase ou ARMAZENAMENTO=sqlite)!")
     
     if not groq_client:
         print("⚠️  AVISO: Groq não configurado!")
     
+    iniciar_processo()
     port = int(os.environ.get("PORT", 5000))
     print(f"📍 Servidor: http://0.0.0.0:{port}")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False)
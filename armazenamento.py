@@ -0,0 +1,435 @@
+"""Armazenamento dos protocolos: Supabase ou SQLite local, com uma cache de leitura opcional à frente
+
+Todos os backends expõem a mesma interface:
+    inserir(registro) -> id
+    inserir_varios([registro]) -> [id]            (numa única escrita)
+    obter(id, colunas) -> dict ou None
+    obter_varios(ids, colunas) -> [dict]          (ordem não garantida)
+    consultar_pagina(limite, chave, colunas) -> [dict]
+    pesquisar_texto(termo, limite, chave, colunas) -> [dict]
+    atualizar(id, alteracoes)                      (None remove o valor da coluna)
+    incrementar([{"id": ..., campo: delta, ...}])
+    ajustar_sequencia()                            (próximo id a seguir ao maior, após inserir IDs explícitos)
+
+e guardam o estado das tarefas de geração (tabela `tarefas`, ver tarefas.py), partilhado entre workers:
+    criar_tarefa(tarefa) -> id
+    atualizar_tarefa(id, alteracoes, estados) -> bool   (só se o estado atual for um de `estados`)
+    obter_tarefa(id) -> dict ou None
+    apagar_tarefas(antes_de)                            (criadas antes do instante `antes_de`)
+
+As listagens são ordenadas por (created_at, id) descendente; `chave` é o par (created_at, id)
+do último protocolo já visto (keyset) e `limite` o número exato de linhas a devolver.
+Os erros propagam-se: cabe a quem chama decidir o que mostrar.
+"""
+import copy
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from cache import CacheLRU
+from estatisticas import CONTADORES
+
+log = logging.getLogger(__name__)
+
+
+class IncrementoParcialErro(Exception):
+    """Só parte dos incrementos foi aplicada; `pendentes` são os ids que ficaram por aplicar"""
+
+    def __init__(self, mensagem, pendentes):
+        super().__init__(mensagem)
+        self.pendentes = pendentes
+
+
+def _funcao_em_falta(erro):
+    # PostgREST: PGRST202 (função fora da schema cache) ou 42883 (undefined_function)
+    return getattr(erro, "code", None) in ("PGRST202", "42883") or "PGRST202" in str(erro)
+
+
+def _lista_colunas(colunas):
+    return None if colunas == "*" else [c.strip() for c in colunas.split(",")]
+
+
+class ArmazenamentoSupabase:
+    """Tabelas `protocolos` e `tarefas` (sql/tarefas.sql) no Supabase (PostgREST)"""
+
+    def __init__(self, cliente, tabela="protocolos", tabela_tarefas="tarefas"):
+        self.cliente = cliente
+        self.tabela = tabela
+        self.tabela_tarefas = tabela_tarefas
+
+    def _tabela(self):
+        return self.cliente.table(self.tabela)
+
+    def _tarefas(self):
+        return self.cliente.table(self.tabela_tarefas)
+
+    def _listar(self, query, limite, chave):
+        query = query.order("created_at", desc=True).order("id", desc=True)
+        if chave:
+            created_at, ultimo_id = chave
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{ultimo_id})'
+            )
+        if limite:
+            query = query.limit(limite)
+        return query.execute().data or []
+
+    def inserir(self, registro):
+        response = self._tabela().insert(registro).execute()
+        return response.data[0]["id"] if response.data else None
+
+    def inserir_varios(self, registros):
+        response = self._tabela().insert(list(registros)).execute()
+        return [linha["id"] for linha in response.data or []]
+
+    def obter(self, id, colunas="*"):
+        response = self._tabela().select(colunas).eq("id", id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def obter_varios(self, ids, colunas="*"):
+        return self._tabela().select(colunas).in_("id", list(ids)).execute().data or []
+
+    def consultar_pagina(self, limite=None, chave=None, colunas="*"):
+        return self._listar(self._tabela().select(colunas), limite, chave)
+
+    def pesquisar_texto(self, termo, limite=None, chave=None, colunas="*"):
+        query = self._tabela().select(colunas).or_(
+            f"titulo.ilike.%{termo}%,resumo.ilike.%{termo}%,autor.ilike.%{termo}%"
+        )
+        return self._listar(query, limite, chave)
+
+    def atualizar(self, id, alteracoes):
+        self._tabela().update(alteracoes).eq("id", id).execute()
+
+    def incrementar(self, incrementos):
+        try:
+            self.cliente.rpc("incrementar_contadores", {"incrementos": incrementos}).execute()
+        except Exception as e:
+            # Erros transitórios (5xx, timeouts) propagam-se e o buffer repete o RPC atómico;
+            # ler e atualizar um a um (não atómico) só se a função SQL não existir
+            # (ver sql/incrementar_contadores.sql)
+            if not _funcao_em_falta(e):
+                raise
+            log.warning("rpc incrementar_contadores em falta erro=%s a usar leitura + update", e)
+            self._incrementar_um_a_um(incrementos)
+
+    def _incrementar_um_a_um(self, incrementos):
+        for i, linha in enumerate(incrementos):
+            try:
+                atual = self.obter(linha["id"], ",".join(CONTADORES)) or {}
+                self._tabela().update({
+                    campo: (atual.get(campo) or 0) + linha[campo]
+                    for campo in CONTADORES if linha.get(campo)
+                }).eq("id", linha["id"]).execute()
+            except Exception as e:
+                # As linhas anteriores já foram aplicadas: não podem voltar ao buffer
+                raise IncrementoParcialErro(str(e), [l["id"] for l in incrementos[i:]]) from e
+
+    def ajustar_sequencia(self):
+        # Ver sql/ajustar_sequencia.sql: o PostgREST não expõe setval
+        self.cliente.rpc("ajustar_sequencia_protocolos", {}).execute()
+
+    def criar_tarefa(self, tarefa):
+        self._tarefas().insert(tarefa).execute()
+        return tarefa["id"]
+
+    def atualizar_tarefa(self, id, alteracoes, estados):
+        response = self._tarefas().update(alteracoes).eq("id", id).in_("estado", list(estados)).execute()
+        return bool(response.data)
+
+    def obter_tarefa(self, id):
+        response = self._tarefas().select("*").eq("id", id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def apagar_tarefas(self, antes_de):
+        self._tarefas().delete().lt("criada_em", antes_de).execute()
+
+
+class ArmazenamentoSQLite:
+    """Base de dados SQLite local (WAL), para correr e testar o portal sem Supabase
+
+    O registo é guardado como JSON na coluna `dados`; id, created_at e os contadores
+    têm colunas próprias para a ordenação (keyset) e os incrementos atómicos.
+    """
+
+    def __init__(self, caminho="protocolos.db"):
+        self.caminho = caminho
+        self._local = threading.local()
+        conn = self._ligacao()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS protocolos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    gostos INTEGER NOT NULL DEFAULT 0,
+                    nao_gostos INTEGER NOT NULL DEFAULT 0,
+                    visualizacoes INTEGER NOT NULL DEFAULT 0,
+                    dados TEXT NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_protocolos_created_at_id ON protocolos (created_at DESC, id DESC)"
+            )
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tarefas (
+                    id TEXT PRIMARY KEY,
+                    tipo TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    criada_em REAL NOT NULL,
+                    iniciada_em REAL,
+                    terminada_em REAL,
+                    resultado TEXT,
+                    erro TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_criada_em ON tarefas (criada_em)")
+
+    def _ligacao(self):
+        """Uma ligação por thread (sqlite3 não partilha ligações entre threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _protocolo(linha, colunas):
+        protocolo = json.loads(linha["dados"])
+        protocolo["id"] = linha["id"]
+        protocolo["created_at"] = linha["created_at"]
+        for campo in CONTADORES:
+            protocolo[campo] = linha[campo]
+        nomes = _lista_colunas(colunas)
+        if nomes is None:
+            return protocolo
+        resultado = {}
+        for nome in nomes:
+            # Seleção de uma chave JSON, como no PostgREST: alias:coluna->chave
+            alias, _, caminho = nome.rpartition(":")
+            coluna, _, chave = caminho.partition("->")
+            valor = protocolo.get(coluna)
+            if chave:
+                valor = valor.get(chave) if isinstance(valor, dict) else None
+            resultado[alias or (chave or coluna)] = valor
+        return resultado
+
+    def _listar(self, condicoes, parametros, limite, chave, colunas):
+        condicoes = list(condicoes)
+        parametros = list(parametros)
+        if chave:
+            condicoes.append("(created_at, id) < (?, ?)")
+            parametros.extend(chave)
+        sql = "SELECT * FROM protocolos"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limite:
+            sql += " LIMIT ?"
+            parametros.append(limite)
+        linhas = self._ligacao().execute(sql, parametros).fetchall()
+        return [self._protocolo(linha, colunas) for linha in linhas]
+
+    @staticmethod
+    def _inserir(conn, registro):
+        dados = {c: v for c, v in registro.items() if c not in ("id", "created_at", *CONTADORES)}
+        created_at = registro.get("created_at") or datetime.now(timezone.utc).isoformat()
+        cursor = conn.execute(
+            "INSERT INTO protocolos (id, created_at, gostos, nao_gostos, visualizacoes, dados) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (registro.get("id"), created_at, *(registro.get(c) or 0 for c in CONTADORES),
+             json.dumps(dados, ensure_ascii=False))
+        )
+        return cursor.lastrowid
+
+    def inserir(self, registro):
+        conn = self._ligacao()
+        with conn:
+            return self._inserir(conn, registro)
+
+    def inserir_varios(self, registros):
+        conn = self._ligacao()
+        with conn:
+            return [self._inserir(conn, registro) for registro in registros]
+
+    def obter(self, id, colunas="*"):
+        linha = self._ligacao().execute("SELECT * FROM protocolos WHERE id = ?", (id,)).fetchone()
+        return self._protocolo(linha, colunas) if linha else None
+
+    def obter_varios(self, ids, colunas="*"):
+        ids = list(ids)
+        marcadores = ",".join("?" * len(ids))
+        linhas = self._ligacao().execute(
+            f"SELECT * FROM protocolos WHERE id IN ({marcadores})", ids
+        ).fetchall()
+        return [self._protocolo(linha, colunas) for linha in linhas]
+
+    def consultar_pagina(self, limite=None, chave=None, colunas="*"):
+        return self._listar((), (), limite, chave, colunas)
+
+    def pesquisar_texto(self, termo, limite=None, chave=None, colunas="*"):
+        padrao = "%" + termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        condicao = "(" + " OR ".join(
+            f"json_extract(dados, '$.{campo}') LIKE ? ESCAPE '\\'" for campo in ("titulo", "resumo", "autor")
+        ) + ")"
+        return self._listar((condicao,), (padrao,) * 3, limite, chave, colunas)
+
+    def atualizar(self, id, alteracoes):
+        conn = self._ligacao()
+        with conn:
+            linha = conn.execute("SELECT dados FROM protocolos WHERE id = ?", (id,)).fetchone()
+            if linha is None:
+                return
+            dados = json.loads(linha["dados"])
+            for campo, valor in alteracoes.items():
+                if campo in ("id", "created_at", *CONTADORES):
+                    continue
+                if valor is None:
+                    dados.pop(campo, None)
+                else:
+                    dados[campo] = valor
+            conn.execute("UPDATE protocolos SET dados = ? WHERE id = ?", (json.dumps(dados, ensure_ascii=False), id))
+
+    def incrementar(self, incrementos):
+        conn = self._ligacao()
+        with conn:
+            conn.executemany(
+                "UPDATE protocolos SET " + ", ".join(f"{c} = {c} + :{c}" for c in CONTADORES) + " WHERE id = :id",
+                [{"id": linha["id"], **{c: linha.get(c, 0) for c in CONTADORES}} for linha in incrementos]
+            )
+
+    def ajustar_sequencia(self):
+        # AUTOINCREMENT já guarda o maior id inserido (sqlite_sequence), mesmo explícito
+        pass
+
+    def criar_tarefa(self, tarefa):
+        conn = self._ligacao()
+        with conn:
+            conn.execute(
+                "INSERT INTO tarefas (id, tipo, estado, criada_em, iniciada_em, terminada_em, resultado, erro) "
+                "VALUES (:id, :tipo, :estado, :criada_em, :iniciada_em, :terminada_em, :resultado, :erro)",
+                {**tarefa, "resultado": json.dumps(tarefa.get("resultado"), ensure_ascii=False)}
+            )
+        return tarefa["id"]
+
+    def atualizar_tarefa(self, id, alteracoes, estados):
+        alteracoes = dict(alteracoes)
+        if "resultado" in alteracoes:
+            alteracoes["resultado"] = json.dumps(alteracoes["resultado"], ensure_ascii=False)
+        conn = self._ligacao()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE tarefas SET " + ", ".join(f"{campo} = ?" for campo in alteracoes)
+                + " WHERE id = ? AND estado IN (" + ",".join("?" * len(estados)) + ")",
+                (*alteracoes.values(), id, *estados)
+            )
+        return cursor.rowcount > 0
+
+    def obter_tarefa(self, id):
+        linha = self._ligacao().execute("SELECT * FROM tarefas WHERE id = ?", (id,)).fetchone()
+        if linha is None:
+            return None
+        tarefa = dict(linha)
+        tarefa["resultado"] = json.loads(tarefa["resultado"]) if tarefa["resultado"] else None
+        return tarefa
+
+    def apagar_tarefas(self, antes_de):
+        conn = self._ligacao()
+        with conn:
+            conn.execute("DELETE FROM tarefas WHERE criada_em < ?", (antes_de,))
+
+
+class ArmazenamentoComCache:
+    """Cache de leitura (read-through) com TTL à frente de outro armazenamento
+
+    As escritas invalidam as entradas afetadas. Se o backend falhar, é servida a última
+    versão em cache, mesmo expirada, em vez de um erro ou de um catálogo vazio.
+    """
+
+    def __init__(self, backend, ttl=30.0, max_itens=2000):
+        self.backend = backend
+        self.acertos = 0
+        self.falhas = 0
+        self.obsoletos = 0
+        self._cache = CacheLRU(max_itens=max_itens, ttl=ttl)
+
+    def _ler(self, chave, funcao, *args):
+        valor = self._cache.obter(chave)
+        if valor is not None:
+            self.acertos += 1
+        else:
+            self.falhas += 1
+            try:
+                valor = funcao(*args)
+            except Exception as e:
+                valor = self._cache.obter(chave, expirados=True)
+                if valor is None:
+                    raise
+                self.obsoletos += 1
+                log.warning("armazenamento indisponivel erro=%s a servir dados da cache", e)
+            else:
+                if valor is None:
+                    return None
+                self._cache.guardar(chave, valor)
+        # Quem chama pode alterar o resultado (ex.: contadores pendentes)
+        return copy.deepcopy(valor)
+
+    def _invalidar_listagens(self):
+        self._cache.remover_se(lambda chave: chave[0] != "protocolo")
+
+    def inserir(self, registro):
+        id = self.backend.inserir(registro)
+        self._invalidar_listagens()
+        return id
+
+    def inserir_varios(self, registros):
+        ids = self.backend.inserir_varios(registros)
+        self._invalidar_listagens()
+        return ids
+
+    def obter(self, id, colunas="*"):
+        return self._ler(("protocolo", id, colunas), self.backend.obter, id, colunas)
+
+    def obter_varios(self, ids, colunas="*"):
+        ids = tuple(ids)
+        return self._ler(("varios", ids, colunas), self.backend.obter_varios, ids, colunas)
+
+    def consultar_pagina(self, limite=None, chave=None, colunas="*"):
+        return self._ler(("pagina", limite, chave, colunas), self.backend.consultar_pagina, limite, chave, colunas)
+
+    def pesquisar_texto(self, termo, limite=None, chave=None, colunas="*"):
+        return self._ler(
+            ("pesquisa", termo, limite, chave, colunas), self.backend.pesquisar_texto, termo, limite, chave, colunas
+        )
+
+    def atualizar(self, id, alteracoes):
+        self.backend.atualizar(id, alteracoes)
+        self._cache.remover_se(lambda chave: chave[0] != "protocolo" or chave[1] == id)
+
+    def ajustar_sequencia(self):
+        self.backend.ajustar_sequencia()
+
+    # Tarefas: sem cache, o estado muda noutros workers
+    def criar_tarefa(self, tarefa):
+        return self.backend.criar_tarefa(tarefa)
+
+    def atualizar_tarefa(self, id, alteracoes, estados):
+        return self.backend.atualizar_tarefa(id, alteracoes, estados)
+
+    def obter_tarefa(self, id):
+        return self.backend.obter_tarefa(id)
+
+    def apagar_tarefas(self, antes_de):
+        self.backend.apagar_tarefas(antes_de)
+
+    def incrementar(self, incrementos):
+        try:
+            self.backend.incrementar(incrementos)
+        finally:
+            # Também após uma falha parcial (IncrementoParcialErro): parte já foi escrita
+            ids = {linha["id"] for linha in incrementos}
+            self._cache.remover_se(lambda chave: chave[0] != "protocolo" or chave[1] in ids)
@@ -0,0 +1,74 @@
+"""Cache LRU em memória, limitada por número de itens e/ou bytes, com TTL opcional"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def _tamanho(valor):
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    return 1
+
+
+class CacheLRU:
+    """Cache thread-safe com evicção do item usado há mais tempo"""
+
+    def __init__(self, max_itens=None, max_bytes=None, ttl=None):
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        # Itens expirados não são devolvidos, mas ficam até serem evictos (ver obter(expirados=True))
+        self.ttl = ttl
+        self.bytes = 0
+        self._itens = OrderedDict()   # chave -> (valor, tamanho, expira_em)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def __contains__(self, chave):
+        return chave in self._itens
+
+    def obter(self, chave, default=None, expirados=False):
+        """Retorna o valor em cache (e marca-o como usado recentemente); expirados=True aceita itens fora do TTL"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or (not expirados and item[2] is not None and item[2] < time.monotonic()):
+                return default
+            self._itens.move_to_end(chave)
+            return item[0]
+
+    def guardar(self, chave, valor, tamanho=None):
+        """Guarda um valor, removendo os itens mais antigos se os limites forem ultrapassados"""
+        tamanho = _tamanho(valor) if tamanho is None else tamanho
+        if self.max_bytes is not None and tamanho > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self.bytes -= anterior[1]
+            expira_em = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._itens[chave] = (valor, tamanho, expira_em)
+            self.bytes += tamanho
+            while (self.max_itens is not None and len(self._itens) > self.max_itens) \
+                    or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, removido, _) = self._itens.popitem(last=False)
+                self.bytes -= removido
+
+    def remover(self, chave):
+        """Remove uma chave da cache (se existir)"""
+        with self._lock:
+            item = self._itens.pop(chave, None)
+            if item is not None:
+                self.bytes -= item[1]
+
+    def remover_se(self, predicado):
+        """Remove todas as chaves para as quais predicado(chave) é verdadeiro"""
+        with self._lock:
+            for chave in [c for c in self._itens if predicado(c)]:
+                self.bytes -= self._itens.pop(chave)[1]
+
+    def limpar(self):
+        """Esvazia a cache"""
+        with self._lock:
+            self._itens.clear()
+            self.bytes = 0
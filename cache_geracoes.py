@@ -0,0 +1,86 @@
+"""Cache persistente (SQLite) das gerações do LLM, endereçada pelo conteúdo do pedido"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from pesquisa import normalizar
+
+
+def _normalizar_texto(texto):
+    return re.sub(r"\s+", " ", normalizar(texto)).strip(" .!?")
+
+
+class CacheGeracoes:
+    """Guarda protocolos gerados por chave (pedido normalizado + modelo + temperatura), com TTL e limite de tamanho"""
+
+    def __init__(self, caminho, ttl=7 * 24 * 3600, max_entradas=2000):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.acertos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geracoes (
+                chave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                usado_em REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geracoes_usado_em ON geracoes (usado_em)")
+        self._conn.commit()
+
+    @staticmethod
+    def chave(titulo, resumo, anos, disciplinas, modelo, temperatura):
+        """Chave do pedido: textos normalizados, anos e disciplinas ordenados"""
+        pedido = {
+            "titulo": _normalizar_texto(titulo),
+            "resumo": _normalizar_texto(resumo),
+            "anos": sorted(_normalizar_texto(a) for a in anos or []),
+            "disciplinas": sorted(_normalizar_texto(d) for d in disciplinas or []),
+            "modelo": modelo,
+            "temperatura": temperatura,
+        }
+        return hashlib.sha256(json.dumps(pedido, sort_keys=True).encode()).hexdigest()
+
+    def obter(self, chave):
+        """Retorna o protocolo em cache (ou None se não existir ou tiver expirado)"""
+        agora = time.time()
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT valor, criado_em FROM geracoes WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None or agora - linha[1] > self.ttl:
+                self.falhas += 1
+                return None
+            self._conn.execute("UPDATE geracoes SET usado_em = ? WHERE chave = ?", (agora, chave))
+            self._conn.commit()
+            self.acertos += 1
+        return json.loads(linha[0])
+
+    def guardar(self, chave, protocolo):
+        """Guarda um protocolo e remove entradas expiradas ou, acima do limite, as menos usadas"""
+        agora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geracoes (chave, valor, criado_em, usado_em) VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(protocolo, ensure_ascii=False), agora, agora)
+            )
+            self._conn.execute("DELETE FROM geracoes WHERE criado_em < ?", (agora - self.ttl,))
+            self._conn.execute("""
+                DELETE FROM geracoes WHERE chave IN (
+                    SELECT chave FROM geracoes ORDER BY usado_em DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entradas,))
+            self._conn.commit()
+
+    def estatisticas(self):
+        """Acertos, falhas e número de entradas"""
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM geracoes").fetchone()[0]
+        return {"acertos": self.acertos, "falhas": self.falhas, "entradas": entradas}
@@ -0,0 +1,228 @@
+"""Camada resiliente sobre o cliente Groq: prazos, retries com backoff, limite de concorrência e disjuntor"""
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class GroqIndisponivelErro(Exception):
+    """O pedido ao Groq não foi (ou não pôde ser) concluído dentro das políticas definidas"""
+
+
+class CircuitoAbertoErro(GroqIndisponivelErro):
+    """O disjuntor está aberto: o Groq falhou repetidamente e os pedidos falham de imediato"""
+
+
+class Disjuntor:
+    """Circuit breaker: abre após N falhas seguidas e deixa passar um pedido de teste após a pausa"""
+
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    SEMI_ABERTO = "semi_aberto"
+
+    def __init__(self, limite_falhas=5, pausa=30.0):
+        self.limite_falhas = limite_falhas
+        self.pausa = pausa
+        self.estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """Indica se um pedido pode avançar (no estado semi-aberto, apenas um de cada vez)"""
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.ABERTO and time.monotonic() - self._aberto_em >= self.pausa:
+                self.estado = self.SEMI_ABERTO
+                return True
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self.estado = self.FECHADO
+            self._falhas = 0
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            if self.estado == self.SEMI_ABERTO or self._falhas >= self.limite_falhas:
+                self.estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+    def inconclusivo(self):
+        """O pedido terminou sem dizer nada sobre o Groq (sem vaga, cancelado, erro local)
+
+        Se era o pedido de teste, o disjuntor volta a aberto com uma nova pausa: de outro modo
+        ficaria semi-aberto para sempre e recusaria todos os pedidos seguintes.
+        """
+        with self._lock:
+            if self.estado == self.SEMI_ABERTO:
+                self.estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+
+def _retentavel(erro):
+    """429, 5xx, timeouts e erros de ligação justificam nova tentativa"""
+    status = getattr(erro, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(erro).__name__ in ("APITimeoutError", "APIConnectionError", "TimeoutError")
+
+
+def _erro_cliente(erro):
+    """4xx (exceto 429): o Groq respondeu, o problema está no pedido"""
+    status = getattr(erro, "status_code", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def _retry_after(erro):
+    resposta = getattr(erro, "response", None)
+    try:
+        return float(resposta.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _uso(resposta):
+    """Tokens gastos (objeto usage) numa resposta ou no último chunk de um stream"""
+    uso = getattr(resposta, "usage", None)
+    if uso is None:
+        uso = getattr(getattr(resposta, "x_groq", None), "usage", None)
+    return uso
+
+
+class ClienteGroqResiliente:
+    """Envolve groq.Groq e aplica as políticas a chat.completions.create
+
+    ao_terminar(operacao, duracao, resultado, uso) e ao_repetir(operacao) permitem
+    registar métricas de cada pedido sem acoplar este módulo a uma biblioteca.
+    """
+
+    def __init__(self, cliente, timeout=60.0, tentativas=3, backoff_base=1.0, backoff_max=20.0,
+                 max_concorrencia=4, disjuntor=None, ao_terminar=None, ao_repetir=None):
+        self.cliente = cliente
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.disjuntor = disjuntor or Disjuntor()
+        self.ao_terminar = ao_terminar
+        self.ao_repetir = ao_repetir
+        self._semaforo = threading.BoundedSemaphore(max_concorrencia)
+
+    def definir_concorrencia(self, max_concorrencia):
+        """Altera o limite de pedidos simultâneos (só deve ser usado sem pedidos em curso)"""
+        self._semaforo = threading.BoundedSemaphore(max_concorrencia)
+
+    def _espera(self, tentativa, erro):
+        """Backoff exponencial com jitter total, respeitando Retry-After quando existe"""
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+        return max(espera, _retry_after(erro) or 0)
+
+    def _terminar(self, operacao, inicio, resultado, uso=None):
+        if self.ao_terminar:
+            self.ao_terminar(operacao, time.monotonic() - inicio, resultado, uso)
+
+    def completar(self, operacao="chat", timeout=None, **kwargs):
+        """chat.completions.create com prazo total, retries, limite de concorrência e disjuntor"""
+        inicio = time.monotonic()
+        prazo = inicio + (timeout or self.timeout)
+
+        if not self.disjuntor.permitir():
+            self._terminar(operacao, inicio, "circuito_aberto")
+            raise CircuitoAbertoErro("Groq indisponível (disjuntor aberto)")
+
+        if not self._semaforo.acquire(timeout=max(0, prazo - time.monotonic())):
+            self.disjuntor.inconclusivo()
+            self._terminar(operacao, inicio, "sem_vaga")
+            raise GroqIndisponivelErro("Demasiados pedidos ao Groq em curso")
+        libertar = True
+        # O disjuntor tem de ser informado em todas as saídas (ver Disjuntor.inconclusivo)
+        informado = False
+        try:
+            tentativa = 0
+            while True:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    informado = True
+                    self.disjuntor.falha()
+                    self._terminar(operacao, inicio, "prazo")
+                    raise GroqIndisponivelErro("Prazo do pedido ao Groq excedido")
+                try:
+                    resposta = self.cliente.chat.completions.create(timeout=restante, **kwargs)
+                except Exception as e:
+                    tentativa += 1
+                    if not _retentavel(e):
+                        if _erro_cliente(e):
+                            informado = True
+                            self.disjuntor.sucesso()
+                        self._terminar(operacao, inicio, "erro")
+                        raise
+                    espera = self._espera(tentativa, e)
+                    if tentativa >= self.tentativas or time.monotonic() + espera >= prazo:
+                        informado = True
+                        self.disjuntor.falha()
+                        self._terminar(operacao, inicio, "erro")
+                        raise
+                    log.warning("groq falhou operacao=%s erro=%s nova_tentativa_em=%.1fs",
+                                operacao, type(e).__name__, espera)
+                    if self.ao_repetir:
+                        self.ao_repetir(operacao)
+                    time.sleep(espera)
+                    continue
+
+                if kwargs.get("stream"):
+                    # Em streaming a vaga e o disjuntor ficam a cargo de _acompanhar_stream
+                    libertar = False
+                    informado = True
+                    return self._acompanhar_stream(resposta, operacao, inicio, prazo)
+                informado = True
+                self.disjuntor.sucesso()
+                self._terminar(operacao, inicio, "ok", _uso(resposta))
+                return resposta
+        finally:
+            if not informado:
+                self.disjuntor.inconclusivo()
+            if libertar:
+                self._semaforo.release()
+
+    def _acompanhar_stream(self, stream, operacao, inicio, prazo):
+        uso = None
+        resultado = "erro"
+        recebidos = 0
+        informado = False
+        try:
+            for chunk in stream:
+                # O timeout do cliente HTTP é por leitura: um stream que vai pingando nunca o
+                # atingiria, por isso o prazo total do pedido é verificado a cada chunk
+                if time.monotonic() >= prazo:
+                    resultado = "prazo"
+                    fechar = getattr(stream, "close", None)
+                    if fechar:
+                        fechar()
+                    raise GroqIndisponivelErro("Prazo do pedido ao Groq excedido")
+                recebidos += 1
+                uso = _uso(chunk) or uso
+                yield chunk
+            informado = True
+            self.disjuntor.sucesso()
+            resultado = "ok"
+        except GeneratorExit:
+            # O cliente desligou-se a meio: não é uma falha do Groq (e, se já enviou dados, respondeu)
+            resultado = "cancelado"
+            if recebidos:
+                informado = True
+                self.disjuntor.sucesso()
+            raise
+        except Exception:
+            informado = True
+            self.disjuntor.falha()
+            raise
+        finally:
+            if not informado:
+                self.disjuntor.inconclusivo()
+            self._semaforo.release()
+            self._terminar(operacao, inicio, resultado, uso)
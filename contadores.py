@@ -0,0 +1,109 @@
+"""Buffer write-behind para os contadores (gostos, nao_gostos, visualizacoes)"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class BufferContadores:
+    """Acumula incrementos em memória e aplica-os em lote, periodicamente ou ao atingir um limite"""
+
+    def __init__(self, aplicar_lote, intervalo=5.0, limite=200):
+        # aplicar_lote({id: {campo: delta}}) deve aplicar tudo atomicamente ou lançar exceção;
+        # se a exceção tiver `pendentes` (ids), só esses ficaram por aplicar
+        self.aplicar_lote = aplicar_lote
+        self.intervalo = intervalo
+        self.limite = limite
+        self._lock = threading.Lock()
+        self._lock_descarga = threading.Lock()
+        self._pendentes = defaultdict(Counter)   # id -> {campo: delta}
+        self._em_voo = {}
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def incrementar(self, id, campo, delta=1):
+        """Regista um incremento; é aplicado na base de dados na próxima descarga"""
+        with self._lock:
+            self._pendentes[id][campo] += delta
+            cheio = len(self._pendentes) >= self.limite
+        if cheio:
+            self._acordar.set()
+
+    def pendentes(self, id):
+        """Incrementos ainda não refletidos na base de dados, por campo"""
+        with self._lock:
+            resultado = Counter(self._pendentes.get(id))
+            resultado.update(self._em_voo.get(id, {}))
+            return dict(resultado)
+
+    def instantaneo(self):
+        """Cópia de todos os incrementos ainda não refletidos na base de dados: {id: {campo: delta}}"""
+        with self._lock:
+            resultado = defaultdict(Counter)
+            for origem in (self._pendentes, self._em_voo):
+                for id, deltas in origem.items():
+                    resultado[id].update(deltas)
+            return {id: dict(deltas) for id, deltas in resultado.items()}
+
+    @contextmanager
+    def descarga_suspensa(self):
+        """Nenhuma descarga corre dentro do bloco: este processo não altera os contadores na base de dados"""
+        with self._lock_descarga:
+            yield
+
+    def aplicar_pendentes(self, protocolo: dict):
+        """Soma os incrementos pendentes aos contadores de um protocolo lido da base de dados"""
+        if protocolo and protocolo.get("id") is not None:
+            for campo, delta in self.pendentes(protocolo["id"]).items():
+                protocolo[campo] = (protocolo.get(campo) or 0) + delta
+        return protocolo
+
+    def descarregar(self):
+        """Aplica os incrementos acumulados; em caso de erro, voltam para o buffer"""
+        with self._lock_descarga:
+            with self._lock:
+                if not self._pendentes:
+                    return 0
+                self._em_voo = dict(self._pendentes)
+                self._pendentes = defaultdict(Counter)
+            lote = self._em_voo
+            try:
+                self.aplicar_lote(lote)
+            except Exception as e:
+                log.error("erro ao descarregar contadores protocolos=%d erro=%s", len(lote), e)
+                pendentes = getattr(e, "pendentes", None)
+                with self._lock:
+                    for id, deltas in lote.items():
+                        # Os já aplicados não voltam ao buffer (seriam contados duas vezes)
+                        if pendentes is None or id in pendentes:
+                            self._pendentes[id].update(deltas)
+                    self._em_voo = {}
+                return 0
+            with self._lock:
+                self._em_voo = {}
+            return len(lote)
+
+    def _ciclo(self):
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            self.descarregar()
+
+    def iniciar(self):
+        """Arranca a thread de descarga periódica"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._ciclo, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Para a thread e descarrega o que ainda estiver pendente (ex.: no encerramento)"""
+        self._parar.set()
+        self._acordar.set()
+        if self._thread:
+            self._thread.join(timeout=self.intervalo + 5)
+        self.descarregar()
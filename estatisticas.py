@@ -0,0 +1,162 @@
+"""Agregados do catálogo mantidos em memória para o dashboard (/api/stats)"""
+import json
+import threading
+import time
+from collections import Counter
+
+# Campos guardados por protocolo (sem textos longos)
+CAMPOS_ESTATISTICAS = ("id", "titulo", "autor", "disciplinas", "anos", "gostos",
+                       "nao_gostos", "visualizacoes", "created_at")
+CONTADORES = ("gostos", "nao_gostos", "visualizacoes")
+
+
+def _lista(valor):
+    """Converte um campo JSON em texto (ou já em lista) numa lista"""
+    if isinstance(valor, list):
+        return valor
+    if isinstance(valor, str):
+        try:
+            valor = json.loads(valor)
+        except ValueError:
+            return []
+        return valor if isinstance(valor, list) else []
+    return []
+
+
+def _popularidade(protocolo):
+    return (protocolo.get("gostos") or 0, protocolo.get("visualizacoes") or 0)
+
+
+class EstatisticasCatalogo:
+    """Total, visualizações, contagem por disciplina, top-N e últimos N, atualizados incrementalmente"""
+
+    def __init__(self, top_n=5, ultimos_n=5):
+        self.top_n = top_n
+        self.ultimos_n = ultimos_n
+        self.construido_em = None
+        self._lock = threading.RLock()
+        self._a_reconstruir = False
+        self._eventos_durante_reconstrucao = []
+        self._limpar()
+
+    def _limpar(self):
+        self._protocolos = {}          # id -> campos de CAMPOS_ESTATISTICAS
+        self._total_visualizacoes = 0
+        self._disciplinas = Counter()
+        self._top = []                 # ids ordenados por (gostos, visualizacoes)
+        self._ultimos = []             # ids ordenados por (created_at, id)
+
+    @property
+    def pronto(self):
+        return self.construido_em is not None
+
+    def _ordenar_top(self):
+        self._top.sort(key=lambda id: (_popularidade(self._protocolos[id]), id), reverse=True)
+        del self._top[self.top_n:]
+
+    def _adicionar(self, protocolo):
+        id = protocolo.get("id")
+        if id is None or id in self._protocolos:
+            return
+        registo = {campo: protocolo.get(campo) for campo in CAMPOS_ESTATISTICAS}
+        registo["disciplinas"] = _lista(registo["disciplinas"])
+        registo["anos"] = _lista(registo["anos"])
+        for campo in CONTADORES:
+            registo[campo] = registo[campo] or 0
+        self._protocolos[id] = registo
+        self._total_visualizacoes += registo["visualizacoes"]
+        self._disciplinas.update(registo["disciplinas"])
+
+        self._top.append(id)
+        self._ordenar_top()
+        self._ultimos.append(id)
+        self._ultimos.sort(key=lambda i: (str(self._protocolos[i]["created_at"] or ""), i), reverse=True)
+        del self._ultimos[self.ultimos_n:]
+
+    def _incrementar(self, id, campo, delta):
+        registo = self._protocolos.get(id)
+        if registo is None or campo not in CONTADORES:
+            return
+        registo[campo] += delta
+        if campo == "visualizacoes":
+            self._total_visualizacoes += delta
+        # Os contadores só crescem: um protocolo só entra no top pelo seu próprio incremento
+        if id in self._top or len(self._top) < self.top_n \
+                or _popularidade(registo) >= _popularidade(self._protocolos[self._top[-1]]):
+            if id not in self._top:
+                self._top.append(id)
+            self._ordenar_top()
+
+    def registar_protocolo(self, protocolo: dict):
+        """Inclui um protocolo acabado de guardar"""
+        with self._lock:
+            self._adicionar(protocolo)
+            if self._a_reconstruir:
+                self._eventos_durante_reconstrucao.append(("protocolo", protocolo))
+
+    def registar_incremento(self, id, campo, delta=1):
+        """Reflete o incremento de um contador (gostos, nao_gostos, visualizacoes)"""
+        with self._lock:
+            self._incrementar(id, campo, delta)
+            if self._a_reconstruir:
+                self._eventos_durante_reconstrucao.append(("incremento", (id, campo, delta)))
+
+    def iniciar_reconstrucao(self):
+        """Marca o início de uma reconstrução: os eventos seguintes serão reaplicados sobre ela
+
+        Os protocolos dados a reconstruir() devem refletir todos os incrementos anteriores e
+        nenhum dos seguintes (ver reconstruir_estatisticas em app.py); por omissão é chamado
+        por reconstruir().
+        """
+        with self._lock:
+            self._a_reconstruir = True
+            self._eventos_durante_reconstrucao = []
+
+    def reconstruir(self, protocolos):
+        """Recalcula todos os agregados a partir de um iterável de protocolos"""
+        with self._lock:
+            if not self._a_reconstruir:
+                self.iniciar_reconstrucao()
+        novo = EstatisticasCatalogo(self.top_n, self.ultimos_n)
+        try:
+            for protocolo in protocolos:
+                novo._adicionar(protocolo)
+        except Exception:
+            with self._lock:
+                self._a_reconstruir = False
+            raise
+        with self._lock:
+            for tipo, dados in self._eventos_durante_reconstrucao:
+                if tipo == "protocolo":
+                    novo._adicionar(dados)
+                else:
+                    novo._incrementar(*dados)
+            self._protocolos = novo._protocolos
+            self._total_visualizacoes = novo._total_visualizacoes
+            self._disciplinas = novo._disciplinas
+            self._top = novo._top
+            self._ultimos = novo._ultimos
+            self._a_reconstruir = False
+            self._eventos_durante_reconstrucao = []
+            self.construido_em = time.time()
+
+    def contadores(self, id):
+        """Contadores conhecidos de um protocolo, ou None se não estiver nos agregados"""
+        with self._lock:
+            registo = self._protocolos.get(id)
+            if registo is None:
+                return None
+            return {campo: registo[campo] for campo in CONTADORES}
+
+    def resumo(self):
+        """Snapshot no formato do endpoint /api/stats"""
+        with self._lock:
+            return {
+                "total_protocolos": len(self._protocolos),
+                "total_visualizacoes": self._total_visualizacoes,
+                "mais_populares": [dict(self._protocolos[id]) for id in self._top],
+                "por_disciplina": [
+                    {"disciplina": k, "count": v} for k, v in self._disciplinas.most_common()
+                ],
+                "ultimos": [dict(self._protocolos[id]) for id in self._ultimos],
+            }
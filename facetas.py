@@ -0,0 +1,201 @@
+"""Índice de facetas (disciplina, ano) em memória: um bitset por valor, para filtros e contagens rápidos"""
+import re
+import threading
+import time
+
+from estatisticas import _lista
+from pesquisa import normalizar
+
+# Faceta -> campo do protocolo
+FACETAS = {"disciplinas": "disciplinas", "anos": "anos"}
+
+_NAO_ALFANUMERICO = re.compile(r"[^a-z0-9]")
+
+
+def chave_faceta(valor):
+    """Forma canónica de um valor: "Físico-Química" e "fisico quimica" -> "fisicoquimica", "8.º ano" -> "8oano" """
+    return _NAO_ALFANUMERICO.sub("", normalizar(valor))
+
+
+def _posicoes(bits):
+    """Posições dos bits a 1 (por ordem crescente)"""
+    binario = bin(bits)[:1:-1]
+    posicoes = []
+    i = binario.find("1")
+    while i != -1:
+        posicoes.append(i)
+        i = binario.find("1", i + 1)
+    return posicoes
+
+
+class IndiceFacetas:
+    """Bitsets (int) por valor de disciplina e ano, sobre posições densas atribuídas a cada protocolo
+
+    Os filtros combinam-se com OR dentro de uma faceta e AND entre facetas. As contagens são
+    disjuntivas: cada faceta é contada com os filtros das outras, para se poder alargar a escolha.
+    """
+
+    def __init__(self):
+        self.construido_em = None
+        self._lock = threading.RLock()
+        self._limpar()
+        self._a_reconstruir = False
+        self._alterados_durante_reconstrucao = {}
+
+    def _limpar(self):
+        self._bits = {faceta: {} for faceta in FACETAS}      # faceta -> chave -> bitset
+        self._rotulos = {faceta: {} for faceta in FACETAS}   # faceta -> chave -> valor apresentado
+        self._posicao = {}                                   # id -> posição
+        self._ordem = []                                     # posição -> (created_at, id)
+        self._valores = {}                                   # id -> {faceta: [chaves]}
+        self.todos = 0
+
+    @property
+    def pronto(self):
+        return self.construido_em is not None
+
+    def __len__(self):
+        return len(self._valores)
+
+    def _remover(self, id):
+        valores = self._valores.pop(id, None)
+        if valores is None:
+            return
+        bit = 1 << self._posicao[id]
+        self.todos &= ~bit
+        for faceta, chaves in valores.items():
+            for chave in chaves:
+                restantes = self._bits[faceta][chave] & ~bit
+                if restantes:
+                    self._bits[faceta][chave] = restantes
+                else:
+                    del self._bits[faceta][chave]
+                    del self._rotulos[faceta][chave]
+
+    def _adicionar(self, protocolo):
+        id = protocolo["id"]
+        self._remover(id)
+        posicao = self._posicao.get(id)
+        if posicao is None:
+            # Posições não são reutilizadas; a reconstrução periódica volta a compactá-las
+            posicao = self._posicao[id] = len(self._ordem)
+            self._ordem.append(None)
+        self._ordem[posicao] = (str(protocolo.get("created_at") or ""), id)
+        bit = 1 << posicao
+        self.todos |= bit
+        valores = {}
+        for faceta, campo in FACETAS.items():
+            chaves = valores[faceta] = []
+            for valor in _lista(protocolo.get(campo)):
+                chave = chave_faceta(valor)
+                if not chave or chave in chaves:
+                    continue
+                chaves.append(chave)
+                self._bits[faceta][chave] = self._bits[faceta].get(chave, 0) | bit
+                self._rotulos[faceta].setdefault(chave, str(valor).strip())
+        self._valores[id] = valores
+
+    def adicionar(self, protocolo: dict):
+        """Adiciona (ou substitui) um protocolo no índice"""
+        if protocolo.get("id") is None:
+            return
+        with self._lock:
+            self._adicionar(protocolo)
+            if self._a_reconstruir:
+                self._alterados_durante_reconstrucao[protocolo["id"]] = protocolo
+
+    def remover(self, id):
+        """Remove um protocolo do índice"""
+        with self._lock:
+            self._remover(id)
+            if self._a_reconstruir:
+                self._alterados_durante_reconstrucao[id] = None
+
+    def iniciar_reconstrucao(self):
+        """Chamado antes de percorrer o catálogo, se os protocolos só chegarem a reconstruir() depois"""
+        with self._lock:
+            self._a_reconstruir = True
+            self._alterados_durante_reconstrucao = {}
+
+    def reconstruir(self, protocolos):
+        """Reconstrói o índice a partir de um iterável de protocolos"""
+        with self._lock:
+            if not self._a_reconstruir:
+                self.iniciar_reconstrucao()
+        novo = IndiceFacetas()
+        try:
+            for protocolo in protocolos:
+                if protocolo.get("id") is not None:
+                    novo._adicionar(protocolo)
+        except Exception:
+            with self._lock:
+                self._a_reconstruir = False
+            raise
+        with self._lock:
+            # Reaplicar o que foi guardado enquanto o catálogo era percorrido
+            for id, protocolo in self._alterados_durante_reconstrucao.items():
+                if protocolo is None:
+                    novo._remover(id)
+                else:
+                    novo._adicionar(protocolo)
+            self._bits = novo._bits
+            self._rotulos = novo._rotulos
+            self._posicao = novo._posicao
+            self._ordem = novo._ordem
+            self._valores = novo._valores
+            self.todos = novo.todos
+            self._a_reconstruir = False
+            self._alterados_durante_reconstrucao = {}
+            self.construido_em = time.time()
+
+    def conjunto(self, ids):
+        """Bitset dos ids indicados (ignora os que não estão no índice)"""
+        bits = 0
+        with self._lock:
+            for id in ids:
+                posicao = self._posicao.get(id)
+                if posicao is not None and id in self._valores:
+                    bits |= 1 << posicao
+        return bits
+
+    def _filtro(self, faceta, valores):
+        bits = 0
+        for valor in valores:
+            bits |= self._bits[faceta].get(chave_faceta(valor), 0)
+        return bits
+
+    def filtrar(self, filtros, base=None):
+        """Bitset de `base` (por omissão, todos) que satisfaz os filtros {faceta: [valores]}"""
+        with self._lock:
+            bits = self.todos if base is None else base
+            for faceta, valores in filtros.items():
+                if faceta in FACETAS and valores:
+                    bits &= self._filtro(faceta, valores)
+            return bits
+
+    def contar(self, base, filtros=None):
+        """{faceta: [{"valor", "count"}]} em `base`, cada faceta com os filtros das restantes"""
+        filtros = filtros or {}
+        contagens = {}
+        with self._lock:
+            for faceta in FACETAS:
+                outros = {f: v for f, v in filtros.items() if f != faceta}
+                bits = self.filtrar(outros, base)
+                valores = [
+                    {"valor": self._rotulos[faceta][chave], "count": (bits & conjunto).bit_count()}
+                    for chave, conjunto in self._bits[faceta].items()
+                ]
+                valores = [v for v in valores if v["count"]]
+                valores.sort(key=lambda v: (-v["count"], normalizar(v["valor"])))
+                contagens[faceta] = valores
+        return contagens
+
+    def ids(self, bits, ordem=None):
+        """Ids do bitset: pela ordem de `ordem` (ex.: relevância) ou do mais recente para o mais antigo"""
+        with self._lock:
+            if ordem is not None:
+                presentes = set(_posicoes(bits))
+                return [id for id in ordem if self._posicao.get(id) in presentes]
+            chaves = [self._ordem[posicao] for posicao in _posicoes(bits)]
+        chaves.sort(reverse=True)
+        return [id for _, id in chaves]
@@ -0,0 +1,345 @@
+"""Benchmark reprodutível do portal, totalmente offline (SQLite + Groq falso)
+
+Arranca o servidor Groq falso, semeia uma base SQLite com N protocolos, lança o portal
+(gunicorn, como no Procfile, ou o servidor do Flask) e gera tráfego com uma mistura
+realista de pedidos. Reporta débito e p50/p95/p99 por endpoint e compara com uma baseline.
+
+Uso:
+    python -m ferramentas.benchmark --protocolos 2000 --clientes 16 --duracao 30 --guardar-baseline bench.json
+    python -m ferramentas.benchmark --baseline bench.json --limiar 0.2     # termina com 1 se regredir
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from armazenamento import ArmazenamentoSQLite  # noqa: E402
+from registos import criar_registo  # noqa: E402
+from ferramentas import fake_groq  # noqa: E402
+
+# Mistura de tráfego (pesos relativos): página inicial, pesquisa, leituras por QR Code, gostos, geração
+MISTURA = {
+    "stats": 15,
+    "pesquisa": 30,
+    "leitura_qr": 40,
+    "gosto": 12,
+    "geracao": 3,
+}
+
+_TEMAS = [
+    ("Vulcão de bicarbonato", "Reação ácido-base entre vinagre e bicarbonato de sódio", "Química"),
+    ("Circuito elétrico simples", "Montagem de um circuito com pilha, fios e lâmpada", "Física"),
+    ("Germinação de feijão", "Observação das fases da germinação em algodão húmido", "Biologia"),
+    ("Densidade dos líquidos", "Torre de líquidos com mel, água e óleo", "Física"),
+    ("Indicador de couve roxa", "Indicador natural de pH a partir de couve roxa", "Química"),
+    ("Fotossíntese em elódea", "Libertação de oxigénio por plantas aquáticas à luz", "Biologia"),
+    ("Erosão do solo", "Efeito da chuva em solos com e sem vegetação", "Geologia"),
+    ("Pêndulo simples", "Relação entre comprimento do fio e período de oscilação", "Matemática"),
+]
+_ANOS = ["5º ano", "6º ano", "7º ano", "8º ano", "9º ano", "10º ano"]
+_TERMOS = ["vulcão", "circuito", "feijão", "densidade", "couve", "fotossíntese", "erosão", "pêndulo",
+           "reação", "luz", "água", "ácido", "plantas", "energia"]
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def semear(caminho, n, semente):
+    """Cria uma base SQLite com n protocolos (determinística para a mesma semente)"""
+    aleatorio = random.Random(semente)
+    base = ArmazenamentoSQLite(caminho)
+    exemplo = fake_groq.PROTOCOLO_EXEMPLO
+    registos = []
+    for i in range(n):
+        titulo, resumo, disciplina = _TEMAS[i % len(_TEMAS)]
+        protocolo = {
+            **exemplo,
+            "titulo": f"{titulo} #{i}",
+            "resumo": resumo,
+            "autor": f"Professor {aleatorio.randint(1, 50)}",
+            "disciplinas": [disciplina] + aleatorio.sample(["Ciências Naturais", "Matemática"], aleatorio.randint(0, 1)),
+            "anos": aleatorio.sample(_ANOS, aleatorio.randint(1, 3)),
+        }
+        registo = criar_registo(protocolo)
+        registo.update({
+            "gostos": aleatorio.randint(0, 200),
+            "nao_gostos": aleatorio.randint(0, 20),
+            "visualizacoes": aleatorio.randint(0, 5000),
+            "created_at": f"2025-{1 + i * 12 // max(n, 1):02d}-{1 + i % 28:02d}T{i % 24:02d}:00:00+00:00",
+        })
+        registos.append(registo)
+        if len(registos) == 500:
+            base.inserir_varios(registos)
+            registos = []
+    if registos:
+        base.inserir_varios(registos)
+
+
+def arrancar_portal(porta, ambiente, servidor, threads, worker_class="gthread"):
+    """Lança o portal num subprocesso e espera que responda"""
+    if servidor == "gunicorn" and shutil.which("gunicorn"):
+        # A classe de worker vai por ambiente: o gunicorn.conf.py aplica o monkey patching do gevent
+        ambiente = {**ambiente, "GUNICORN_WORKER_CLASS": worker_class}
+        comando = ["gunicorn", "app:app", "--threads", str(threads),
+                   "--bind", f"127.0.0.1:{porta}", "--log-level", "warning"]
+    else:
+        comando = [sys.executable, "app.py"]
+    processo = subprocess.Popen(comando, cwd=RAIZ, env={**os.environ, **ambiente, "PORT": str(porta)},
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.time() + 30
+    while time.time() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"O portal terminou ao arrancar (código {processo.returncode})")
+        try:
+            ligacao = http.client.HTTPConnection("127.0.0.1", porta, timeout=2)
+            ligacao.request("GET", "/readyz")
+            if ligacao.getresponse().status == 200:
+                return processo
+        except OSError:
+            pass
+        time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError("O portal não respondeu em 30s")
+
+
+class Cliente:
+    """Um utilizador simulado, com ligação keep-alive própria"""
+
+    def __init__(self, porta, n_protocolos, aleatorio, resultados, lock):
+        self.porta = porta
+        self.n = n_protocolos
+        self.aleatorio = aleatorio
+        self.resultados = resultados
+        self.lock = lock
+        self.ligacao = None
+
+    def _pedido(self, nome, metodo, caminho, corpo=None):
+        cabecalhos = {"Content-Type": "application/json"} if corpo is not None else {}
+        dados = json.dumps(corpo).encode() if corpo is not None else None
+        inicio = time.perf_counter()
+        try:
+            if self.ligacao is None:
+                self.ligacao = http.client.HTTPConnection("127.0.0.1", self.porta, timeout=120)
+            self.ligacao.request(metodo, caminho, body=dados, headers=cabecalhos)
+            resposta = self.ligacao.getresponse()
+            conteudo = resposta.read()
+            ok = resposta.status < 400
+        except (OSError, http.client.HTTPException):
+            self.ligacao = None
+            conteudo, ok = b"", False
+        duracao = time.perf_counter() - inicio
+        with self.lock:
+            serie = self.resultados.setdefault(nome, {"latencias": [], "erros": 0})
+            serie["latencias"].append(duracao)
+            if not ok:
+                serie["erros"] += 1
+        return conteudo
+
+    def _id_popular(self):
+        # Poucos protocolos concentram a maioria das leituras (cartazes com QR Code numa escola)
+        return min(self.n, int(self.aleatorio.paretovariate(1.2))) if self.n else 1
+
+    def executar(self, cenario):
+        if cenario == "stats":
+            self._pedido("GET /api/stats", "GET", "/api/stats")
+        elif cenario == "pesquisa":
+            termo = self.aleatorio.choice(_TERMOS)
+            corpo = self._pedido("GET /search_protocols", "GET", f"/search_protocols?q={quote(termo)}")
+            try:
+                cursor = json.loads(corpo).get("proximo_cursor")
+            except ValueError:
+                cursor = None
+            if cursor and self.aleatorio.random() < 0.3:
+                self._pedido("GET /search_protocols (página 2)", "GET",
+                             f"/search_protocols?q={quote(termo)}&cursor={cursor}")
+        elif cenario == "leitura_qr":
+            id = self._id_popular()
+            self._pedido("GET /protocolo/<id>", "GET", f"/protocolo/{id}")
+            self._pedido("GET /protocolo/<id>/qr.svg", "GET", f"/protocolo/{id}/qr.svg")
+            self._pedido("GET /api/protocolo/<id>/contadores", "GET", f"/api/protocolo/{id}/contadores")
+        elif cenario == "gosto":
+            id = self._id_popular()
+            tipo = "gosto" if self.aleatorio.random() < 0.85 else "nao_gosto"
+            self._pedido("POST /avaliar_protocolo/<id>", "POST", f"/avaliar_protocolo/{id}", {"tipo": tipo})
+        elif cenario == "geracao":
+            titulo, resumo, disciplina = self.aleatorio.choice(_TEMAS)
+            self._pedido("POST /generate_protocol", "POST", "/generate_protocol", {
+                # Sufixo aleatório: cada pedido passa pelo Groq (falso) em vez da cache de gerações
+                "titulo": f"{titulo} {self.aleatorio.randint(0, 10 ** 9)}",
+                "resumo": resumo, "anos": ["7º ano"], "disciplinas": [disciplina], "autor": "Benchmark",
+            })
+
+
+def _percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, int(round(p / 100 * len(valores_ordenados))) - 1))
+    return valores_ordenados[indice]
+
+
+def resumir(resultados, duracao):
+    resumo = {}
+    for nome, serie in sorted(resultados.items()):
+        latencias = sorted(serie["latencias"])
+        resumo[nome] = {
+            "pedidos": len(latencias),
+            "erros": serie["erros"],
+            "rps": len(latencias) / duracao,
+            "p50_ms": _percentil(latencias, 50) * 1000,
+            "p95_ms": _percentil(latencias, 95) * 1000,
+            "p99_ms": _percentil(latencias, 99) * 1000,
+        }
+    return resumo
+
+
+def gerar_trafego(porta, n_protocolos, clientes, duracao, aquecimento, semente, mistura):
+    """Corre `clientes` utilizadores durante `duracao` segundos (após o aquecimento)"""
+    cenarios = list(mistura)
+    pesos = [mistura[c] for c in cenarios]
+    lock = threading.Lock()
+    resultados = {}
+    fim_aquecimento = time.time() + aquecimento
+    fim = fim_aquecimento + duracao
+
+    def utilizador(indice):
+        aleatorio = random.Random(semente * 1000 + indice)
+        cliente = Cliente(porta, n_protocolos, aleatorio, {}, threading.Lock())
+        while time.time() < fim:
+            if time.time() >= fim_aquecimento:
+                # Depois do aquecimento passa a registar nos resultados partilhados
+                cliente.resultados, cliente.lock = resultados, lock
+            cliente.executar(aleatorio.choices(cenarios, pesos)[0])
+
+    threads = [threading.Thread(target=utilizador, args=(i,), daemon=True) for i in range(clientes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resumir(resultados, duracao)
+
+
+def comparar(atual, baseline, limiar):
+    """Lista de regressões: p95 acima de (1 + limiar) × baseline ou débito abaixo de (1 - limiar) × baseline"""
+    regressoes = []
+    for nome, base in baseline.get("endpoints", {}).items():
+        medido = atual["endpoints"].get(nome)
+        if medido is None:
+            continue
+        if base["p95_ms"] > 0 and medido["p95_ms"] > base["p95_ms"] * (1 + limiar):
+            regressoes.append(f"{nome}: p95 {base['p95_ms']:.1f} → {medido['p95_ms']:.1f} ms")
+        if base["rps"] > 0 and medido["rps"] < base["rps"] * (1 - limiar):
+            regressoes.append(f"{nome}: débito {base['rps']:.1f} → {medido['rps']:.1f} pedidos/s")
+        if medido["erros"] > base["erros"] and medido["erros"] > medido["pedidos"] * 0.01:
+            regressoes.append(f"{nome}: {medido['erros']} erros (baseline {base['erros']})")
+    return regressoes
+
+
+def imprimir(resumo):
+    print(f"{'endpoint':<40} {'pedidos':>8} {'erros':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for nome, r in resumo.items():
+        print(f"{nome:<40} {r['pedidos']:>8} {r['erros']:>6} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do portal (SQLite + Groq falso)")
+    parser.add_argument("--protocolos", type=int, default=2000, help="protocolos semeados")
+    parser.add_argument("--clientes", type=int, default=16, help="utilizadores simultâneos")
+    parser.add_argument("--duracao", type=float, default=30, help="segundos de medição")
+    parser.add_argument("--aquecimento", type=float, default=5, help="segundos antes de medir")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--servidor", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--threads", type=int, default=8, help="threads do gunicorn (gthread)")
+    parser.add_argument("--worker-class", choices=("gthread", "gevent"), default="gthread",
+                        help="gevent = modo assíncrono (ver gunicorn.conf.py)")
+    parser.add_argument("--latencia-groq", type=float, default=2.0, help="latência do Groq falso (s)")
+    parser.add_argument("--mistura", type=json.loads, default=MISTURA,
+                        help='pesos dos cenários em JSON, ex.: \'{"leitura_qr": 1}\'')
+    parser.add_argument("--saida", help="guardar o resultado (JSON) neste ficheiro")
+    parser.add_argument("--baseline", help="comparar com este resultado e falhar se regredir")
+    parser.add_argument("--guardar-baseline", help="guardar este resultado como baseline")
+    parser.add_argument("--limiar", type=float, default=0.2, help="regressão tolerada (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix="benchmark-portal-")
+    servidor_groq = None
+    portal = None
+    try:
+        print(f"🌱 A semear {args.protocolos} protocolos...")
+        caminho_db = os.path.join(diretorio, "protocolos.db")
+        semear(caminho_db, args.protocolos, args.semente)
+
+        fake_groq.Configuracao.latencia = args.latencia_groq
+        porta_groq = _porta_livre()
+        servidor_groq = fake_groq.iniciar(porta_groq, em_segundo_plano=True)
+
+        porta = _porta_livre()
+        portal = arrancar_portal(porta, {
+            "ARMAZENAMENTO": "sqlite",
+            "SQLITE_PATH": caminho_db,
+            "GERACOES_CACHE_PATH": os.path.join(diretorio, "cache_geracoes.db"),
+            "GROQ_API_KEY": "benchmark",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{porta_groq}",
+            "LOG_LEVEL": "WARNING",
+        }, args.servidor, args.threads, args.worker_class)
+
+        print(f"🚦 {args.clientes} clientes durante {args.duracao:.0f}s (+{args.aquecimento:.0f}s de aquecimento)")
+        endpoints = gerar_trafego(porta, args.protocolos, args.clientes, args.duracao,
+                                  args.aquecimento, args.semente, args.mistura)
+    finally:
+        if portal:
+            portal.send_signal(signal.SIGTERM)
+            try:
+                portal.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                portal.kill()
+        if servidor_groq:
+            servidor_groq.shutdown()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+    resultado = {
+        "parametros": {k: v for k, v in vars(args).items()
+                       if k not in ("saida", "baseline", "guardar_baseline", "limiar")},
+        "endpoints": endpoints,
+        "total_rps": sum(r["rps"] for r in endpoints.values()),
+    }
+    imprimir(endpoints)
+    print(f"Total: {resultado['total_rps']:.1f} pedidos/s")
+
+    for caminho in (args.saida, args.guardar_baseline):
+        if caminho:
+            with open(caminho, "w", encoding="utf-8") as f:
+                json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("parametros") != resultado["parametros"]:
+            print("⚠️ Parâmetros diferentes da baseline: a comparação pode não ser justa")
+        regressoes = comparar(resultado, baseline, args.limiar)
+        if regressoes:
+            print(f"❌ Regressões acima de {args.limiar:.0%}:")
+            for regressao in regressoes:
+                print(f"   {regressao}")
+            sys.exit(1)
+        print(f"✅ Sem regressões acima de {args.limiar:.0%} face à baseline")
+
+
+if __name__ == "__main__":
+    main()
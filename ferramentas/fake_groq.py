@@ -0,0 +1,189 @@
+"""Servidor local que imita a API do Groq (chat completions), para testar o portal offline
+
+Uso:
+    python -m ferramentas.fake_groq --porta 8090 --latencia 2 --taxa-429 0.1 --taxa-erros 0.05
+    GROQ_API_KEY=fake GROQ_BASE_URL=http://localhost:8090 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROTOCOLO_EXEMPLO = {
+    "titulo": "Vulcão de Bicarbonato",
+    "subtitulo": "Reações ácido-base",
+    "duracao": "45-50 minutos",
+    "competencias": ["Raciocínio científico", "Trabalho prático"],
+    "objetivos": ["Observar uma reação química", "Identificar os reagentes e produtos"],
+    "contextualizacao": "O fermento da massa dos bolos liberta o mesmo gás que esta experiência.",
+    "resumo": "Reação entre vinagre e bicarbonato de sódio que liberta dióxido de carbono.",
+    "materiais": "- 2 colheres de bicarbonato de sódio\n- 100 mL de vinagre\n- Corante alimentar",
+    "pre_experiencia": "1. O que achas que vai acontecer?\n2. Que gás se forma?",
+    "procedimento": "1. Coloca o bicarbonato no copo. 💡 Observar: cor e textura.\n"
+                    "2. Junta o vinagre. 💡 Observar: formação de espuma.",
+    "pos_experiencia": "1. O que observaste?\n2. Porque se formou espuma?",
+    "resultados_esperados": "Formação de espuma devido à libertação de CO2.",
+    "seguranca": {
+        "nivel_risco": "Baixo",
+        "riscos": "Salpicos de vinagre nos olhos.",
+        "epi": "Óculos de proteção.",
+        "supervisao": "Supervisão de professor.",
+        "cuidados": "Não ingerir os reagentes.",
+        "primeiros_socorros": "Lavar os olhos com água abundante.",
+        "descarte": "Pode ser descartado no lava-loiça.",
+    },
+    "quiz": [
+        {
+            "tipo": "multipla_escolha",
+            "pergunta": "Que gás se liberta?",
+            "opcoes": ["A) Oxigénio", "B) Dióxido de carbono", "C) Hidrogénio", "D) Azoto"],
+            "resposta_correta": "B",
+            "explicacao": "A reação ácido-base liberta CO2.",
+        },
+        {
+            "tipo": "verdadeiro_falso",
+            "afirmacao": "O vinagre é uma base.",
+            "resposta_correta": False,
+            "explicacao": "O vinagre é um ácido (ácido acético).",
+        },
+    ],
+    "diferenciacao": {
+        "simplificacao": ["Fazer a experiência em demonstração"],
+        "aprofundamento": ["Medir o volume de gás libertado"],
+        "inclusao": ["Trabalho em pares"],
+    },
+    "recursos_extras": ["Manual escolar", "Vídeo sobre reações ácido-base"],
+}
+
+
+class Configuracao:
+    latencia = 0.5
+    jitter = 0.0
+    taxa_429 = 0.0
+    taxa_erros = 0.0
+    tokens_por_segundo = 400.0
+
+
+def _conteudo_resposta(pedido):
+    """Protocolo completo, ou só as chaves pedidas em prompts de regeneração por secções"""
+    prompt = " ".join(m.get("content", "") for m in pedido.get("messages", []))
+    chaves = re.search(r"APENAS com as chaves: ([a-z_, ]+)", prompt)
+    if chaves:
+        pedidas = [c.strip() for c in chaves.group(1).split(",")]
+        return json.dumps({c: PROTOCOLO_EXEMPLO.get(c, "") for c in pedidas}, ensure_ascii=False)
+    return json.dumps(PROTOCOLO_EXEMPLO, ensure_ascii=False, indent=2)
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _json(self, status, dados, cabecalhos=None):
+        corpo = json.dumps(dados).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "Not found"}})
+            return
+        pedido = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        time.sleep(max(0.0, Configuracao.latencia + random.uniform(-1, 1) * Configuracao.jitter))
+        sorteio = random.random()
+        if sorteio < Configuracao.taxa_429:
+            self._json(429, {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                       {"retry-after": "1"})
+            return
+        if sorteio < Configuracao.taxa_429 + Configuracao.taxa_erros:
+            self._json(503, {"error": {"message": "Service unavailable"}})
+            return
+
+        conteudo = _conteudo_resposta(pedido)
+        identificador = f"chatcmpl-{uuid.uuid4().hex}"
+        modelo = pedido.get("model", "fake")
+        criado = int(time.time())
+        uso = {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in pedido.get("messages", [])) // 4,
+            "completion_tokens": len(conteudo) // 4,
+        }
+        uso["total_tokens"] = uso["prompt_tokens"] + uso["completion_tokens"]
+
+        if not pedido.get("stream"):
+            self._json(200, {
+                "id": identificador, "object": "chat.completion", "created": criado, "model": modelo,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": conteudo},
+                             "finish_reason": "stop"}],
+                "usage": uso,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        tamanho = 40
+        for i in range(0, len(conteudo), tamanho):
+            chunk = {
+                "id": identificador, "object": "chat.completion.chunk", "created": criado, "model": modelo,
+                "choices": [{"index": 0, "delta": {"content": conteudo[i:i + tamanho]}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(tamanho / 4 / Configuracao.tokens_por_segundo)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def iniciar(porta=8090, em_segundo_plano=False):
+    """Arranca o servidor (numa thread, se em_segundo_plano) e retorna-o"""
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), FakeGroqHandler)
+    servidor.daemon_threads = True
+    if em_segundo_plano:
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Groq falso para testes offline")
+    parser.add_argument("--porta", type=int, default=8090)
+    parser.add_argument("--latencia", type=float, default=Configuracao.latencia,
+                        help="segundos até à primeira resposta")
+    parser.add_argument("--jitter", type=float, default=Configuracao.jitter,
+                        help="variação aleatória da latência (segundos)")
+    parser.add_argument("--taxa-429", type=float, default=Configuracao.taxa_429,
+                        help="fração de pedidos que recebem 429")
+    parser.add_argument("--taxa-erros", type=float, default=Configuracao.taxa_erros,
+                        help="fração de pedidos que recebem 503")
+    parser.add_argument("--tokens-por-segundo", type=float, default=Configuracao.tokens_por_segundo)
+    args = parser.parse_args()
+
+    Configuracao.latencia = args.latencia
+    Configuracao.jitter = args.jitter
+    Configuracao.taxa_429 = args.taxa_429
+    Configuracao.taxa_erros = args.taxa_erros
+    Configuracao.tokens_por_segundo = args.tokens_por_segundo
+
+    servidor = iniciar(args.porta)
+    print(f"🤖 Groq falso em http://127.0.0.1:{args.porta}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Geração de protocolos em lote (CSV ou JSONL), com concorrência e orçamento de tokens por minuto"""
+import csv
+import json
+import re
+import threading
+import time
+
+_SEPARADORES_LISTA = re.compile(r"\s*[;|,]\s*")
+
+
+def _lista(valor):
+    if isinstance(valor, list):
+        return [str(v).strip() for v in valor if str(v).strip()]
+    if not valor:
+        return []
+    return [v for v in _SEPARADORES_LISTA.split(str(valor).strip()) if v]
+
+
+def _pedido(dados):
+    if not isinstance(dados, dict):
+        raise ValueError("não é um objeto")
+    pedido = {
+        "titulo": str(dados.get("titulo") or "").strip(),
+        "resumo": str(dados.get("resumo") or "").strip(),
+        "autor": str(dados.get("autor") or "").strip(),
+        "anos": _lista(dados.get("anos")),
+        "disciplinas": _lista(dados.get("disciplinas")),
+    }
+    if not pedido["titulo"] and not pedido["resumo"]:
+        raise ValueError("titulo e resumo em falta")
+    return pedido
+
+
+def ler_pedidos(caminho):
+    """Lê (número, pedido ou ValueError) de um CSV com cabeçalho ou de um ficheiro JSONL
+
+    Colunas/chaves: titulo, resumo, anos, disciplinas, autor. No CSV, anos e disciplinas
+    são separados por ';', '|' ou ','.
+    """
+    with open(caminho, encoding="utf-8-sig", newline="") as f:
+        if caminho.lower().endswith(".csv"):
+            for numero, dados in enumerate(csv.DictReader(f), start=2):
+                try:
+                    yield numero, _pedido(dados)
+                except ValueError as e:
+                    yield numero, e
+        else:
+            for numero, linha in enumerate(f, start=1):
+                if not linha.strip():
+                    continue
+                try:
+                    yield numero, _pedido(json.loads(linha))
+                except ValueError as e:
+                    yield numero, e
+
+
+class BaldeTokens:
+    """Token bucket: até `tokens_por_minuto` de rajada, reposto continuamente"""
+
+    def __init__(self, tokens_por_minuto):
+        self.capacidade = float(tokens_por_minuto)
+        self.disponiveis = self.capacidade
+        self._reposto_em = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self, tokens):
+        """Bloqueia até haver `tokens` disponíveis e desconta-os; retorna os segundos de espera"""
+        tokens = min(float(tokens), self.capacidade)
+        esperado = 0.0
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.disponiveis = min(
+                    self.capacidade, self.disponiveis + (agora - self._reposto_em) * self.capacidade / 60
+                )
+                self._reposto_em = agora
+                if self.disponiveis >= tokens:
+                    self.disponiveis -= tokens
+                    return esperado
+                espera = (tokens - self.disponiveis) * 60 / self.capacidade
+            time.sleep(espera)
+            esperado += espera
+
+
+def executar_lote(pedidos, processar, custo, concorrencia=4, balde=None, checkpoint=None, relatar=print):
+    """Processa os pedidos com `concorrencia` threads, respeitando o balde de tokens
+
+    processar(pedido) -> id guardado (ou exceção); custo(pedido) -> tokens estimados.
+    O checkpoint guarda os números já concluídos: ao retomar, só falhas e pendentes são refeitos.
+    Retorna o estado final com concluídos, falhas, inválidos e duração.
+    """
+    estado = {"concluidos": {}, **(checkpoint.carregar() if checkpoint else {})}
+    estado["falhas"] = {}
+    estado["invalidos"] = 0
+    feitos_antes = len(estado["concluidos"])
+    if feitos_antes:
+        relatar(f"↪️ A retomar: {feitos_antes} pedidos já concluídos")
+
+    fonte = iter(pedidos)
+    lock = threading.Lock()
+    inicio = time.time()
+
+    def proximo():
+        with lock:
+            for numero, pedido in fonte:
+                if str(numero) in estado["concluidos"]:
+                    continue
+                if isinstance(pedido, ValueError):
+                    estado["invalidos"] += 1
+                    relatar(f"⚠️ Linha {numero} inválida: {pedido}")
+                    continue
+                return numero, pedido
+            return None
+
+    def trabalhar():
+        while True:
+            item = proximo()
+            if item is None:
+                return
+            numero, pedido = item
+            if balde:
+                balde.consumir(custo(pedido))
+            try:
+                id = processar(pedido)
+                erro = None if id else "não foi possível guardar"
+            except Exception as e:
+                id, erro = None, f"{type(e).__name__}: {e}"
+            with lock:
+                if erro:
+                    estado["falhas"][str(numero)] = erro
+                    relatar(f"❌ Linha {numero} ({pedido['titulo'] or pedido['resumo'][:40]}): {erro}")
+                else:
+                    estado["concluidos"][str(numero)] = id
+                    if checkpoint:
+                        checkpoint.guardar({"concluidos": estado["concluidos"]})
+                feitos = len(estado["concluidos"]) - feitos_antes
+                ritmo = feitos * 60 / max(time.time() - inicio, 1e-6)
+                relatar(f"✅ {feitos} gerados, {len(estado['falhas'])} falhas ({ritmo:.1f}/min)")
+
+    threads = [threading.Thread(target=trabalhar, daemon=True) for _ in range(max(1, concorrencia))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    estado["gerados"] = len(estado["concluidos"]) - feitos_antes
+    estado["duracao"] = time.time() - inicio
+    return estado
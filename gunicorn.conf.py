@@ -0,0 +1,35 @@
+"""Configuração do gunicorn (lida automaticamente a partir da pasta do projeto)
+
+O processo pai carrega a aplicação uma vez (--preload), compila os templates e importa os
+módulos pesados; os workers herdam isso por fork e só criam os clientes no primeiro uso.
+
+GUNICORN_WORKER_CLASS=gevent ativa o modo assíncrono: cada worker serve centenas de pedidos
+em simultâneo (GUNICORN_WORKER_CONNECTIONS), porque quase todo o tempo de um pedido é espera
+pelo Supabase ou pelo Groq. Com gthread (por omissão) o limite é workers × GUNICORN_THREADS.
+"""
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    # Antes de importar a aplicação: os locks, threads e sockets criados ao carregar app.py
+    # (--preload) têm de ser já os cooperativos do gevent, senão um lock bloqueia o worker inteiro
+    from gevent import monkey
+    monkey.patch_all()
+
+preload_app = True
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "500"))
+
+
+def when_ready(server):
+    # Antes de criar os workers: o que for carregado aqui é partilhado (copy-on-write)
+    if server.cfg.preload_app:
+        import app as portal
+        portal.aquecer(portal.app)
+
+
+def post_fork(server, worker):
+    # As threads em segundo plano do pai não sobrevivem ao fork: arrancar em cada worker
+    import app as portal
+    portal.iniciar_processo()
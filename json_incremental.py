@@ -0,0 +1,81 @@
+"""Parser incremental de um objeto JSON recebido por partes (ex.: resposta do LLM em streaming)"""
+import json
+
+
+class ParserSeccoesJSON:
+    """Emite cada par (chave, valor) de topo assim que o respetivo valor fica completo"""
+
+    def __init__(self):
+        self.protocolo = {}
+        self.completo = False
+        self._texto = ""
+        self._pos = 0
+        self._profundidade = 0
+        self._em_string = False
+        self._escape = False
+        self._inicio_membro = None   # índice do início do membro atual (após '{' ou ',')
+        self._dois_pontos = False    # o membro atual já tem ':' (estamos no valor)
+        self._emitido = False
+
+    def _emitir(self, fim):
+        """Faz parse do membro entre _inicio_membro e fim, se ainda não tiver sido emitido"""
+        if self._emitido or self._inicio_membro is None:
+            return []
+        fragmento = self._texto[self._inicio_membro:fim].strip()
+        if not fragmento:
+            return []
+        self._emitido = True
+        try:
+            membro = json.loads("{" + fragmento + "}")
+        except json.JSONDecodeError:
+            return []
+        self.protocolo.update(membro)
+        return list(membro.items())
+
+    def alimentar(self, texto):
+        """Acrescenta texto recebido e retorna as secções que ficaram completas"""
+        self._texto += texto
+        seccoes = []
+        while self._pos < len(self._texto) and not self.completo:
+            i = self._pos
+            c = self._texto[i]
+            self._pos += 1
+
+            if self._profundidade == 0:
+                # Ignorar markdown ou texto antes do objeto
+                if c == "{":
+                    self._profundidade = 1
+                    self._inicio_membro = i + 1
+                continue
+
+            if self._em_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._em_string = False
+                    if self._profundidade == 1 and self._dois_pontos:
+                        seccoes += self._emitir(i + 1)
+                continue
+
+            if c == '"':
+                self._em_string = True
+            elif c in "{[":
+                self._profundidade += 1
+            elif c in "}]":
+                self._profundidade -= 1
+                if self._profundidade == 1 and self._dois_pontos:
+                    seccoes += self._emitir(i + 1)
+                elif self._profundidade == 0:
+                    seccoes += self._emitir(i)
+                    self.completo = True
+            elif self._profundidade == 1:
+                if c == ":":
+                    self._dois_pontos = True
+                elif c == ",":
+                    seccoes += self._emitir(i)
+                    self._inicio_membro = i + 1
+                    self._dois_pontos = False
+                    self._emitido = False
+        return seccoes
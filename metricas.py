@@ -0,0 +1,179 @@
+"""Métricas em memória (contadores, histogramas, medidores) expostas no formato de texto do Prometheus"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Limites (segundos) adequados tanto a leituras em cache como a gerações do LLM
+LIMITES_DURACAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + "}"
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        return tuple(rotulos.get(nome, "") for nome in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        linhas.extend(self._amostras())
+        return "\n".join(linhas)
+
+
+class Contador(_Metrica):
+    """Valor que só cresce, por combinação de rótulos"""
+
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        super().__init__(nome, ajuda, rotulos)
+        self._valores = {}
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def _amostras(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}" for chave, valor in valores]
+
+
+class Histograma(_Metrica):
+    """Distribuição de valores em intervalos fixos, com soma e contagem, por combinação de rótulos"""
+
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_DURACAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.limites = tuple(sorted(limites))
+        self._series = {}   # chave -> [contagens por intervalo (+Inf no fim), soma]
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        indice = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        """Mede a duração do bloco; o rótulo `resultado`, se existir, passa a "erro" em exceções"""
+        inicio = time.perf_counter()
+        try:
+            yield rotulos
+        except BaseException:
+            if "resultado" in self.rotulos and rotulos.get("resultado", "ok") == "ok":
+                rotulos["resultado"] = "erro"
+            raise
+        finally:
+            if "resultado" in self.rotulos:
+                rotulos.setdefault("resultado", "ok")
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def _amostras(self):
+        with self._lock:
+            series = [(chave, list(contagens), soma) for chave, (contagens, soma) in self._series.items()]
+        linhas = []
+        for chave, contagens, soma in series:
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (float("inf"),), contagens):
+                acumulado += contagem
+                linhas.append(
+                    f"{self.nome}_bucket{_rotulos(self.rotulos, chave, [('le', _numero(limite))])} {acumulado}"
+                )
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(soma)}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, chave)} {acumulado}")
+        return linhas
+
+
+class Medidor(_Metrica):
+    """Valor lido no momento da exportação: funcao() -> número ou {tuplo de rótulos: número}"""
+
+    def __init__(self, nome, ajuda, funcao, rotulos=(), tipo="gauge"):
+        super().__init__(nome, ajuda, rotulos)
+        self.funcao = funcao
+        self.tipo = tipo
+
+    def _amostras(self):
+        valores = self.funcao()
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        return [f"{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}" for chave, valor in valores.items()]
+
+
+class RegistoMetricas:
+    """Conjunto de métricas exportadas juntas em /metrics"""
+
+    def __init__(self):
+        self._metricas = []
+
+    def _registar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_DURACAO):
+        return self._registar(Histograma(nome, ajuda, rotulos, limites))
+
+    def medidor(self, nome, ajuda, funcao, rotulos=(), tipo="gauge"):
+        return self._registar(Medidor(nome, ajuda, funcao, rotulos, tipo))
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)"""
+        blocos = []
+        for metrica in self._metricas:
+            try:
+                blocos.append(metrica.exportar())
+            except Exception:
+                # Um medidor avariado não deve esconder as restantes métricas
+                continue
+        return "\n".join(blocos) + "\n"
+
+
+class ChamadasMedidas:
+    """Proxy que mede a duração de cada método chamado num objeto (ex.: um backend de armazenamento)"""
+
+    def __init__(self, objeto, histograma, **rotulos):
+        self._objeto = objeto
+        self._histograma = histograma
+        self._rotulos = rotulos
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._objeto, nome)
+        if not callable(atributo):
+            return atributo
+
+        def medido(*args, **kwargs):
+            with self._histograma.cronometrar(operacao=nome, **self._rotulos):
+                return atributo(*args, **kwargs)
+        return medido
@@ -0,0 +1,194 @@
+"""Índice de pesquisa em memória (texto integral em português) para os protocolos"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+# Campos indexados e respetivo peso (BM25F simplificado)
+CAMPOS_PESQUISA = {
+    "titulo": 3.0,
+    "subtitulo": 2.0,
+    "autor": 2.0,
+    "resumo": 1.5,
+    "materiais": 1.0,
+    "procedimento": 1.0,
+}
+
+# Palavras demasiado frequentes para serem úteis na pesquisa (já sem acentos)
+STOPWORDS = {
+    "a", "ao", "aos", "as", "com", "da", "das", "de", "do", "dos", "e", "em",
+    "entre", "esta", "este", "isso", "isto", "na", "nas", "no", "nos", "o",
+    "os", "ou", "para", "pela", "pelas", "pelo", "pelos", "por", "que", "se",
+    "sem", "sua", "suas", "seu", "seus", "um", "uma", "umas", "uns",
+}
+
+# Sufixos de plural: (sufixo, substituição), testados por ordem
+_PLURAIS = [
+    ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"),
+    ("is", "il"), ("ns", "m"), ("res", "r"), ("zes", "z"), ("ses", "s"), ("s", ""),
+]
+
+# Sufixos derivacionais comuns, removidos apenas se o radical ficar com 3+ letras
+_SUFIXOS = [
+    "amente", "mente", "idade", "ismo", "ista", "avel", "ivel", "ador",
+    "adora", "acao", "icao", "mento", "ante", "ente", "inte", "oso", "osa",
+]
+
+_PALAVRA = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto):
+    """Converte para minúsculas e remove acentos (ç→c, ã→a, é→e, ...)"""
+    if not texto:
+        return ""
+    decomposto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def radical(palavra):
+    """Stemming leve para português: remove plurais e alguns sufixos frequentes"""
+    if len(palavra) <= 3:
+        return palavra
+    for sufixo, substituto in _PLURAIS:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 2:
+            palavra = palavra[:-len(sufixo)] + substituto
+            break
+    for sufixo in _SUFIXOS:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= 3:
+            return palavra[:-len(sufixo)]
+    # Vogal temática: "solida"/"solido" e "vinagre"/"vinagres" partilham o radical
+    if palavra[-1] in "aoe" and len(palavra) > 4:
+        return palavra[:-1]
+    return palavra
+
+
+def tokenizar(texto):
+    """Divide o texto em radicais normalizados, ignorando stopwords"""
+    return [
+        radical(p) for p in _PALAVRA.findall(normalizar(texto))
+        if p not in STOPWORDS and len(p) > 1
+    ]
+
+
+class IndicePesquisa:
+    """Índice invertido com ranking BM25, atualizável incrementalmente"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.construido_em = None
+        self._lock = threading.RLock()
+        self._limpar()
+        self._a_reconstruir = False
+        self._alterados_durante_reconstrucao = {}
+
+    def _limpar(self):
+        self._postings = defaultdict(dict)   # termo -> {id: frequência ponderada}
+        self._comprimentos = {}              # id -> comprimento ponderado
+        self._termos = {}                    # id -> termos do documento (para remoção)
+        self._comprimento_total = 0.0
+
+    @property
+    def pronto(self):
+        return self.construido_em is not None
+
+    def __len__(self):
+        return len(self._comprimentos)
+
+    def _frequencias(self, protocolo):
+        """Frequência ponderada de cada termo nos campos indexados"""
+        frequencias = Counter()
+        for campo, peso in CAMPOS_PESQUISA.items():
+            for termo in tokenizar(protocolo.get(campo)):
+                frequencias[termo] += peso
+        return frequencias
+
+    def _remover(self, id):
+        for termo in self._termos.pop(id, ()):
+            documentos = self._postings.get(termo)
+            if documentos is not None:
+                documentos.pop(id, None)
+                if not documentos:
+                    del self._postings[termo]
+        self._comprimento_total -= self._comprimentos.pop(id, 0.0)
+
+    def _adicionar(self, id, frequencias):
+        self._remover(id)
+        for termo, frequencia in frequencias.items():
+            self._postings[termo][id] = frequencia
+        self._termos[id] = list(frequencias)
+        comprimento = sum(frequencias.values())
+        self._comprimentos[id] = comprimento
+        self._comprimento_total += comprimento
+
+    def adicionar(self, protocolo: dict):
+        """Adiciona (ou substitui) um protocolo no índice"""
+        id = protocolo.get("id")
+        if id is None:
+            return
+        frequencias = self._frequencias(protocolo)
+        with self._lock:
+            self._adicionar(id, frequencias)
+            if self._a_reconstruir:
+                self._alterados_durante_reconstrucao[id] = frequencias
+
+    def remover(self, id):
+        """Remove um protocolo do índice"""
+        with self._lock:
+            self._remover(id)
+            if self._a_reconstruir:
+                self._alterados_durante_reconstrucao[id] = None
+
+    def reconstruir(self, protocolos):
+        """Reconstrói o índice a partir de um iterável de protocolos"""
+        with self._lock:
+            self._a_reconstruir = True
+            self._alterados_durante_reconstrucao = {}
+        novo = IndicePesquisa(self.k1, self.b)
+        try:
+            for protocolo in protocolos:
+                if protocolo.get("id") is not None:
+                    novo._adicionar(protocolo["id"], self._frequencias(protocolo))
+        except Exception:
+            with self._lock:
+                self._a_reconstruir = False
+            raise
+        with self._lock:
+            # Reaplicar o que foi guardado enquanto o catálogo era percorrido
+            for id, frequencias in self._alterados_durante_reconstrucao.items():
+                if frequencias is None:
+                    novo._remover(id)
+                else:
+                    novo._adicionar(id, frequencias)
+            self._postings = novo._postings
+            self._comprimentos = novo._comprimentos
+            self._termos = novo._termos
+            self._comprimento_total = novo._comprimento_total
+            self._a_reconstruir = False
+            self._alterados_durante_reconstrucao = {}
+            self.construido_em = time.time()
+
+    def pesquisar(self, consulta, limite=None):
+        """Retorna [(id, pontuação)] por ordem decrescente de relevância (BM25)"""
+        termos = set(tokenizar(consulta))
+        if not termos:
+            return []
+        with self._lock:
+            total = len(self._comprimentos)
+            if not total:
+                return []
+            media = self._comprimento_total / total or 1.0
+            pontuacoes = defaultdict(float)
+            for termo in termos:
+                documentos = self._postings.get(termo)
+                if not documentos:
+                    continue
+                idf = math.log(1 + (total - len(documentos) + 0.5) / (len(documentos) + 0.5))
+                for id, frequencia in documentos.items():
+                    norma = self.k1 * (1 - self.b + self.b * self._comprimentos[id] / media)
+                    pontuacoes[id] += idf * frequencia * (self.k1 + 1) / (frequencia + norma)
+        # Empates: protocolos mais recentes (id maior) primeiro
+        resultados = sorted(pontuacoes.items(), key=lambda x: (x[1], x[0]), reverse=True)
+        return resultados[:limite] if limite else resultados
@@ -0,0 +1,36 @@
+"""Dependências criadas só no primeiro uso (clientes, ligações), uma vez por processo"""
+import os
+import threading
+
+
+class Preguicoso:
+    """Proxy que cria o objeto com fabrica() no primeiro acesso a um atributo
+
+    O objeto é recriado se o processo mudou (fork dos workers do gunicorn com --preload):
+    ligações HTTP e SQLite não podem ser partilhadas entre processos.
+    """
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._objeto = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pronto(self):
+        """True se o objeto já foi criado neste processo (sem o criar)"""
+        return self._objeto is not None and self._pid == os.getpid()
+
+    def _alvo(self):
+        # Privado: um método público com nome comum (ex.: obter) esconderia o do objeto
+        if self.pronto:
+            return self._objeto
+        with self._lock:
+            if not self.pronto:
+                self._objeto = self._fabrica()
+                self._pid = os.getpid()
+            return self._objeto
+
+    def __getattr__(self, nome):
+        # Só chamado para atributos que não existem no proxy
+        return getattr(self._alvo(), nome)
@@ -0,0 +1,157 @@
+"""Formato dos registos na tabela `protocolos` e leitura compatível com os formatos antigos
+
+Formato 1 (legado): uma coluna de texto por secção; listas achatadas com newlines,
+disciplinas/anos/seguranca/quiz como JSON em texto e seguranca_json/quiz_json/
+diferenciacao_json duplicados.
+
+Formato 2: colunas de topo apenas para o que é filtrado, ordenado ou pesquisado
+(titulo, subtitulo, resumo, autor, contadores, created_at) e as restantes secções
+num único documento JSONB (`documento`) com tipos nativos. Secções de texto grandes
+podem ser comprimidas (zlib) no documento: {"z": "<base64>"}.
+
+O resto da aplicação só vê protocolos "lógicos" (ler_registo), com listas e objetos nativos.
+"""
+import base64
+import json
+import zlib
+
+FORMATO_ATUAL = 2
+
+# Secções guardadas no documento (formato 2), por tipo
+CAMPOS_LISTA = ("disciplinas", "anos", "competencias", "objetivos", "recursos_extras")
+CAMPOS_OBJETO = {"seguranca": dict, "quiz": list, "diferenciacao": dict}
+CAMPOS_TEXTO = ("duracao", "contextualizacao", "materiais", "pre_experiencia", "procedimento",
+                "pos_experiencia", "resultados_esperados")
+CAMPOS_DOCUMENTO = CAMPOS_LISTA + tuple(CAMPOS_OBJETO) + CAMPOS_TEXTO
+
+# Colunas de topo do formato 2 (além de id, created_at e contadores)
+CAMPOS_TOPO = ("titulo", "subtitulo", "resumo", "autor")
+
+# Colunas do formato 1 de onde vem cada secção, por ordem de preferência
+COLUNAS_V1 = {
+    "seguranca": ("seguranca_json", "seguranca"),
+    "quiz": ("quiz_json", "quiz"),
+    "diferenciacao": ("diferenciacao_json",),
+}
+COLUNAS_SO_V1 = ("seguranca_json", "quiz_json", "diferenciacao_json")
+
+# Alias das secções pedidas diretamente ao documento (ex.: doc_disciplinas:documento->disciplinas)
+_PREFIXO_DOCUMENTO = "doc_"
+
+
+def _texto(valor):
+    if isinstance(valor, list):
+        return "\n".join(str(v) for v in valor)
+    return str(valor) if valor else ""
+
+
+def _lista(valor):
+    if isinstance(valor, list):
+        return valor
+    if not valor or not isinstance(valor, str):
+        return []
+    try:
+        convertido = json.loads(valor)
+    except ValueError:
+        convertido = None
+    if isinstance(convertido, list):
+        return convertido
+    # Formato 1: listas achatadas com newlines
+    return [linha.strip() for linha in valor.split("\n") if linha.strip()]
+
+
+def _objeto(valor, tipo):
+    if isinstance(valor, str):
+        try:
+            valor = json.loads(valor)
+        except ValueError:
+            valor = None
+    return valor if isinstance(valor, tipo) else tipo()
+
+
+def normalizar_campo(campo, valor):
+    """Converte o valor de uma secção para o tipo nativo do formato 2"""
+    if campo in CAMPOS_LISTA:
+        return _lista(valor)
+    if campo in CAMPOS_OBJETO:
+        return _objeto(valor, CAMPOS_OBJETO[campo])
+    return _texto(valor)
+
+
+def _comprimir(texto, limite_bytes):
+    if not limite_bytes or not isinstance(texto, str):
+        return texto
+    dados = texto.encode()
+    if len(dados) < limite_bytes:
+        return texto
+    comprimido = base64.b64encode(zlib.compress(dados, 9)).decode()
+    return {"z": comprimido} if len(comprimido) < len(dados) else texto
+
+
+def _descomprimir(valor):
+    if isinstance(valor, dict) and "z" in valor:
+        return zlib.decompress(base64.b64decode(valor["z"])).decode()
+    return valor
+
+
+def criar_registo(protocolo: dict, comprimir_bytes=0):
+    """Registo no formato 2 a partir de um protocolo (gerado pela IA ou lógico)
+
+    comprimir_bytes: secções de texto com pelo menos este tamanho são comprimidas (0 desativa).
+    """
+    registo = {campo: _texto(protocolo.get(campo)) for campo in CAMPOS_TOPO}
+    registo["formato"] = FORMATO_ATUAL
+    registo["documento"] = {
+        campo: _comprimir(normalizar_campo(campo, protocolo.get(campo)), comprimir_bytes)
+        if campo in CAMPOS_TEXTO else normalizar_campo(campo, protocolo.get(campo))
+        for campo in CAMPOS_DOCUMENTO
+    }
+    return registo
+
+
+def migrar_registo(linha: dict, comprimir_bytes=0):
+    """Alterações que convertem uma linha do formato 1 para o formato 2 (sem tocar nos contadores)"""
+    alteracoes = criar_registo(ler_registo(linha), comprimir_bytes)
+    # As colunas antigas deixam de ter conteúdo (e podem ser removidas no fim da migração)
+    for campo in CAMPOS_DOCUMENTO + COLUNAS_SO_V1:
+        if campo in linha and campo not in CAMPOS_TOPO:
+            alteracoes[campo] = None
+    return alteracoes
+
+
+def ler_registo(linha):
+    """Protocolo lógico (tipos nativos) a partir de uma linha em qualquer formato"""
+    if not linha:
+        return linha
+    protocolo = {
+        chave: valor for chave, valor in linha.items()
+        if chave not in ("formato", "documento") and chave not in COLUNAS_SO_V1
+        and not chave.startswith(_PREFIXO_DOCUMENTO)
+    }
+    if (linha.get("formato") or 1) >= 2:
+        documento = linha.get("documento") or {}
+        for campo in CAMPOS_DOCUMENTO:
+            if campo in documento:
+                protocolo[campo] = normalizar_campo(campo, _descomprimir(documento[campo]))
+            elif _PREFIXO_DOCUMENTO + campo in linha:
+                protocolo[campo] = normalizar_campo(campo, _descomprimir(linha[_PREFIXO_DOCUMENTO + campo]))
+    else:
+        for campo in CAMPOS_DOCUMENTO:
+            fontes = [c for c in COLUNAS_V1.get(campo, (campo,)) if c in linha]
+            if fontes:
+                protocolo[campo] = normalizar_campo(campo, next((linha[c] for c in fontes if linha[c]), None))
+    return protocolo
+
+
+def colunas_registo(campos):
+    """Colunas a pedir ao armazenamento para obter os campos lógicos indicados, em ambos os formatos"""
+    if campos == "*":
+        return "*"
+    colunas = ["formato"]
+    for campo in (c.strip() for c in campos.split(",")):
+        if campo in CAMPOS_DOCUMENTO:
+            colunas.extend(COLUNAS_V1.get(campo, (campo,)))
+            colunas.append(f"{_PREFIXO_DOCUMENTO}{campo}:documento->{campo}")
+        else:
+            colunas.append(campo)
+    return ",".join(colunas)
@@ -0,0 +1,100 @@
+"""Versões do catálogo e respostas JSON pré-serializadas, com ETag forte e compressão negociada"""
+import gzip
+import hashlib
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    # Opcional (pip install brotli): sem ele só se serve gzip
+    brotli = None
+
+# Corpos mais pequenos do que isto não compensam a compressão
+COMPRIMIR_A_PARTIR_DE = 512
+
+
+class Versoes:
+    """Versão do catálogo (protocolos guardados, índices reconstruídos) e dos contadores
+
+    Os contadores mudam a cada visualização: a versão publicada só avança, no máximo, uma vez
+    por `intervalo_contadores` segundos, para as respostas em cache durarem pelo menos isso.
+    """
+
+    def __init__(self, intervalo_contadores=5.0):
+        self.intervalo_contadores = intervalo_contadores
+        self.catalogo = 0
+        self._contadores = 0
+        self._contadores_publicada = 0
+        self._publicada_em = 0.0
+        self._lock = threading.Lock()
+
+    def alterar_catalogo(self):
+        with self._lock:
+            self.catalogo += 1
+
+    def alterar_contadores(self):
+        with self._lock:
+            self._contadores += 1
+
+    @property
+    def contadores(self):
+        agora = time.monotonic()
+        with self._lock:
+            if self._contadores != self._contadores_publicada \
+                    and agora - self._publicada_em >= self.intervalo_contadores:
+                self._contadores_publicada = self._contadores
+                self._publicada_em = agora
+            return self._contadores_publicada
+
+
+def negociar_codificacao(accept_encoding):
+    """Escolhe "br", "gzip" ou "identity" a partir do cabeçalho Accept-Encoding"""
+    aceites = {}
+    for parte in (accept_encoding or "").lower().split(","):
+        nome, _, parametros = parte.strip().partition(";")
+        q = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                q = float(parametros[2:])
+            except ValueError:
+                q = 0.0
+        if nome:
+            aceites[nome] = q
+    for codificacao in (("br", "gzip") if brotli else ("gzip",)):
+        if aceites.get(codificacao, aceites.get("*", 0)) > 0:
+            return codificacao
+    return "identity"
+
+
+class RespostaCodificada:
+    """Um corpo JSON serializado uma vez, com as variantes comprimidas criadas a pedido
+
+    Cada variante tem a sua ETag forte (os bytes são diferentes), derivada do conteúdo:
+    workers com os mesmos dados produzem a mesma ETag.
+    """
+
+    def __init__(self, corpo: bytes):
+        self.etag_base = hashlib.sha1(corpo).hexdigest()
+        self._variantes = {"identity": corpo}
+        self._lock = threading.Lock()
+
+    @property
+    def tamanho(self):
+        return sum(len(corpo) for corpo in self._variantes.values())
+
+    def variante(self, codificacao):
+        """Retorna (corpo, etag, codificação efetiva)"""
+        corpo = self._variantes["identity"]
+        if codificacao == "identity" or len(corpo) < COMPRIMIR_A_PARTIR_DE:
+            return corpo, self.etag_base, "identity"
+        with self._lock:
+            comprimido = self._variantes.get(codificacao)
+            if comprimido is None:
+                if codificacao == "br":
+                    comprimido = brotli.compress(corpo, quality=5)
+                else:
+                    comprimido = gzip.compress(corpo, compresslevel=6, mtime=0)
+                self._variantes[codificacao] = comprimido
+        return comprimido, f"{self.etag_base}-{codificacao}", codificacao
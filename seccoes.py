@@ -0,0 +1,59 @@
+"""Secções de topo de um protocolo e classificação do feedback por secção"""
+from pesquisa import tokenizar
+
+# Secções de topo do JSON gerado pela IA, pela ordem do prompt
+SECCOES_PROTOCOLO = [
+    "titulo", "subtitulo", "duracao", "competencias", "objetivos", "contextualizacao",
+    "resumo", "materiais", "pre_experiencia", "procedimento", "pos_experiencia",
+    "resultados_esperados", "seguranca", "quiz", "diferenciacao", "recursos_extras",
+]
+
+# Palavras do feedback que apontam para cada secção
+_PALAVRAS_SECCOES = {
+    "titulo": "título nome",
+    "subtitulo": "subtítulo",
+    "duracao": "duração tempo minutos aula",
+    "competencias": "competências competência",
+    "objetivos": "objetivos objetivo metas",
+    "contextualizacao": "contextualização contexto quotidiano motivação introdução",
+    "resumo": "resumo",
+    "materiais": "materiais material reagentes ingredientes quantidades",
+    "pre_experiencia": "pré antes prévias hipóteses",
+    "procedimento": "procedimento passos passo etapas instruções",
+    "pos_experiencia": "pós depois discussão conclusões sistematização",
+    "resultados_esperados": "resultados esperados observações",
+    "seguranca": "segurança riscos risco perigo perigoso proteção epi óculos luvas "
+                 "supervisão cuidados socorros descarte",
+    "quiz": "quiz perguntas pergunta questões escolha múltipla verdadeiro falso avaliação teste",
+    "diferenciacao": "diferenciação inclusão inclusiva nee",
+    "recursos_extras": "recursos vídeos vídeo links bibliografia sites",
+}
+
+# Palavras que indicam uma alteração ao protocolo inteiro
+_PALAVRAS_GLOBAIS = "tudo todo inteiro completo geral protocolo linguagem tom nível idade anos"
+
+_SECCOES_POR_RADICAL = {}
+for _seccao, _palavras in _PALAVRAS_SECCOES.items():
+    for _radical in tokenizar(_palavras):
+        _SECCOES_POR_RADICAL.setdefault(_radical, []).append(_seccao)
+_RADICAIS_GLOBAIS = set(tokenizar(_PALAVRAS_GLOBAIS))
+
+
+def classificar_feedback(feedback):
+    """Secções visadas pelo feedback, ou None se for geral ou não for possível decidir"""
+    radicais = tokenizar(feedback)
+    if not radicais or _RADICAIS_GLOBAIS.intersection(radicais):
+        return None
+    seccoes = []
+    for radical in radicais:
+        for seccao in _SECCOES_POR_RADICAL.get(radical, ()):
+            if seccao not in seccoes:
+                seccoes.append(seccao)
+    return seccoes or None
+
+
+def validar_seccoes(seccoes):
+    """Filtra uma lista de secções pedida pelo cliente, mantendo apenas as conhecidas"""
+    if not isinstance(seccoes, list):
+        return None
+    return [s for s in SECCOES_PROTOCOLO if s in seccoes] or None
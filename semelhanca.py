@@ -0,0 +1,259 @@
+"""Protocolos semelhantes: vetores TF-IDF com hashing e lista pré-calculada dos k vizinhos de cada protocolo"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from estatisticas import _lista
+from facetas import chave_faceta
+from pesquisa import tokenizar
+
+# Campos usados e respetivo peso
+CAMPOS_SEMELHANCA = {
+    "titulo": 3.0,
+    "resumo": 2.0,
+    "materiais": 1.0,
+    "procedimento": 1.0,
+}
+DIMENSOES = 1 << 20
+# Só os termos mais fortes de cada protocolo entram no vetor (menos ruído, comparação mais rápida)
+MAX_TERMOS = 40
+# Peso da partilha de disciplinas (Jaccard) somado ao cosseno
+PESO_DISCIPLINAS = 0.15
+# Termos presentes em mais do que esta fração do catálogo não geram candidatos: quase não
+# distinguem protocolos e as suas listas tornariam o cálculo quadrático
+MAX_FRACAO_DOCUMENTOS = 0.05
+MIN_DOCUMENTOS_COMUNS = 50
+FORMATO_FICHEIRO = 1
+
+
+def _dimensao(termo):
+    # crc32 e não hash(): as dimensões têm de ser iguais em todos os processos
+    return zlib.crc32(termo.encode()) % DIMENSOES
+
+
+def _frequencias(protocolo):
+    frequencias = Counter()
+    for campo, peso in CAMPOS_SEMELHANCA.items():
+        for termo in tokenizar(protocolo.get(campo)):
+            frequencias[_dimensao(termo)] += peso
+    return frequencias
+
+
+def documento(protocolo):
+    """O que o índice precisa de um protocolo: (id, frequências, disciplinas, título)"""
+    return (
+        protocolo.get("id"),
+        _frequencias(protocolo),
+        {chave_faceta(d) for d in _lista(protocolo.get("disciplinas"))},
+        protocolo.get("titulo") or "",
+    )
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class IndiceSemelhanca:
+    """Vetores dos protocolos em memória e, para cada um, os k mais semelhantes
+
+    Os vizinhos são calculados fora dos pedidos (reconstrução, ao guardar, ou pelo comando
+    `flask --app app reconstruir-semelhanca`) e podem ser gravados num ficheiro JSON para
+    o arranque seguinte não ter de os recalcular.
+    """
+
+    def __init__(self, k=6):
+        self.k = k
+        self.construido_em = None
+        self._lock = threading.RLock()
+        self._documentos = 0
+        self._df = Counter()        # dimensão -> nº de protocolos que a contêm
+        self._vetores = {}          # id -> {dimensão: peso} normalizado
+        self._postings = defaultdict(dict)   # dimensão -> {id: peso}
+        self._disciplinas = {}      # id -> {chaves de disciplina}
+        self._titulos = {}          # id -> título
+        self._vizinhos = {}         # id -> [(id, pontuação)]
+        self._a_reconstruir = False
+        self._adicionados_durante_reconstrucao = {}
+
+    @property
+    def pronto(self):
+        return self.construido_em is not None
+
+    def _vetor(self, frequencias):
+        pesos = {
+            dimensao: (1 + math.log(frequencia)) * math.log((1 + self._documentos) / (1 + self._df[dimensao]))
+            for dimensao, frequencia in frequencias.items()
+        }
+        pesos = dict(heapq.nlargest(MAX_TERMOS, pesos.items(), key=lambda x: x[1]))
+        norma = math.sqrt(sum(p * p for p in pesos.values())) or 1.0
+        return {dimensao: peso / norma for dimensao, peso in pesos.items() if peso > 0}
+
+    def _guardar_vetor(self, id, vetor):
+        for dimensao in self._vetores.get(id, ()):
+            self._postings[dimensao].pop(id, None)
+        self._vetores[id] = vetor
+        for dimensao, peso in vetor.items():
+            self._postings[dimensao][id] = peso
+
+    def _calcular(self, id):
+        """Os k protocolos mais semelhantes a `id` (produto interno via postings + disciplinas)"""
+        pontuacoes = defaultdict(float)
+        max_documentos = max(MIN_DOCUMENTOS_COMUNS, MAX_FRACAO_DOCUMENTOS * self._documentos)
+        for dimensao, peso in self._vetores.get(id, {}).items():
+            documentos = self._postings[dimensao]
+            if len(documentos) > max_documentos:
+                continue
+            for outro, peso_outro in documentos.items():
+                pontuacoes[outro] += peso * peso_outro
+        pontuacoes.pop(id, None)
+        disciplinas = self._disciplinas.get(id, set())
+        melhores = heapq.nlargest(
+            self.k,
+            ((outro, p + PESO_DISCIPLINAS * _jaccard(disciplinas, self._disciplinas.get(outro, set())))
+             for outro, p in pontuacoes.items()),
+            key=lambda x: (x[1], x[0])
+        )
+        return [(outro, round(p, 4)) for outro, p in melhores]
+
+    def iniciar_reconstrucao(self):
+        """Chamado antes de percorrer o catálogo: o que for adicionado a partir daqui é reaplicado
+
+        Os documentos só chegam a reconstruir() depois da leitura (feita com os outros índices).
+        """
+        with self._lock:
+            self._a_reconstruir = True
+            self._adicionados_durante_reconstrucao = {}
+
+    def reconstruir(self, documentos):
+        """Recalcula IDF e vetores a partir de documento(protocolo) de todo o catálogo
+
+        Mantém os vizinhos já conhecidos: ver calcular_em_falta.
+        """
+        with self._lock:
+            if not self._a_reconstruir:
+                self.iniciar_reconstrucao()
+        try:
+            documentos = {id: resto for id, *resto in documentos if id is not None}
+            novo = IndiceSemelhanca(self.k)
+            novo._documentos = len(documentos)
+            for frequencias, _, _ in documentos.values():
+                novo._df.update(frequencias.keys())
+            for id, (frequencias, disciplinas, titulo) in documentos.items():
+                novo._guardar_vetor(id, novo._vetor(frequencias))
+                novo._disciplinas[id] = disciplinas
+                novo._titulos[id] = titulo
+        except Exception:
+            with self._lock:
+                self._a_reconstruir = False
+            raise
+        with self._lock:
+            self._documentos = novo._documentos
+            self._df = novo._df
+            self._vetores = novo._vetores
+            self._postings = novo._postings
+            self._disciplinas = novo._disciplinas
+            self._titulos = novo._titulos
+            # Vizinhos de protocolos que já não existem são descartados
+            self._vizinhos = {
+                id: [(v, p) for v, p in vizinhos if v in documentos]
+                for id, vizinhos in self._vizinhos.items() if id in documentos
+            }
+            # Reaplicar o que foi guardado enquanto o catálogo era percorrido
+            for doc in self._adicionados_durante_reconstrucao.values():
+                self._adicionar(doc)
+            self._a_reconstruir = False
+            self._adicionados_durante_reconstrucao = {}
+            self.construido_em = time.time()
+
+    def em_falta(self):
+        """Ids (com vetor) que ainda não têm lista de vizinhos"""
+        with self._lock:
+            return [id for id in self._vetores if id not in self._vizinhos]
+
+    def calcular_em_falta(self, todos=False, relatar=None):
+        """Calcula os vizinhos dos protocolos que ainda não os têm (ou de todos); retorna quantos"""
+        with self._lock:
+            ids = list(self._vetores) if todos else self.em_falta()
+        for n, id in enumerate(ids, start=1):
+            if relatar and n % 1000 == 0:
+                relatar(n, len(ids))
+            with self._lock:
+                # Lock por protocolo: um save a meio não espera pelo catálogo inteiro
+                if id in self._vetores:
+                    self._vizinhos[id] = self._calcular(id)
+        return len(ids)
+
+    def adicionar(self, protocolo: dict):
+        """Acrescenta um protocolo (com o IDF atual) e atualiza as listas afetadas
+
+        Retorna os ids cuja lista de vizinhos mudou (para invalidar páginas em cache).
+        """
+        if protocolo.get("id") is None:
+            return []
+        doc = documento(protocolo)
+        with self._lock:
+            if self._a_reconstruir:
+                self._adicionados_durante_reconstrucao[doc[0]] = doc
+            return self._adicionar(doc)
+
+    def _adicionar(self, doc):
+        id, frequencias, disciplinas, titulo = doc
+        with self._lock:
+            if id not in self._vetores:
+                self._documentos += 1
+                self._df.update(frequencias.keys())
+            self._guardar_vetor(id, self._vetor(frequencias))
+            self._disciplinas[id] = disciplinas
+            self._titulos[id] = titulo
+            self._vizinhos[id] = self._calcular(id)
+            alterados = [id]
+            # A semelhança é simétrica: o novo protocolo pode entrar na lista dos seus vizinhos
+            for outro, pontuacao in self._vizinhos[id]:
+                lista = [(v, p) for v, p in self._vizinhos.get(outro, []) if v != id]
+                if len(lista) < self.k or pontuacao > lista[-1][1]:
+                    lista.append((id, pontuacao))
+                    lista.sort(key=lambda x: (x[1], x[0]), reverse=True)
+                    self._vizinhos[outro] = lista[:self.k]
+                    alterados.append(outro)
+            return alterados
+
+    def vizinhos(self, id):
+        """[{"id", "titulo", "pontuacao"}] dos protocolos mais semelhantes (só leitura em memória)"""
+        with self._lock:
+            return [
+                {"id": outro, "titulo": self._titulos.get(outro, ""), "pontuacao": pontuacao}
+                for outro, pontuacao in self._vizinhos.get(id, [])
+                if outro in self._titulos
+            ]
+
+    def guardar(self, caminho):
+        """Grava os vizinhos num ficheiro JSON (escrita atómica)"""
+        with self._lock:
+            dados = {
+                "formato": FORMATO_FICHEIRO,
+                "k": self.k,
+                "vizinhos": {str(id): vizinhos for id, vizinhos in self._vizinhos.items()},
+            }
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(dados, f, separators=(",", ":"))
+        os.replace(temporario, caminho)
+
+    def carregar(self, caminho):
+        """Lê os vizinhos gravados por guardar(); retorna False se o ficheiro não existir ou não servir"""
+        try:
+            with open(caminho, encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if dados.get("formato") != FORMATO_FICHEIRO or dados.get("k") != self.k:
+            return False
+        with self._lock:
+            for id, vizinhos in dados["vizinhos"].items():
+                self._vizinhos[int(id)] = [(int(v), p) for v, p in vizinhos]
+        return True
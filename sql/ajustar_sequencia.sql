@@ -0,0 +1,13 @@
+-- Acerta a sequência dos IDs de protocolos com o maior ID existente
+-- (usado por flask --app app importar --manter-ids, que insere IDs explícitos)
+-- Sem isto, o próximo insert sem ID pode receber um ID já importado e falhar com chave duplicada
+create or replace function ajustar_sequencia_protocolos()
+returns bigint
+language sql
+as $$
+  select setval(
+    pg_get_serial_sequence('protocolos', 'id'),
+    coalesce((select max(id) from protocolos), 1),
+    (select max(id) from protocolos) is not null
+  );
+$$;
@@ -0,0 +1,13 @@
+-- Incremento atómico dos contadores em lote (usado pelo buffer de contadores em app.py)
+-- incrementos: [{"id": 1, "gostos": 2, "nao_gostos": 0, "visualizacoes": 30}, ...]
+create or replace function incrementar_contadores(incrementos jsonb)
+returns void
+language sql
+as $$
+  update protocolos p set
+    gostos = coalesce(p.gostos, 0) + coalesce((i->>'gostos')::int, 0),
+    nao_gostos = coalesce(p.nao_gostos, 0) + coalesce((i->>'nao_gostos')::int, 0),
+    visualizacoes = coalesce(p.visualizacoes, 0) + coalesce((i->>'visualizacoes')::int, 0)
+  from jsonb_array_elements(incrementos) as i
+  where p.id = (i->>'id')::bigint;
+$$;
@@ -0,0 +1,38 @@
+-- Formato compacto dos registos (formato 2, ver registos.py)
+-- Passo 1 (antes de publicar a versão que escreve o formato 2): colunas novas, sem downtime
+alter table protocolos add column if not exists formato smallint not null default 1;
+alter table protocolos add column if not exists documento jsonb;
+
+-- As colunas antigas ficam a null nos registos migrados
+alter table protocolos
+  alter column duracao drop not null,
+  alter column competencias drop not null,
+  alter column objetivos drop not null,
+  alter column contextualizacao drop not null,
+  alter column materiais drop not null,
+  alter column pre_experiencia drop not null,
+  alter column procedimento drop not null,
+  alter column pos_experiencia drop not null,
+  alter column resultados_esperados drop not null,
+  alter column seguranca drop not null,
+  alter column seguranca_json drop not null,
+  alter column quiz drop not null,
+  alter column quiz_json drop not null,
+  alter column diferenciacao_json drop not null,
+  alter column recursos_extras drop not null,
+  alter column disciplinas drop not null,
+  alter column anos drop not null;
+
+-- Passo 2: migrar os registos existentes, em lotes, com o portal a funcionar
+--   flask --app app migrar-registos --simular
+--   flask --app app migrar-registos --lote 200
+
+-- Passo 3 (só depois de todos os registos estarem no formato 2 e de retirar a leitura
+-- do formato 1 em registos.py): remover as colunas antigas
+-- alter table protocolos
+--   drop column duracao, drop column competencias, drop column objetivos,
+--   drop column contextualizacao, drop column materiais, drop column pre_experiencia,
+--   drop column procedimento, drop column pos_experiencia, drop column resultados_esperados,
+--   drop column seguranca, drop column seguranca_json, drop column quiz, drop column quiz_json,
+--   drop column diferenciacao_json, drop column recursos_extras, drop column disciplinas,
+--   drop column anos;
@@ -0,0 +1,15 @@
+-- Estado das tarefas de geração (/api/jobs), partilhado entre os workers do gunicorn
+-- (ver tarefas.py): a tarefa corre no worker que a recebeu, mas a consulta e o cancelamento
+-- podem chegar a qualquer outro. As linhas antigas são apagadas pelo próprio portal.
+create table if not exists tarefas (
+  id text primary key,
+  tipo text not null,
+  estado text not null,
+  criada_em double precision not null,
+  iniciada_em double precision,
+  terminada_em double precision,
+  resultado jsonb,
+  erro text
+);
+
+create index if not exists idx_tarefas_criada_em on tarefas (criada_em);
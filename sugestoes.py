@@ -0,0 +1,146 @@
+"""Sugestões de pesquisa enquanto se escreve: títulos, autores e disciplinas por prefixo, sem acentos"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+
+from estatisticas import _lista
+from pesquisa import STOPWORDS, normalizar
+
+# Tipos de sugestão e campo do protocolo de onde vêm
+TIPOS = ("titulo", "autor", "disciplina")
+# Intervalos de prefixo muito grandes ("a") só são percorridos até aqui
+MAX_CANDIDATOS = 5000
+
+_SEPARADORES = re.compile(r"[^a-z0-9]+")
+
+
+def _texto(valor):
+    # "Arco-íris" -> "arco iris": hífenes e pontuação separam palavras
+    return _SEPARADORES.sub(" ", normalizar(valor)).strip()
+
+
+def _popularidade(protocolo):
+    return math.log1p(3 * (protocolo.get("gostos") or 0) + (protocolo.get("visualizacoes") or 0))
+
+
+def _chaves(texto):
+    """O texto completo e cada sufixo a partir de uma palavra ("vulcao de lava" -> ..., "lava")"""
+    palavras = _texto(texto).split()
+    return [
+        " ".join(palavras[i:]) for i, palavra in enumerate(palavras)
+        if i == 0 or palavra not in STOPWORDS
+    ]
+
+
+class IndiceSugestoes:
+    """Array ordenado de chaves normalizadas (pesquisa binária por prefixo) com pesos de popularidade
+
+    Cada título é uma sugestão; autores e disciplinas são agregados e pesam a soma da popularidade
+    dos seus protocolos (log de 3 × gostos + visualizações).
+    """
+
+    def __init__(self):
+        self.construido_em = None
+        self._lock = threading.RLock()
+        self._limpar()
+        self._a_reconstruir = False
+        self._adicionados_durante_reconstrucao = []
+
+    def _limpar(self):
+        self._chaves = []        # [(chave, nº da sugestão)] ordenado
+        self._sugestoes = []     # nº -> {"tipo", "texto", "id"?}
+        self._pesos = []         # nº -> peso
+        self._agregadas = {}     # (tipo, texto normalizado) -> nº
+        self._titulos = {}       # id do protocolo -> nº
+
+    @property
+    def pronto(self):
+        return self.construido_em is not None
+
+    def _nova(self, sugestao, chaves_ordenadas):
+        numero = len(self._sugestoes)
+        self._sugestoes.append(sugestao)
+        self._pesos.append(0.0)
+        for chave in _chaves(sugestao["texto"]):
+            if chaves_ordenadas:
+                bisect.insort(self._chaves, (chave, numero))
+            else:
+                self._chaves.append((chave, numero))
+        return numero
+
+    def _adicionar(self, protocolo, chaves_ordenadas=True):
+        id = protocolo.get("id")
+        if id is None or id in self._titulos:
+            return
+        peso = _popularidade(protocolo)
+        titulo = (protocolo.get("titulo") or "").strip()
+        if titulo:
+            numero = self._nova({"tipo": "titulo", "texto": titulo, "id": id}, chaves_ordenadas)
+            self._pesos[numero] = peso
+            self._titulos[id] = numero
+        valores = [("autor", protocolo.get("autor"))] + [("disciplina", d) for d in _lista(protocolo.get("disciplinas"))]
+        for tipo, valor in valores:
+            valor = (valor or "").strip()
+            chave = (tipo, _texto(valor))
+            if not chave[1]:
+                continue
+            numero = self._agregadas.get(chave)
+            if numero is None:
+                numero = self._agregadas[chave] = self._nova({"tipo": tipo, "texto": valor}, chaves_ordenadas)
+            # Mesmo protocolos sem votos contam um pouco (autores com muitos protocolos sobem)
+            self._pesos[numero] += peso + 0.1
+
+    def adicionar(self, protocolo: dict):
+        """Inclui um protocolo acabado de guardar"""
+        with self._lock:
+            self._adicionar(protocolo)
+            if self._a_reconstruir:
+                self._adicionados_durante_reconstrucao.append(protocolo)
+
+    def iniciar_reconstrucao(self):
+        """Chamado antes de percorrer o catálogo, se os protocolos só chegarem a reconstruir() depois"""
+        with self._lock:
+            self._a_reconstruir = True
+            self._adicionados_durante_reconstrucao = []
+
+    def reconstruir(self, protocolos):
+        """Reconstrói o índice (e os pesos) a partir de um iterável de protocolos"""
+        with self._lock:
+            if not self._a_reconstruir:
+                self.iniciar_reconstrucao()
+        novo = IndiceSugestoes()
+        try:
+            for protocolo in protocolos:
+                novo._adicionar(protocolo, chaves_ordenadas=False)
+        except Exception:
+            with self._lock:
+                self._a_reconstruir = False
+            raise
+        novo._chaves.sort()
+        with self._lock:
+            # Reaplicar o que foi guardado enquanto o catálogo era percorrido
+            for protocolo in self._adicionados_durante_reconstrucao:
+                novo._adicionar(protocolo)
+            self._a_reconstruir = False
+            self._adicionados_durante_reconstrucao = []
+            self._chaves = novo._chaves
+            self._sugestoes = novo._sugestoes
+            self._pesos = novo._pesos
+            self._agregadas = novo._agregadas
+            self._titulos = novo._titulos
+            self.construido_em = time.time()
+
+    def sugerir(self, consulta, limite=8):
+        """As `limite` sugestões mais populares cujo texto (ou uma palavra dele) começa pela consulta"""
+        prefixo = _texto(consulta)
+        if not prefixo:
+            return []
+        with self._lock:
+            inicio = bisect.bisect_left(self._chaves, (prefixo,))
+            fim = bisect.bisect_left(self._chaves, (prefixo + "￿",), inicio, min(len(self._chaves), inicio + MAX_CANDIDATOS))
+            numeros = {numero for _, numero in self._chaves[inicio:fim]}
+            melhores = heapq.nlargest(limite, numeros, key=lambda n: (self._pesos[n], -n))
+            return [dict(self._sugestoes[n]) for n in melhores]
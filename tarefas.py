@@ -0,0 +1,245 @@
+"""Fila de tarefas assíncronas (geração de protocolos) com um pool limitado de threads"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+PENDENTE = "pendente"
+A_EXECUTAR = "a_executar"
+CONCLUIDA = "concluida"
+ERRO = "erro"
+CANCELADA = "cancelada"
+EXPIRADA = "expirada"
+
+ESTADOS_FINAIS = (CONCLUIDA, ERRO, CANCELADA, EXPIRADA)
+
+# Campos de uma tarefa no registo partilhado (ver armazenamento.py)
+CAMPOS_REGISTO = ("id", "tipo", "estado", "criada_em", "iniciada_em", "terminada_em", "resultado", "erro")
+
+
+class FilaCheiaErro(Exception):
+    """A fila atingiu o número máximo de tarefas em espera"""
+
+
+class Tarefa:
+    """Uma tarefa submetida ao gestor, com estado e resultado"""
+
+    def __init__(self, tipo):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.estado = PENDENTE
+        self.criada_em = time.time()
+        self.iniciada_em = None
+        self.terminada_em = None
+        self.resultado = None
+        self.erro = None
+        self.future = None
+        # Se está no registo partilhado (a criação pode ter falhado ou não haver registo)
+        self.partilhada = False
+
+    @classmethod
+    def de_registo(cls, linha):
+        """Tarefa lida do registo partilhado (possivelmente a correr noutro worker)"""
+        tarefa = cls(linha["tipo"])
+        for campo in CAMPOS_REGISTO:
+            setattr(tarefa, campo, linha.get(campo))
+        return tarefa
+
+    def para_registo(self):
+        return {campo: getattr(self, campo) for campo in CAMPOS_REGISTO}
+
+    def para_dict(self):
+        dados = {
+            "job_id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "criada_em": self.criada_em,
+            "iniciada_em": self.iniciada_em,
+            "terminada_em": self.terminada_em,
+        }
+        if self.estado == CONCLUIDA:
+            dados["resultado"] = self.resultado
+        if self.erro:
+            dados["erro"] = self.erro
+        return dados
+
+
+class GestorTarefas:
+    """Executa tarefas num pool limitado, com limite de fila, timeout, expiração e cancelamento
+
+    Com `registo` (o armazenamento: criar_tarefa, atualizar_tarefa, obter_tarefa, apagar_tarefas)
+    o estado de cada tarefa é também escrito na base de dados, e é de lá que é lido: com vários
+    workers, a consulta ou o cancelamento podem chegar a um worker que não tem a tarefa. Se o
+    registo falhar, a tarefa continua a correr e a ser consultada no worker que a recebeu.
+    """
+
+    def __init__(self, max_workers=4, max_pendentes=20, timeout=180, expiracao=3600, registo=None):
+        self.max_workers = max_workers
+        self.max_pendentes = max_pendentes
+        self.timeout = timeout
+        self.expiracao = expiracao
+        self.registo = registo
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tarefa")
+        self._tarefas = {}
+        self._lock = threading.Lock()
+        self._limpo_em = 0.0
+
+    def _registar(self, operacao, *args):
+        """Chama o registo partilhado; None se não houver registo ou se a chamada falhar"""
+        if self.registo is None:
+            return None
+        try:
+            return getattr(self.registo, operacao)(*args)
+        except Exception as e:
+            log.warning("registo de tarefas falhou operacao=%s erro=%s", operacao, e)
+            return None
+
+    def _registar_alteracao(self, tarefa, alteracoes, estados):
+        """Altera a tarefa no registo se o estado registado for um de `estados`
+
+        Retorna False se não era (ex.: cancelada noutro worker), None se não se sabe.
+        """
+        if not tarefa.partilhada:
+            return None
+        return self._registar("atualizar_tarefa", tarefa.id, alteracoes, estados)
+
+    def _ativas(self):
+        return sum(1 for t in self._tarefas.values() if t.estado in (PENDENTE, A_EXECUTAR))
+
+    def _expirar(self, tarefa, agora):
+        """Marca a tarefa como expirada se excedeu o timeout; True se o fez"""
+        # Pendente há mais tempo do que a expiração: o worker que a tinha já não existe
+        if (tarefa.estado == A_EXECUTAR and agora - tarefa.iniciada_em > self.timeout) or \
+                (tarefa.estado == PENDENTE and agora - tarefa.criada_em > self.expiracao):
+            tarefa.estado = EXPIRADA
+            tarefa.erro = f"Tempo limite excedido ({self.timeout}s)"
+            tarefa.terminada_em = agora
+            return True
+        return False
+
+    def _esquecida(self, tarefa, agora):
+        return tarefa.estado in ESTADOS_FINAIS and agora - tarefa.terminada_em > self.expiracao
+
+    def _executar(self, tarefa, funcao, args, kwargs):
+        with self._lock:
+            if tarefa.estado != PENDENTE:
+                return
+            tarefa.estado = A_EXECUTAR
+            tarefa.iniciada_em = time.time()
+        inicio = {"estado": A_EXECUTAR, "iniciada_em": tarefa.iniciada_em}
+        if self._registar_alteracao(tarefa, inicio, (PENDENTE,)) is False:
+            # Cancelada noutro worker enquanto esperava na fila
+            with self._lock:
+                tarefa.estado = CANCELADA
+                tarefa.terminada_em = time.time()
+            return
+        try:
+            resultado = funcao(*args, **kwargs)
+            erro = None
+        except Exception as e:
+            resultado = None
+            erro = f"{type(e).__name__}: {e}"
+        with self._lock:
+            # Cancelada ou expirada entretanto: o resultado é descartado
+            if tarefa.estado != A_EXECUTAR:
+                return
+        fim = {"estado": ERRO, "erro": erro} if erro else {"estado": CONCLUIDA, "resultado": resultado}
+        fim["terminada_em"] = time.time()
+        registada = self._registar_alteracao(tarefa, fim, (A_EXECUTAR,))
+        with self._lock:
+            if tarefa.estado != A_EXECUTAR:
+                return
+            if registada is False:
+                # Cancelada (ou dada como expirada) noutro worker: prevalece o estado registado
+                tarefa.estado = CANCELADA
+                tarefa.terminada_em = fim["terminada_em"]
+                return
+            for campo, valor in fim.items():
+                setattr(tarefa, campo, valor)
+
+    def _atualizar(self, agora):
+        """Marca tarefas que excederam o timeout e esquece as terminadas há mais tempo que a expiração
+
+        Retorna as que expiraram agora, para registar fora do lock.
+        """
+        expiradas = []
+        for id, tarefa in list(self._tarefas.items()):
+            if self._expirar(tarefa, agora):
+                expiradas.append(tarefa)
+            elif self._esquecida(tarefa, agora):
+                del self._tarefas[id]
+        return expiradas
+
+    def _registar_expiradas(self, expiradas):
+        for tarefa in expiradas:
+            alteracoes = {"estado": EXPIRADA, "erro": tarefa.erro, "terminada_em": tarefa.terminada_em}
+            self._registar_alteracao(tarefa, alteracoes, (PENDENTE, A_EXECUTAR))
+
+    def _limpar_registo(self, agora):
+        # No máximo uma vez por minuto; as linhas apagadas já não podiam ser consultadas
+        # (pendente + execução + expiração do resultado)
+        if agora - self._limpo_em > 60:
+            self._limpo_em = agora
+            self._registar("apagar_tarefas", agora - 2 * self.expiracao - self.timeout)
+
+    def submeter(self, tipo, funcao, *args, **kwargs):
+        """Coloca uma tarefa na fila e retorna-a imediatamente (FilaCheiaErro se a fila estiver cheia)"""
+        tarefa = Tarefa(tipo)
+        agora = time.time()
+        with self._lock:
+            expiradas = self._atualizar(agora)
+            # O limite é o deste worker: cada um tem o seu pool
+            cheia = self._ativas() >= self.max_workers + self.max_pendentes
+            if not cheia:
+                self._tarefas[tarefa.id] = tarefa
+        self._registar_expiradas(expiradas)
+        if cheia:
+            raise FilaCheiaErro(f"Demasiadas tarefas em curso ({self.max_workers + self.max_pendentes})")
+        self._limpar_registo(agora)
+        tarefa.partilhada = self._registar("criar_tarefa", tarefa.para_registo()) is not None
+        tarefa.future = self._executor.submit(self._executar, tarefa, funcao, args, kwargs)
+        return tarefa
+
+    def obter(self, id):
+        """Retorna a tarefa (ou None se não existir ou já tiver expirado)"""
+        agora = time.time()
+        with self._lock:
+            expiradas = self._atualizar(agora)
+            local = self._tarefas.get(id)
+        self._registar_expiradas(expiradas)
+        linha = self._registar("obter_tarefa", id)
+        if not linha:
+            return local
+        tarefa = Tarefa.de_registo(linha)
+        # O worker que a tinha pode ter terminado sem a dar como expirada
+        self._expirar(tarefa, agora)
+        return None if self._esquecida(tarefa, agora) else tarefa
+
+    def cancelar(self, id):
+        """Cancela uma tarefa pendente ou em execução; retorna False se já tiver terminado"""
+        agora = time.time()
+        cancelada = False
+        with self._lock:
+            tarefa = self._tarefas.get(id)
+            if tarefa and tarefa.estado not in ESTADOS_FINAIS:
+                # Em execução não é possível interromper a thread: o resultado será ignorado
+                if tarefa.future:
+                    tarefa.future.cancel()
+                tarefa.estado = CANCELADA
+                tarefa.terminada_em = agora
+                cancelada = True
+        # Também no registo: a tarefa pode estar noutro worker, que o lê antes de começar e ao terminar
+        alteracoes = {"estado": CANCELADA, "terminada_em": agora}
+        return self._registar("atualizar_tarefa", id, alteracoes, (PENDENTE, A_EXECUTAR)) or cancelada
+
+    def profundidade(self):
+        """Número de tarefas pendentes ou em execução neste worker"""
+        with self._lock:
+            return self._ativas()
+
+    def encerrar(self):
+        """Cancela as tarefas em espera e aguarda as que estão em execução"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,124 @@
+"""Exportação e importação do catálogo em NDJSON (um protocolo por linha), em streaming"""
+import hashlib
+import json
+import os
+import time
+
+from pesquisa import normalizar
+from registos import criar_registo
+from estatisticas import CONTADORES
+
+
+def linhas_ndjson(protocolos):
+    """Gera uma linha NDJSON por protocolo, sem materializar o catálogo"""
+    for protocolo in protocolos:
+        yield json.dumps(protocolo, ensure_ascii=False, default=str) + "\n"
+
+
+def chave_duplicado(protocolo):
+    """Identidade de um protocolo para efeitos de deduplicação: título, resumo e autor normalizados"""
+    partes = [" ".join(normalizar(protocolo.get(c) or "").split()) for c in ("titulo", "resumo", "autor")]
+    return hashlib.sha1("\x1f".join(partes).encode()).hexdigest()
+
+
+def validar_protocolo(dados):
+    """Valida uma linha importada; lança ValueError com o motivo se for inválida"""
+    if not isinstance(dados, dict):
+        raise ValueError("não é um objeto JSON")
+    if not isinstance(dados.get("titulo"), str) or not dados["titulo"].strip():
+        raise ValueError("titulo em falta")
+    for campo in CONTADORES:
+        valor = dados.get(campo)
+        if valor is not None and (not isinstance(valor, int) or valor < 0):
+            raise ValueError(f"{campo} inválido")
+    id = dados.get("id")
+    if id is not None and (not isinstance(id, int) or id <= 0):
+        raise ValueError("id inválido")
+
+
+def registo_importado(dados, manter_ids=False, comprimir_bytes=0):
+    """Registo a inserir a partir de um protocolo exportado (mantém created_at e contadores)"""
+    registo = criar_registo(dados, comprimir_bytes)
+    for campo in CONTADORES:
+        registo[campo] = dados.get(campo) or 0
+    if dados.get("created_at"):
+        registo["created_at"] = dados["created_at"]
+    if manter_ids and dados.get("id"):
+        registo["id"] = dados["id"]
+    return registo
+
+
+class Checkpoint:
+    """Progresso de uma importação, gravado atomicamente após cada lote para poder retomar"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def carregar(self):
+        if not self.caminho or not os.path.exists(self.caminho):
+            return {}
+        with open(self.caminho, encoding="utf-8") as f:
+            return json.load(f)
+
+    def guardar(self, estado):
+        if not self.caminho:
+            return
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(estado, f)
+        os.replace(temporario, self.caminho)
+
+    def remover(self):
+        if self.caminho and os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+
+def importar_ndjson(ficheiro, inserir_varios, existentes=(), lote=500, checkpoint=None,
+                    manter_ids=False, comprimir_bytes=0, relatar=print):
+    """Importa um ficheiro NDJSON: valida, ignora duplicados e insere em lotes
+
+    existentes: chaves (chave_duplicado) dos protocolos já no destino.
+    Retorna o estado final: linhas lidas, inseridos, duplicados, inválidos.
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    estado = {"linha": 0, "inseridos": 0, "duplicados": 0, "invalidos": 0, **checkpoint.carregar()}
+    if estado["linha"]:
+        relatar(f"↪️ A retomar a partir da linha {estado['linha'] + 1}")
+    vistos = set(existentes)
+    pendentes = []
+    inicio = time.time()
+
+    def descarregar(numero_linha):
+        if pendentes:
+            inserir_varios(pendentes)
+            estado["inseridos"] += len(pendentes)
+            pendentes.clear()
+        estado["linha"] = numero_linha
+        checkpoint.guardar(estado)
+        ritmo = estado["inseridos"] / max(time.time() - inicio, 1e-6)
+        relatar(f"📥 linha {numero_linha}: {estado['inseridos']} inseridos, {estado['duplicados']} duplicados, "
+                f"{estado['invalidos']} inválidos ({ritmo:.0f}/s)")
+
+    numero_linha = 0
+    for numero_linha, linha in enumerate(ficheiro, start=1):
+        if numero_linha <= estado["linha"]:
+            continue
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+            validar_protocolo(dados)
+        except ValueError as e:
+            estado["invalidos"] += 1
+            relatar(f"⚠️ Linha {numero_linha} inválida: {e}")
+            continue
+        chave = chave_duplicado(dados)
+        if chave in vistos:
+            estado["duplicados"] += 1
+            continue
+        vistos.add(chave)
+        pendentes.append(registo_importado(dados, manter_ids, comprimir_bytes))
+        if len(pendentes) >= lote:
+            descarregar(numero_linha)
+    descarregar(max(numero_linha, estado["linha"]))
+    return estado
@@ -0,0 +1,253 @@
+"""Leitura tolerante do JSON gerado pela IA e validação das secções de um protocolo"""
+import json
+
+from seccoes import SECCOES_PROTOCOLO
+
+SECCOES_TEXTO = (
+    "titulo", "subtitulo", "duracao", "contextualizacao", "resumo", "materiais",
+    "pre_experiencia", "procedimento", "pos_experiencia", "resultados_esperados",
+)
+SECCOES_LISTA = ("competencias", "objetivos", "recursos_extras")
+CHAVES_SEGURANCA = ("nivel_risco", "riscos", "epi", "supervisao", "cuidados", "primeiros_socorros", "descarte")
+NIVEIS_RISCO = {"baixo": "Baixo", "medio": "Médio", "médio": "Médio", "alto": "Alto"}
+CHAVES_DIFERENCIACAO = ("simplificacao", "aprofundamento", "inclusao")
+# Campos obrigatórios de cada tipo de pergunta (os que o template do protocolo usa)
+CAMPOS_QUIZ = {
+    "multipla_escolha": ("pergunta", "opcoes", "resposta_correta"),
+    "verdadeiro_falso": ("afirmacao", "resposta_correta"),
+    "aberta": ("pergunta", "resposta_sugerida"),
+}
+VERDADEIRO = {"true", "verdadeiro", "v", "sim"}
+FALSO = {"false", "falso", "f", "nao", "não"}
+
+# Formato de cada secção, para voltar a pedir só as que vieram mal
+FORMATO_SECCOES = {
+    **{seccao: "texto" for seccao in SECCOES_TEXTO},
+    **{seccao: "lista de textos" for seccao in SECCOES_LISTA},
+    "seguranca": 'objeto com nivel_risco ("Baixo", "Médio" ou "Alto"), riscos, epi, supervisao, '
+                 "cuidados, primeiros_socorros e descarte (textos)",
+    "quiz": 'lista de 5 perguntas: {"tipo": "multipla_escolha", "pergunta", "opcoes": ["A) ...", ...], '
+            '"resposta_correta": "B", "explicacao"}, {"tipo": "verdadeiro_falso", "afirmacao", '
+            '"resposta_correta": true/false, "explicacao"} ou {"tipo": "aberta", "pergunta", "resposta_sugerida"}',
+    "diferenciacao": "objeto com simplificacao, aprofundamento e inclusao (listas de textos)",
+}
+
+# Tentativas de corte ao reparar uma resposta truncada
+MAX_CORTES = 50
+
+
+def extrair_objeto_json(texto):
+    """O objeto JSON mais exterior do texto (sem markdown nem prosa à volta), ou None
+
+    Se a resposta foi truncada, retorna tudo desde a primeira chaveta.
+    """
+    inicio = (texto or "").find("{")
+    if inicio == -1:
+        return None
+    profundidade = 0
+    em_string = escape = False
+    for i in range(inicio, len(texto)):
+        c = texto[i]
+        if em_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                em_string = False
+        elif c == '"':
+            em_string = True
+        elif c in "{[":
+            profundidade += 1
+        elif c in "}]":
+            profundidade -= 1
+            if profundidade == 0:
+                return texto[inicio:i + 1]
+    return texto[inicio:]
+
+
+def _analisar(texto):
+    """Retira vírgulas antes de } e ] e regista onde se pode cortar uma resposta truncada
+
+    Retorna (texto sem vírgulas finais, [(posição de corte, pilha aberta nesse ponto)], pilha final,
+    se o texto acaba dentro de uma string).
+    """
+    saida = []
+    cortes = []
+    pilha = []
+    em_string = escape = False
+    n = len(texto)
+    for i, c in enumerate(texto):
+        if em_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                em_string = False
+        elif c == '"':
+            em_string = True
+        elif c in "{[":
+            pilha.append("}" if c == "{" else "]")
+            saida.append(c)
+            cortes.append((len(saida), list(pilha)))
+            continue
+        elif c in "}]":
+            if pilha:
+                pilha.pop()
+        elif c == ",":
+            j = i + 1
+            while j < n and texto[j].isspace():
+                j += 1
+            if j == n or texto[j] in "}]":
+                continue
+            # Cortar aqui descarta o membro seguinte, possivelmente incompleto
+            cortes.append((len(saida), list(pilha)))
+        saida.append(c)
+    return "".join(saida), cortes, pilha, em_string
+
+
+def _fechar(texto, pilha):
+    return texto.rstrip().rstrip(",") + "".join(reversed(pilha))
+
+
+def interpretar_json(texto):
+    """Lê um objeto JSON da resposta do modelo, reparando as falhas habituais
+
+    Ignora markdown e prosa à volta, aceita quebras de linha dentro de strings, retira vírgulas
+    finais e, numa resposta truncada (max_tokens), descarta o último membro incompleto e fecha
+    as chavetas e parênteses em aberto. Lança ValueError se não houver objeto aproveitável.
+    """
+    objeto = extrair_objeto_json(texto)
+    if objeto is None:
+        raise ValueError("Resposta sem objeto JSON")
+    try:
+        resultado = json.loads(objeto, strict=False)
+        if isinstance(resultado, dict):
+            return resultado
+    except ValueError:
+        pass
+    limpo, cortes, pilha, em_string = _analisar(objeto)
+    candidatos = [] if em_string else [_fechar(limpo, pilha)]
+    candidatos += [_fechar(limpo[:posicao], aberta) for posicao, aberta in reversed(cortes[-MAX_CORTES:])]
+    for candidato in candidatos:
+        try:
+            resultado = json.loads(candidato, strict=False)
+        except ValueError:
+            continue
+        if isinstance(resultado, dict):
+            return resultado
+    raise ValueError("JSON da resposta irrecuperável")
+
+
+def _texto(valor):
+    if isinstance(valor, list):
+        valor = "\n".join(str(v).strip() for v in valor if isinstance(v, (str, int, float)) and str(v).strip())
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        valor = str(valor)
+    return valor.strip() if isinstance(valor, str) and valor.strip() else None
+
+
+def _lista(valor):
+    if isinstance(valor, str):
+        valor = [valor]
+    if not isinstance(valor, list):
+        return None
+    itens = []
+    for item in valor:
+        if isinstance(item, dict):
+            # {"titulo": ..., "url": ...} -> "titulo — url"
+            item = " — ".join(str(v).strip() for v in item.values() if isinstance(v, (str, int, float)) and str(v).strip())
+        item = _texto(item)
+        if item:
+            itens.append(item)
+    return itens or None
+
+
+def _seguranca(valor):
+    if not isinstance(valor, dict):
+        return None
+    seguranca = {chave: _texto(valor.get(chave)) for chave in CHAVES_SEGURANCA}
+    if not all(seguranca.values()):
+        return None
+    nivel = NIVEIS_RISCO.get(seguranca["nivel_risco"].lower())
+    if nivel is None:
+        return None
+    seguranca["nivel_risco"] = nivel
+    return seguranca
+
+
+def _pergunta(item):
+    if not isinstance(item, dict) or item.get("tipo") not in CAMPOS_QUIZ:
+        return None
+    pergunta = dict(item)
+    tipo = item["tipo"]
+    for campo in CAMPOS_QUIZ[tipo]:
+        if campo == "opcoes":
+            opcoes = _lista(item.get("opcoes"))
+            if not opcoes or len(opcoes) < 2:
+                return None
+            pergunta["opcoes"] = opcoes
+        elif campo == "resposta_correta" and tipo == "verdadeiro_falso":
+            resposta = item.get("resposta_correta")
+            if isinstance(resposta, str):
+                resposta = True if resposta.strip().lower() in VERDADEIRO else \
+                    False if resposta.strip().lower() in FALSO else None
+            if not isinstance(resposta, bool):
+                return None
+            pergunta["resposta_correta"] = resposta
+        elif campo == "resposta_correta":
+            # "B) ..." ou "b" -> "B": o template compara com a primeira letra da opção
+            resposta = _texto(item.get("resposta_correta"))
+            if not resposta or not resposta[0].isalpha():
+                return None
+            pergunta["resposta_correta"] = resposta[0].upper()
+        else:
+            valor = _texto(item.get(campo))
+            if not valor:
+                return None
+            pergunta[campo] = valor
+    return pergunta
+
+
+def _quiz(valor):
+    if not isinstance(valor, list):
+        return None
+    # Perguntas mal formadas são descartadas; a secção só é inválida se não sobrar nenhuma
+    perguntas = [p for p in map(_pergunta, valor) if p]
+    return perguntas or None
+
+
+def _diferenciacao(valor):
+    if not isinstance(valor, dict):
+        return None
+    diferenciacao = {chave: _lista(valor.get(chave)) for chave in CHAVES_DIFERENCIACAO}
+    return diferenciacao if all(diferenciacao.values()) else None
+
+
+_VALIDADORES = {
+    **{seccao: _texto for seccao in SECCOES_TEXTO},
+    **{seccao: _lista for seccao in SECCOES_LISTA},
+    "seguranca": _seguranca,
+    "quiz": _quiz,
+    "diferenciacao": _diferenciacao,
+}
+
+
+def validar_protocolo(protocolo, seccoes=SECCOES_PROTOCOLO):
+    """Normaliza as secções indicadas de um protocolo gerado
+
+    Retorna (secções válidas, já normalizadas, pela ordem do prompt; lista das secções em
+    falta ou inválidas). Correções pequenas (texto em lista, "verdadeiro" em vez de true,
+    nível de risco sem acento) são feitas aqui em vez de voltar a pedir a secção.
+    """
+    protocolo = protocolo if isinstance(protocolo, dict) else {}
+    validas = {}
+    invalidas = []
+    for seccao in seccoes:
+        valor = _VALIDADORES[seccao](protocolo.get(seccao))
+        if valor is None:
+            invalidas.append(seccao)
+        else:
+            validas[seccao] = valor
+    return validas, invalidas
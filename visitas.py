@@ -0,0 +1,117 @@
+"""Visualizações únicas: um visitante conta uma vez por protocolo e janela de tempo, com memória limitada"""
+import hashlib
+import math
+import re
+import threading
+import time
+
+# User-Agents de crawlers e de pré-visualizações de links (WhatsApp, Facebook, Slack, ...)
+PADRAO_BOTS = (
+    r"bot|crawl|spider|slurp|preview|facebookexternalhit|whatsapp|telegram|slack|discord"
+    r"|embedly|vkshare|pinterest|lighthouse|headless|monitor|uptime"
+)
+
+
+def criar_filtro_bots(padrao=None):
+    """Função user_agent -> True se o pedido deve ser ignorado (sem User-Agent também conta como bot)
+
+    `padrao` é uma expressão regular (sem distinção de maiúsculas); "" desliga o filtro.
+    """
+    if padrao == "":
+        return lambda user_agent: False
+    expressao = re.compile(padrao or PADRAO_BOTS, re.IGNORECASE)
+    return lambda user_agent: not user_agent or expressao.search(user_agent) is not None
+
+
+class FiltroBloom:
+    """Conjunto aproximado de tamanho fixo: sem falsos negativos, falsos positivos ~ `taxa_erro`"""
+
+    def __init__(self, capacidade, taxa_erro=0.001):
+        self.capacidade = capacidade
+        bits = max(64, int(-capacidade * math.log(taxa_erro) / math.log(2) ** 2))
+        self.hashes = max(1, round(bits / capacidade * math.log(2)))
+        self.bits = bits
+        self.elementos = 0
+        self._bytes = bytearray((bits + 7) // 8)
+
+    @property
+    def tamanho_bytes(self):
+        return len(self._bytes)
+
+    def _posicoes(self, chave: bytes):
+        # Hashing duplo (Kirsch-Mitzenmacher): k posições a partir de dois hashes de 64 bits
+        digest = hashlib.blake2b(chave, digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "little")
+        b = int.from_bytes(digest[8:], "little") | 1
+        return [(a + i * b) % self.bits for i in range(self.hashes)]
+
+    def contem(self, chave: bytes):
+        return all(self._bytes[p >> 3] & (1 << (p & 7)) for p in self._posicoes(chave))
+
+    def adicionar(self, chave: bytes):
+        """Adiciona a chave; retorna False se (provavelmente) já lá estava"""
+        nova = False
+        for p in self._posicoes(chave):
+            mascara = 1 << (p & 7)
+            if not self._bytes[p >> 3] & mascara:
+                self._bytes[p >> 3] |= mascara
+                nova = True
+        if nova:
+            self.elementos += 1
+        return nova
+
+
+class VisitasUnicas:
+    """Deduplicação de (visitante, protocolo) com dois filtros de Bloom em rotação
+
+    Uma visita repetida é ignorada enquanto estiver no filtro atual ou no anterior, ou seja,
+    durante entre `janela` e 2 × `janela` segundos. Se o filtro atual encher antes do fim da
+    janela, roda mais cedo: a memória e a taxa de falsos positivos ficam fixas e, sob muito
+    tráfego, a janela encurta (conta-se a mais, nunca a menos por excesso de memória).
+    A memória é 2 × o tamanho de um filtro para `capacidade` visitas, independente do catálogo.
+    """
+
+    def __init__(self, janela=1800, capacidade=100_000, taxa_erro=0.001, e_bot=None):
+        self.janela = janela
+        self.capacidade = capacidade
+        self.taxa_erro = taxa_erro
+        self.e_bot = e_bot or criar_filtro_bots()
+        self.unicas = 0
+        self.repetidas = 0
+        self.bots = 0
+        self._lock = threading.Lock()
+        self._atual = FiltroBloom(capacidade, taxa_erro)
+        self._anterior = FiltroBloom(capacidade, taxa_erro)
+        self._rodado_em = time.monotonic()
+
+    @property
+    def tamanho_bytes(self):
+        return self._atual.tamanho_bytes + self._anterior.tamanho_bytes
+
+    def _rodar_se_preciso(self):
+        agora = time.monotonic()
+        if agora - self._rodado_em >= self.janela or self._atual.elementos >= self.capacidade:
+            self._anterior = self._atual
+            self._atual = FiltroBloom(self.capacidade, self.taxa_erro)
+            self._rodado_em = agora
+
+    def marcar(self, visitante: str, id):
+        """Dá a visita como já contada (sem a contar), ex.: para outra identidade do mesmo visitante"""
+        with self._lock:
+            self._rodar_se_preciso()
+            self._atual.adicionar(f"{visitante}\x00{id}".encode())
+
+    def registar(self, visitante: str, id, user_agent=None):
+        """True se a visita deve contar (primeira deste visitante a este protocolo na janela)"""
+        if self.e_bot(user_agent):
+            with self._lock:
+                self.bots += 1
+            return False
+        chave = f"{visitante}\x00{id}".encode()
+        with self._lock:
+            self._rodar_se_preciso()
+            if self._anterior.contem(chave) or not self._atual.adicionar(chave):
+                self.repetidas += 1
+                return False
+            self.unicas += 1
+            return True